@@ -1,43 +1,210 @@
 #!/usr/bin/env python3
 """
 Flask Web Application for RemNote Flashcard Generator
+
+Use ``create_app()`` to build the application. For production, run it under
+a multi-worker WSGI server, e.g. ``gunicorn -c gunicorn.conf.py wsgi:app``;
+worker processes share their result cache, rate limiter and job store
+through a SQLite database.
 """
 
 import os
 import sys
+import atexit
 import tempfile
 import shutil
 from pathlib import Path
-import zipfile
-from flask import Flask, render_template, request, jsonify
+from flask import Blueprint, Flask, Response, current_app, render_template, request, jsonify, stream_with_context
 from werkzeug.utils import secure_filename
-import google.generativeai as genai
-from dotenv import load_dotenv
-from generate_flashcards import process_file, REMNOTE_PROMPT_TEMPLATE
+from lazy_import import lazy_module
+from generate_flashcards import REMNOTE_PROMPT_TEMPLATE, DEFAULT_PROMPT_NAME, generate_validated_flashcards
+from prompt_registry import prompt_hash
+from validation import NO_CARDS_ERROR, summarize_stats
+from single_flight import SingleFlight
+from retry_policy import RetryPolicy, classify_error
+from cancellation import CancelToken, Cancelled
+from worker_pool import FairWorkerPool
+from shared_state import SharedState, file_hash, result_cache_key
+from export import stream_zip, stream_ndjson, stream_text
+from pdf_text import TextCache
+from profiling import Profiler, span
+import uuid
 import threading
 import queue
 import time
 import logging
 from datetime import datetime
 import concurrent.futures
-import re
-
-# Load environment variables from .env file
-load_dotenv()
-
-# Configure comprehensive logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('flashcard_generator.log'),
-        logging.StreamHandler(sys.stdout)
-    ]
-)
+
 logger = logging.getLogger(__name__)
 
-app = Flask(__name__)
-app.config['MAX_CONTENT_LENGTH'] = 100 * 1024 * 1024  # 100MB max file size
+# The Gemini SDK is imported by the first generation, not at startup, so
+# workers boot fast and health checks never load it
+genai = lazy_module('google.generativeai')
+dotenv = lazy_module('dotenv')
+
+bp = Blueprint('flashcards', __name__)
+
+# Results are keyed by prompt content hash. Custom prompts are not given
+# names or versions: every distinct text is simply a different hash
+DEFAULT_PROMPT_HASH = prompt_hash(REMNOTE_PROMPT_TEMPLATE)
+
+# Identical uploads (same file content and prompt) in flight in this process
+# share one upload and generation across all concurrent requests; markers in
+# the shared state extend this to the other worker processes
+inflight = SingleFlight()
+
+def configure_logging(log_file):
+    """Configure comprehensive logging once per process"""
+    root = logging.getLogger()
+    if getattr(root, '_flashcards_configured', False):
+        return
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(process)d - %(name)s - %(levelname)s - %(message)s',
+        handlers=[
+            logging.FileHandler(log_file),
+            logging.StreamHandler(sys.stdout)
+        ]
+    )
+    root._flashcards_configured = True
+
+def load_config():
+    """Build the default configuration from environment variables"""
+    return {
+        'MAX_CONTENT_LENGTH': 100 * 1024 * 1024,  # 100MB max file size
+        # Worker threads per process shared by all requests
+        'MAX_WORKERS': int(os.getenv('FLASHCARD_MAX_WORKERS', '5')),
+        # API requests per minute across all processes (0 disables the limiter)
+        'REQUESTS_PER_MINUTE': int(os.getenv('FLASHCARD_REQUESTS_PER_MINUTE', '0')),
+        # SQLite database shared by all worker processes (defaults to the instance folder)
+        'STATE_DB': os.getenv('FLASHCARD_STATE_DB'),
+        # Days cached results and finished jobs are kept in it (0 keeps them forever)
+        'CACHE_RETENTION_DAYS': float(os.getenv('FLASHCARD_CACHE_RETENTION_DAYS', '30')),
+        'JOB_RETENTION_DAYS': float(os.getenv('FLASHCARD_JOB_RETENTION_DAYS', '7')),
+        # Text extracted from PDFs, keyed by content hash (defaults to the instance folder)
+        'TEXT_CACHE_DIR': os.getenv('FLASHCARD_TEXT_CACHE_DIR'),
+        'LOG_FILE': os.getenv('FLASHCARD_LOG_FILE', 'flashcard_generator.log'),
+        # Retry policy for API calls
+        'RETRY_MAX_ATTEMPTS': int(os.getenv('FLASHCARD_RETRY_MAX_ATTEMPTS', '4')),
+        'RETRY_ATTEMPT_TIMEOUT': float(os.getenv('FLASHCARD_RETRY_ATTEMPT_TIMEOUT', '300')),
+        'RETRY_HEDGE': os.getenv('FLASHCARD_RETRY_HEDGE', '0') == '1',
+        # Record span traces and sampled stacks in each worker process
+        'PROFILE': os.getenv('FLASHCARD_PROFILE', '0') == '1',
+        # Where each process writes its profile on shutdown (defaults to the instance folder)
+        'PROFILE_DIR': os.getenv('FLASHCARD_PROFILE_DIR'),
+    }
+
+def create_app(config=None):
+    """Application factory"""
+    # Load environment variables from .env file
+    dotenv.load_dotenv()
+    
+    app = Flask(__name__)
+    app.config.update(load_config())
+    if config:
+        app.config.update(config)
+    
+    configure_logging(app.config['LOG_FILE'])
+    
+    state_db = app.config['STATE_DB'] or os.path.join(app.instance_path, 'flashcard_state.sqlite3')
+    text_cache_dir = app.config['TEXT_CACHE_DIR'] or os.path.join(app.instance_path, 'text_cache')
+    
+    # One worker pool for the whole process so concurrent requests share a
+    # global cap on API calls instead of each starting their own threads
+    app.extensions['flashcards'] = {
+        'pool': FairWorkerPool(max_workers=app.config['MAX_WORKERS']),
+        'state': SharedState(state_db,
+                             cache_retention=app.config['CACHE_RETENTION_DAYS'] * 24 * 60 * 60,
+                             job_retention=app.config['JOB_RETENTION_DAYS'] * 24 * 60 * 60),
+        'text_cache': TextCache(text_cache_dir),
+        'policy': RetryPolicy(max_attempts=app.config['RETRY_MAX_ATTEMPTS'],
+                              attempt_timeout=app.config['RETRY_ATTEMPT_TIMEOUT'],
+                              hedge=app.config['RETRY_HEDGE'],
+                              max_in_flight=app.config['MAX_WORKERS']),
+        'cancel_tokens': {},
+        'cancel_lock': threading.Lock(),
+        'profiler': Profiler().start() if app.config['PROFILE'] else None,
+        'draining': False
+    }
+    app.register_blueprint(bp)
+    
+    atexit.register(drain, app)
+    logger.info(f"Application created (pid {os.getpid()}, {app.config['MAX_WORKERS']} workers, state: {state_db})")
+    return app
+
+def drain(app):
+    """Stop accepting batches and wait for in-flight jobs to finish"""
+    services = app.extensions['flashcards']
+    if services['draining']:
+        return
+    services['draining'] = True
+    
+    pool_stats = services['pool'].stats()
+    logger.info(f"Draining worker pool: {pool_stats['running']} running, {pool_stats['queued']} queued")
+    services['pool'].shutdown(wait=True)
+    services['state'].interrupt_jobs(os.getpid())
+    logger.info("Worker pool drained")
+    
+    # Each worker process writes its own profile
+    profiler = services['profiler']
+    if profiler is not None:
+        profiler.stop()
+        profile_dir = app.config['PROFILE_DIR'] or os.path.join(app.instance_path, 'profiles')
+        trace_path, stacks_path = profiler.write(profile_dir, suffix=f"-{os.getpid()}")
+        logger.info(f"Profile written: {trace_path}, {stacks_path}")
+
+def _services():
+    """Return the pool and shared state of the current application"""
+    return current_app.extensions['flashcards']
+
+# Cancel tokens of jobs that finished in another process are forgotten after this long
+CANCEL_TOKEN_TTL = 6 * 60 * 60
+
+def _job_token(services, job):
+    """Return this process's cancel token for a job, creating it on first use
+    
+    The token honours the job's deadline and notices cancellation requests
+    handled by any worker process through the shared job store.
+    """
+    state = services['state']
+    job_id = job['id']
+    with services['cancel_lock']:
+        tokens = services['cancel_tokens']
+        if job_id not in tokens:
+            now = time.time()
+            for stale_id in [key for key, (_, created) in tokens.items() if now - created > CANCEL_TOKEN_TTL]:
+                del tokens[stale_id]
+            
+            deadline = job['info'].get('deadline')
+            remaining = job['created'] + deadline - now if deadline else None
+            token = CancelToken(
+                deadline=remaining if remaining is None or remaining > 0 else None,
+                poll=lambda: (state.get_job(job_id) or {}).get('status') == 'cancelled'
+            )
+            # A deadline that passed before this process saw the job is not restarted
+            if remaining is not None and remaining <= 0:
+                token.cancel('deadline exceeded')
+            tokens[job_id] = (token, now)
+        return tokens[job_id][0]
+
+def _forget_job_token(services, job_id):
+    """Drop a finished job's cancel token"""
+    with services['cancel_lock']:
+        services['cancel_tokens'].pop(job_id, None)
+
+def _parse_deadline(value):
+    """Parse an optional per-batch deadline in seconds"""
+    if not value:
+        return None
+    deadline = float(value)
+    if deadline <= 0:
+        raise ValueError('deadline must be positive')
+    return deadline
+
+def _is_skipped(result):
+    """Whether a stored result is a file skipped by cancellation or the deadline"""
+    return bool(result.get('cancelled')) or (result.get('error') or '').startswith(('Skipped', 'Abandoned'))
 
 # Supported file extensions
 ALLOWED_EXTENSIONS = {'.pdf', '.jpg', '.jpeg', '.png'}
@@ -46,8 +213,23 @@ def allowed_file(filename):
     """Check if file extension is allowed"""
     return Path(filename).suffix.lower() in ALLOWED_EXTENSIONS
 
-def process_single_file(file_path, api_key, output_dir, custom_prompt=None):
-    """Process a single file with optional custom prompt"""
+def process_single_file(file_path, api_key, output_dir, custom_prompt=None, state=None, requests_per_minute=0,
+                        policy=None, cancel=None, text_cache=None):
+    """Process a single file with optional custom prompt
+    
+    When ``state`` is given, results are cached by file content hash and
+    prompt hash, and API requests go through its cross-process rate limiter.
+    API calls are retried under ``policy`` (a RetryPolicy) and abandoned
+    once ``cancel`` (a CancelToken) is cancelled. PDF text layers are sent
+    as text and cached in ``text_cache`` (a TextCache).
+    """
+    with span('process_single_file', file=os.path.basename(file_path)):
+        return _process_single_file(file_path, api_key, output_dir, custom_prompt, state, requests_per_minute,
+                                    policy, cancel, text_cache)
+
+def _process_single_file(file_path, api_key, output_dir, custom_prompt, state, requests_per_minute, policy, cancel,
+                         text_cache):
+    """Body of process_single_file, run inside its profiling span"""
     logger.info(f"Starting to process file: {file_path}")
     
     # Configure the Gemini API
@@ -67,87 +249,383 @@ def process_single_file(file_path, api_key, output_dir, custom_prompt=None):
         "success": False
     }
     
+    # Don't start work for a cancelled batch or one past its deadline
+    if cancel is not None and cancel.cancelled:
+        logger.info(f"⏭️ Skipping {file_name}: {cancel.reason}")
+        result["cancelled"] = True
+        result["error"] = f"Skipped: {cancel.reason}"
+        return result
+    
     # Use custom prompt if provided, otherwise use default
     prompt_to_use = custom_prompt if custom_prompt else REMNOTE_PROMPT_TEMPLATE
-    logger.info(f"Using {'custom' if custom_prompt else 'default'} prompt for {file_name}")
+    digest = prompt_hash(custom_prompt) if custom_prompt else DEFAULT_PROMPT_HASH
+    result["prompt_hash"] = digest
+    logger.info(f"Using {'custom' if custom_prompt else DEFAULT_PROMPT_NAME} prompt ({digest}) for {file_name}")
+    
+    # Reuse a result any worker process already produced for this exact input
+    cache_key = result_cache_key(file_hash(file_path), digest)
+    if state is not None:
+        with span('cache lookup', file=file_name):
+            cached = state.cache_get(cache_key)
+        if cached is not None:
+            with open(output_file, 'w', encoding='utf-8') as f:
+                f.write(cached["content"])
+            result["success"] = True
+            result["cached"] = True
+            result["content"] = cached["content"]
+            result["validation"] = cached.get("validation")
+            logger.info(f"♻️ Using cached flashcards for {file_name}")
+            return result
+    
+    if policy is None:
+        policy = RetryPolicy()
     
-    max_retries = 3
-    retry_count = 0
+    def log_retry(attempt, max_attempts, delay, error, kind):
+        logger.error(f"❌ Error processing {file_name} (attempt {attempt}/{max_attempts}, {kind}): {error}")
+        logger.warning(f"Retrying {file_name} in {delay:.1f}s...")
     
-    while retry_count < max_retries:
+    def rate_limited(fn, *args):
+        # Share the generation quota with every other worker process
+        if state is not None and requests_per_minute:
+            with span('rate limit wait'):
+                waited = state.acquire('gemini', requests_per_minute, cancel)
+            if waited:
+                logger.info(f"Rate limiter delayed {file_name} by {waited:.1f}s")
+        # An attempt abandoned while it waited must not send its request
+        if cancel is not None:
+            cancel.raise_if_cancelled()
+        return fn(*args)
+    
+    def call(fn, *args, operation='generate', weight=None, discard=None):
+        # Every API request (upload, generation, follow-up) is retried on its own
+        if operation != 'upload':
+            args = (fn,) + args
+            fn = rate_limited
+        return policy.call(fn, *args, operation=operation, weight=weight, on_retry=log_retry, cancel=cancel,
+                           discard=discard)
+    
+    def generate():
+        """Generate and cache the flashcards; returns ``(content, validation, from_other_process)``."""
+        if state is not None:
+            # Identical work already running in another worker process: wait for its result
+            cached = state.claim_or_wait(cache_key, cancel)
+            if cached is not None:
+                return cached["content"], cached.get("validation"), True
         try:
-            logger.info(f"Processing attempt {retry_count + 1}/{max_retries}: {file_name}")
-            
-            # Upload the file to Gemini
-            sample_file = genai.upload_file(path=file_path, display_name=file_name)
-            logger.info(f"File uploaded to Gemini: {file_name}")
-            
-            # Generate flashcards using the uploaded document
-            response = model.generate_content([sample_file, prompt_to_use])
+            # Custom prompts may legitimately ask for section headings
+            content, validation = generate_validated_flashcards(file_path, model, prompt_to_use,
+                                                                allow_headers=bool(custom_prompt), cancel=cancel,
+                                                                text_cache=text_cache, call=call)
+            # A response without cards is not cached for other requests
+            if state is not None and validation["valid"]:
+                state.cache_set(cache_key, {"content": content, "validation": validation})
+            return content, validation, False
+        finally:
+            if state is not None:
+                state.release(cache_key)
+    
+    try:
+        # Concurrent identical work items wait for one shared generation,
+        # whether they arrive at this process or at another worker process
+        try:
+            (content, validation, elsewhere), shared = inflight.do(cache_key, generate, cancel=cancel)
+        except Cancelled:
+            # The shared call belonged to another, cancelled batch: run our own
+            if cancel is not None and cancel.cancelled:
+                raise
+            (content, validation, elsewhere), shared = inflight.do(cache_key, generate, cancel=cancel)
+        shared = shared or elsewhere
+        result["coalesced"] = shared
+        if shared:
+            logger.info(f"🔗 Shared in-flight result for {file_name}")
+        else:
             logger.info(f"AI response received for: {file_name}")
-            
-            # Save the generated flashcards to a text file
-            with open(output_file, 'w', encoding='utf-8') as f:
-                f.write(response.text)
-            
-            result["success"] = True
-            result["content"] = response.text
-            
-            logger.info(f"✅ Flashcards saved successfully: {output_file}")
-            
-            # Add a small delay to avoid rate limiting
-            time.sleep(0.5)
+        logger.info(f"Validation for {file_name}: {validation}")
+        result["validation"] = validation
+        
+        # A response without cards (a refusal, an error message) is not saved
+        if not validation["valid"]:
+            logger.error(f"❌ Failed to process {file_name}: {NO_CARDS_ERROR}")
+            result["error"] = NO_CARDS_ERROR
             return result
-            
-        except Exception as e:
-            error_msg = str(e)
-            retry_count += 1
-            logger.error(f"❌ Error processing {file_name} (attempt {retry_count}): {error_msg}")
-            
-            # Check if it's a rate limit error - use original script's sophisticated handling
-            if "429" in error_msg and retry_count < max_retries:
-                # Extract retry delay if available (like original script)
-                retry_delay = 10  # Default delay
-                if "retry_delay" in error_msg:
-                    try:
-                        # Try to extract the retry delay from the error message
-                        delay_str = re.search(r'retry_delay\s*{\s*seconds:\s*(\d+)', error_msg)
-                        if delay_str:
-                            retry_delay = int(delay_str.group(1))
-                    except:
-                        pass
-                
-                logger.warning(f"Rate limit hit for {file_name}, waiting {retry_delay}s before retry...")
-                time.sleep(retry_delay)
-                continue
-            elif retry_count < max_retries:
-                logger.warning(f"Retrying in 2 seconds... (attempt {retry_count + 1}/{max_retries})")
-                time.sleep(2)
-                continue
-            else:
-                logger.error(f"❌ Failed to process {file_name} after {max_retries} attempts")
-                result["error"] = error_msg
-                return result
+        
+        # Save the generated flashcards to a text file
+        with open(output_file, 'w', encoding='utf-8') as f:
+            f.write(content)
+        
+        result["success"] = True
+        result["content"] = content
+        
+        logger.info(f"✅ Flashcards saved successfully: {output_file}")
+        
+        # Add a small delay to avoid rate limiting
+        time.sleep(0.5)
+        
+    except Cancelled as e:
+        logger.info(f"🛑 Abandoned {file_name}: {e}")
+        result["cancelled"] = True
+        result["error"] = f"Abandoned: {e}"
+        
+    except Exception as e:
+        # Fatal error, or retries exhausted
+        logger.error(f"❌ Failed to process {file_name} ({classify_error(e)}): {e}")
+        result["error"] = str(e)
     
     return result
 
-@app.route('/')
+@bp.route('/')
 def index():
     """Render the main web interface"""
     logging.info("📄 Serving main web interface")
     return render_template('index.html', default_prompt=REMNOTE_PROMPT_TEMPLATE)
 
-@app.route('/process_files', methods=['POST'])
+@bp.route('/healthz')
+def healthz():
+    """Lightweight health check for load balancers; never loads the Gemini SDK"""
+    services = _services()
+    status = 'draining' if services['draining'] else 'ok'
+    return jsonify({
+        'status': status,
+        'pid': os.getpid(),
+        'sdk_loaded': 'google.generativeai' in sys.modules
+    }), 503 if services['draining'] else 200
+
+PROFILING_DISABLED = {'error': 'Profiling is disabled; set FLASHCARD_PROFILE=1'}
+
+@bp.route('/profile/trace.json')
+def profile_trace():
+    """Spans recorded so far by this worker process, as Chrome trace-event JSON"""
+    profiler = _services()['profiler']
+    if profiler is None:
+        return jsonify(PROFILING_DISABLED), 404
+    return jsonify(profiler.trace())
+
+@bp.route('/profile/stacks.folded')
+def profile_stacks():
+    """Stack samples recorded so far by this worker process, in folded format"""
+    profiler = _services()['profiler']
+    if profiler is None:
+        return jsonify(PROFILING_DISABLED), 404
+    return Response(profiler.folded_stacks(), mimetype='text/plain')
+
+@bp.route('/queue_status')
+def queue_status():
+    """Report the shared worker pool's queue depth for monitoring"""
+    return jsonify(_services()['pool'].stats())
+
+@bp.route('/jobs/<job_id>')
+def job_status(job_id):
+    """Report a job's progress from the shared job store"""
+    job = _services()['state'].get_job(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job)
+
+@bp.route('/jobs/<job_id>/export.zip')
+def export_zip(job_id):
+    """Stream a job's flashcards as a ZIP of per-file files plus combined notes"""
+    state = _services()['state']
+    if state.get_job(job_id) is None:
+        return jsonify({'error': 'Job not found'}), 404
+    
+    logger.info(f"📦 Streaming ZIP export for job {job_id}")
+    return Response(
+        stream_with_context(stream_zip(lambda: state.iter_job_results(job_id), 'flashcards_notes.txt')),
+        mimetype='application/zip',
+        headers={'Content-Disposition': f'attachment; filename="flashcards_{job_id[:8]}.zip"'}
+    )
+
+@bp.route('/jobs/<job_id>/flashcards.txt')
+def export_text(job_id):
+    """Stream a job's combined flashcards, in upload order, for the web editor"""
+    state = _services()['state']
+    if state.get_job(job_id) is None:
+        return jsonify({'error': 'Job not found'}), 404
+    
+    return Response(stream_with_context(stream_text(state.iter_job_results(job_id))),
+                    mimetype='text/plain; charset=utf-8')
+
+@bp.route('/jobs/<job_id>/export.ndjson')
+def export_ndjson(job_id):
+    """Stream a job's flashcards as newline-delimited JSON card records"""
+    state = _services()['state']
+    if state.get_job(job_id) is None:
+        return jsonify({'error': 'Job not found'}), 404
+    
+    logger.info(f"📦 Streaming NDJSON export for job {job_id}")
+    return Response(
+        stream_with_context(stream_ndjson(state.iter_job_results(job_id))),
+        mimetype='application/x-ndjson',
+        headers={'Content-Disposition': f'attachment; filename="flashcards_{job_id[:8]}.ndjson"'}
+    )
+
+def _process_batch_file(state, job_id, position, file_path, api_key, custom_prompt, requests_per_minute, policy,
+                        cancel, text_cache):
+    """Process one file of a batch session and record its result in the job store"""
+    upload_dir = os.path.dirname(file_path)
+    try:
+        result = process_single_file(file_path, api_key, upload_dir, custom_prompt, state, requests_per_minute,
+                                     policy, cancel, text_cache)
+    except Exception as exc:
+        logger.error(f"❌ {os.path.basename(file_path)} generated an exception: {exc}")
+        result = {'file_name': os.path.basename(file_path), 'success': False, 'error': str(exc)}
+    finally:
+        shutil.rmtree(upload_dir, ignore_errors=True)
+    
+    state.add_job_result(job_id, position, result, result.get('content'))
+    return result
+
+@bp.route('/batches', methods=['POST'])
+def create_batch():
+    """Open a batch session that files are uploaded into one at a time"""
+    services = _services()
+    if services['draining']:
+        logger.warning("Rejecting batch: server is shutting down")
+        return jsonify({'error': 'Server is shutting down, please retry shortly'}), 503
+    
+    if not os.getenv('GOOGLE_API_KEY'):
+        logger.error("Google API key not configured")
+        return jsonify({'error': 'Google API key not configured. Please set GOOGLE_API_KEY environment variable.'}), 500
+    
+    custom_prompt = request.form.get('prompt', '').strip()
+    try:
+        deadline = _parse_deadline(request.form.get('deadline'))
+    except ValueError:
+        return jsonify({'error': 'Invalid deadline'}), 400
+    
+    job_id = uuid.uuid4().hex
+    services['state'].create_job(job_id, 0, {'client': request.remote_addr, 'prompt': custom_prompt,
+                                             'session': True, 'deadline': deadline})
+    logger.info(f"=== Opened batch session {job_id} (custom prompt: {'Yes' if custom_prompt else 'No'}, "
+                f"deadline: {deadline or 'none'}) ===")
+    return jsonify({'batch_id': job_id}), 201
+
+@bp.route('/batches/<batch_id>/files', methods=['POST'])
+def upload_batch_file(batch_id):
+    """Accept one file of a batch and start processing it immediately"""
+    services = _services()
+    state = services['state']
+    job = state.get_job(batch_id)
+    if job is None or not job['info'].get('session'):
+        return jsonify({'error': 'Batch not found'}), 404
+    if job['status'] != 'running':
+        return jsonify({'error': f"Batch is {job['status']}"}), 409
+    cancel = _job_token(services, job)
+    if cancel.cancelled:
+        return jsonify({'error': f"Batch {cancel.reason}"}), 409
+    
+    file = request.files.get('file')
+    if not file or not file.filename or not allowed_file(file.filename):
+        return jsonify({'error': 'No valid PDF or image file uploaded'}), 400
+    
+    try:
+        position = int(request.form.get('position', job['total_files']))
+    except ValueError:
+        return jsonify({'error': 'Invalid position'}), 400
+    
+    # Each file gets its own directory so same-named files never collide
+    upload_dir = tempfile.mkdtemp(prefix=f"batch_{batch_id[:8]}_")
+    file_path = os.path.join(upload_dir, secure_filename(file.filename))
+    with span('save upload', file=os.path.basename(file_path)):
+        file.save(file_path)
+    state.add_job_file(batch_id)
+    logger.info(f"Batch {batch_id[:8]}: received {os.path.basename(file_path)} "
+                f"({os.path.getsize(file_path)} bytes) at position {position}")
+    
+    # Hand it to the shared pool right away so generation overlaps with the
+    # rest of the client's uploads
+    request_key = f"{job['info'].get('client')}-{batch_id[:8]}"
+    services['pool'].submit(request_key, _process_batch_file, state, batch_id, position, file_path,
+                            os.getenv('GOOGLE_API_KEY'), job['info'].get('prompt') or None,
+                            current_app.config['REQUESTS_PER_MINUTE'], services['policy'], cancel,
+                            services['text_cache'])
+    return jsonify({'queued': True, 'position': position}), 202
+
+@bp.route('/batches/<batch_id>/cancel', methods=['POST'])
+def cancel_batch(batch_id):
+    """Cancel a batch: queued files are skipped and in-flight retries abandoned
+    
+    Browsers call this with navigator.sendBeacon when the tab is closed.
+    """
+    services = _services()
+    state = services['state']
+    job = state.get_job(batch_id)
+    if job is None:
+        return jsonify({'error': 'Batch not found'}), 404
+    
+    if job['status'] == 'running':
+        state.finish_job(batch_id, 'cancelled', {'cancelled_at': time.time()})
+        _job_token(services, job).cancel('cancelled')
+        logger.info(f"🛑 Batch {batch_id[:8]} cancelled by client")
+    return jsonify({'cancelled': True})
+
+@bp.route('/batches/<batch_id>/close', methods=['POST'])
+def close_batch(batch_id):
+    """Wait for every uploaded file of a batch and return its summary
+    
+    The flashcards themselves are streamed from /jobs/<job_id>/flashcards.txt.
+    """
+    services = _services()
+    state = services['state']
+    job = state.get_job(batch_id)
+    if job is None or not job['info'].get('session'):
+        return jsonify({'error': 'Batch not found'}), 404
+    
+    # Results may be written by any worker process, so poll the job store;
+    # past the deadline the remaining files finish quickly as skipped
+    while job['status'] == 'running' and job['processed_files'] < job['total_files']:
+        time.sleep(0.5)
+        job = state.get_job(batch_id)
+    
+    successful_files = 0
+    skipped_files = 0
+    for row in state.iter_job_results(batch_id):
+        successful_files += 1 if row['success'] else 0
+        skipped_files += 1 if _is_skipped(row) else 0
+    total_files = job['total_files']
+    if job['status'] == 'running':
+        state.finish_job(batch_id, 'complete', {'processed_files': successful_files, 'skipped_files': skipped_files})
+    _forget_job_token(services, batch_id)
+    
+    message = f'Successfully processed {successful_files}/{total_files} files'
+    if job['status'] == 'cancelled':
+        message += ' (batch cancelled)'
+    elif skipped_files:
+        message += f' ({skipped_files} skipped: deadline exceeded or cancelled)'
+    
+    logger.info(f"=== Batch {batch_id[:8]} complete: {successful_files}/{total_files} files successful, "
+                f"{skipped_files} skipped ===")
+    return jsonify({
+        'success': True,
+        'job_id': batch_id,
+        'processed_files': successful_files,
+        'skipped_files': skipped_files,
+        'total_files': total_files,
+        'message': message
+    })
+
+@bp.route('/process_files', methods=['POST'])
 def process_files():
     """Process uploaded files and generate flashcards"""
     logger.info("=== Starting file processing request ===")
     
+    services = _services()
+    worker_pool = services['pool']
+    state = services['state']
+    if services['draining']:
+        logger.warning("Rejecting request: server is shutting down")
+        return jsonify({'error': 'Server is shutting down, please retry shortly'}), 503
+    
     if 'files' not in request.files:
         logger.error("No files uploaded in request")
         return jsonify({'error': 'No files uploaded'}), 400
     
     files = request.files.getlist('files')
     custom_prompt = request.form.get('prompt', '').strip()
+    try:
+        deadline = _parse_deadline(request.form.get('deadline'))
+    except ValueError:
+        return jsonify({'error': 'Invalid deadline'}), 400
     
     logger.info(f"Received {len(files)} files")
     logger.info(f"Custom prompt provided: {'Yes' if custom_prompt else 'No'}")
@@ -190,87 +668,111 @@ def process_files():
             if file:
                 filename = secure_filename(file.filename)
                 file_path = os.path.join(temp_input_dir, filename)
-                file.save(file_path)
+                with span('save upload', file=filename):
+                    file.save(file_path)
                 saved_files.append(file_path)
                 logger.info(f"Saved file: {filename} ({os.path.getsize(file_path)} bytes)")
         
-        # Process files in parallel and collect results
-        all_flashcards = []
+        # Process files in parallel; contents go to the job store and only
+        # the small per-file summaries are kept here
         results = []
         
-        # Set maximum workers (similar to original script)
-        max_workers = min(5, len(saved_files))  # Max 5 workers to respect API limits
-        logger.info(f"Starting parallel processing with {max_workers} workers for {len(saved_files)} files")
+        # Each request gets its own queue in the shared pool so workers are
+        # shared fairly between concurrent requests
+        job_id = uuid.uuid4().hex
+        request_key = f"{request.remote_addr}-{job_id[:8]}"
+        state.create_job(job_id, len(saved_files), {'client': request.remote_addr, 'deadline': deadline})
+        cancel = _job_token(services, state.get_job(job_id))
+        pool_stats = worker_pool.stats()
+        logger.info(f"Queueing {len(saved_files)} files as job {job_id} "
+                    f"(pool: {pool_stats['running']}/{worker_pool.max_workers} running, {pool_stats['queued']} queued)")
         
         try:
-            # Use ThreadPoolExecutor for parallel processing (like original script)
-            with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
-                # Create a dictionary to track which future maps to which file
-                future_to_file = {}
-                
-                # Submit all files for processing
-                for file_path in saved_files:
-                    future = executor.submit(process_single_file, file_path, api_key, temp_output_dir, custom_prompt)
-                    future_to_file[future] = os.path.basename(file_path)
-                    logger.info(f"Submitted {os.path.basename(file_path)} for processing")
+            # Create a dictionary to track which future maps to which file
+            future_to_file = {}
+            
+            # Submit all files for processing
+            for position, file_path in enumerate(saved_files):
+                future = worker_pool.submit(request_key, process_single_file, file_path, api_key, temp_output_dir,
+                                            custom_prompt, state, current_app.config['REQUESTS_PER_MINUTE'],
+                                            services['policy'], cancel, services['text_cache'])
+                future_to_file[future] = (position, os.path.basename(file_path))
+                logger.info(f"Submitted {os.path.basename(file_path)} for processing")
+            
+            # Process results as they complete
+            completed_count = 0
+            for future in concurrent.futures.as_completed(future_to_file):
+                position, file_name = future_to_file[future]
+                completed_count += 1
                 
-                # Process results as they complete
-                completed_count = 0
-                for future in concurrent.futures.as_completed(future_to_file):
-                    file_name = future_to_file[future]
-                    completed_count += 1
+                try:
+                    result = future.result()
+                    content = result.pop('content', None)
+                    results.append(result)
+                    
+                    logger.info(f"Completed {completed_count}/{len(saved_files)}: {file_name}")
                     
-                    try:
-                        result = future.result()
-                        results.append(result)
+                    if result['success']:
+                        if content is None:
+                            # Read from output file
+                            with open(result['output_file'], 'r', encoding='utf-8') as f:
+                                content = f.read()
                         
-                        logger.info(f"Completed {completed_count}/{len(saved_files)}: {file_name}")
+                        state.add_job_result(job_id, position, result, content)
+                        logger.info(f"✅ Successfully processed: {result['file_name']}")
+                    else:
+                        state.add_job_result(job_id, position, result)
+                        logger.error(f"❌ Failed to process: {result['file_name']}")
                         
-                        if result['success']:
-                            # Read the generated flashcards
-                            if 'content' in result:
-                                content = result['content']
-                            else:
-                                # Read from output file
-                                with open(result['output_file'], 'r', encoding='utf-8') as f:
-                                    content = f.read()
-                            
-                            all_flashcards.append(f"# {result['file_name']}\n{content}\n")
-                            logger.info(f"✅ Successfully processed: {result['file_name']}")
-                        else:
-                            logger.error(f"❌ Failed to process: {result['file_name']}")
-                            
-                    except Exception as exc:
-                        logger.error(f"❌ {file_name} generated an exception: {exc}")
-                        # Add failed result
-                        results.append({
-                            'file_name': file_name,
-                            'success': False,
-                            'error': str(exc)
-                        })
-        
+                except Exception as exc:
+                    logger.error(f"❌ {file_name} generated an exception: {exc}")
+                    # Add failed result
+                    results.append({
+                        'file_name': file_name,
+                        'success': False,
+                        'error': str(exc)
+                    })
+                    state.add_job_result(job_id, position, results[-1])
+    
         except Exception as e:
             logger.error(f"❌ Critical error during parallel processing: {str(e)}")
+            worker_pool.cancel(request_key)
+            cancel.cancel('failed')
+            state.finish_job(job_id, 'failed', {'error': str(e)})
             return jsonify({'error': f'Error during parallel processing: {str(e)}'}), 500
-        
-        # Combine all flashcards
-        combined_flashcards = '\n'.join(all_flashcards)
+        finally:
+            _forget_job_token(services, job_id)
         
         # Calculate success metrics
         successful_files = len([r for r in results if r['success']])
+        skipped_files = len([r for r in results if _is_skipped(r)])
         total_files = len(saved_files)
         
-        logger.info(f"=== Processing complete: {successful_files}/{total_files} files successful ===")
+        validation_totals = summarize_stats(r.get('validation') for r in results)
+        
+        message = f'Successfully processed {successful_files}/{total_files} files'
+        if skipped_files:
+            message += f' ({skipped_files} skipped: {cancel.reason or "cancelled"})'
+        
+        logger.info(f"=== Processing complete: {successful_files}/{total_files} files successful, "
+                    f"{skipped_files} skipped ===")
+        logger.info(f"Validation totals: {validation_totals}")
+        state.finish_job(job_id, 'complete', {'processed_files': successful_files, 'skipped_files': skipped_files,
+                                              'validation': validation_totals})
         
         return jsonify({
             'success': True,
-            'flashcards': combined_flashcards,
+            'job_id': job_id,
             'processed_files': successful_files,
+            'skipped_files': skipped_files,
             'total_files': total_files,
-            'message': f'Successfully processed {successful_files}/{total_files} files'
+            'validation': validation_totals,
+            'message': message
         })
 
 if __name__ == '__main__':
+    app = create_app()
+    
     # Check for API key
     if not os.getenv('GOOGLE_API_KEY'):
         logger.warning("⚠️  Warning: GOOGLE_API_KEY environment variable not set!")
@@ -279,5 +781,7 @@ if __name__ == '__main__':
     else:
         logger.info("✅ Google API key found")
     
-    logger.info("🚀 Starting FlashCard Generator Web Application on port 8080")
-    app.run(debug=True, host='0.0.0.0', port=8080)
+    # Development server only; use `gunicorn -c gunicorn.conf.py wsgi:app` in production
+    port = int(os.getenv('PORT', '8080'))
+    logger.info(f"🚀 Starting FlashCard Generator Web Application on port {port}")
+    app.run(debug=os.getenv('FLASK_DEBUG') == '1', host='0.0.0.0', port=port)
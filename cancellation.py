@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+RemNote Cooperative Cancellation
+-------------------------------
+A cancel token shared by everything working on one batch. Signals, client
+disconnects and per-batch deadlines cancel the token; queued work checks it
+before starting, retry loops wake up from their backoff sleeps, and work
+that has not started yet is reported as skipped.
+"""
+
+import time
+import threading
+
+
+class Cancelled(Exception):
+    """Raised when work is abandoned because its batch was cancelled."""
+
+
+class CancelToken:
+    """Cancellation flag with an optional deadline and external poll.
+
+    ``poll`` is an optional callable returning True when the batch was
+    cancelled elsewhere (e.g. by another process); it is called at most once
+    every ``poll_interval`` seconds.
+    """
+
+    def __init__(self, deadline=None, poll=None, poll_interval=2.0):
+        self._event = threading.Event()
+        self._reason = None
+        self.deadline = time.monotonic() + deadline if deadline else None
+        self._poll = poll
+        self._poll_interval = poll_interval
+        self._last_poll = 0.0
+        self._lock = threading.Lock()
+
+    def cancel(self, reason='cancelled'):
+        """Cancel the token; the first reason given is kept."""
+        with self._lock:
+            if self._reason is None:
+                self._reason = reason
+        self._event.set()
+
+    @property
+    def cancelled(self):
+        """True once the token is cancelled or its deadline has passed."""
+        if self._event.is_set():
+            return True
+        if self.deadline is not None and time.monotonic() >= self.deadline:
+            self.cancel('deadline exceeded')
+            return True
+        if self._poll is not None:
+            now = time.monotonic()
+            if now - self._last_poll >= self._poll_interval:
+                self._last_poll = now
+                if self._poll():
+                    self.cancel('cancelled')
+                    return True
+        return False
+
+    @property
+    def reason(self):
+        """Why the token was cancelled, or None."""
+        return self._reason if self.cancelled else None
+
+    def remaining(self):
+        """Seconds until the deadline, or None without one."""
+        if self.deadline is None:
+            return None
+        return max(0.0, self.deadline - time.monotonic())
+
+    def raise_if_cancelled(self):
+        """Raise Cancelled if the token is cancelled."""
+        if self.cancelled:
+            raise Cancelled(self._reason)
+
+    def sleep(self, seconds):
+        """Sleep for up to ``seconds``, waking early (and raising) on cancellation."""
+        end = time.monotonic() + seconds
+        while True:
+            self.raise_if_cancelled()
+            left = end - time.monotonic()
+            if left <= 0:
+                return
+            # Wake at the deadline, and periodically for external polls
+            wait = min(left, self._poll_interval)
+            if self.deadline is not None:
+                wait = min(wait, max(0.0, self.deadline - time.monotonic()))
+            self._event.wait(wait)
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+RemNote Flashcard Export
+-----------------------
+Streams a job's results from the job store as a ZIP archive (one
+``_flashcards.txt`` per file plus the combined notes), as NDJSON card
+records or as the combined text shown in the web editor. Both are generated on the fly, one file at a time, so neither the
+server nor the browser has to hold the whole batch in memory.
+"""
+
+import os
+import json
+import zipfile
+
+from validation import CARD_PATTERN
+
+
+class _ChunkBuffer:
+    """Write-only file object collecting the bytes written since the last drain."""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def _archive_names(rows):
+    """Map result positions to unique ``<stem>_flashcards.txt`` names."""
+    names = {}
+    used = set()
+    for row in rows:
+        stem = os.path.splitext(row['file_name'])[0] or f"file_{row['position']}"
+        name = f"{stem}_flashcards.txt"
+        if name in used:
+            name = f"{stem}_{row['position']}_flashcards.txt"
+        used.add(name)
+        names[row['position']] = name
+    return names
+
+
+def stream_zip(iter_results, notes_name='notes.txt'):
+    """Yield a ZIP archive of a job's results chunk by chunk.
+
+    ``iter_results`` is a callable returning a fresh iterator over the job's
+    result rows; it is called once per pass so rows are never all in memory.
+    """
+    # Only the (small) file names are collected up front
+    names = _archive_names(
+        {'position': row['position'], 'file_name': row['file_name']}
+        for row in iter_results() if row['success']
+    )
+
+    buffer = _ChunkBuffer()
+    with zipfile.ZipFile(buffer, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        # One entry per successfully processed file
+        for row in iter_results():
+            if not row['success']:
+                continue
+            archive.writestr(names[row['position']], row['content'] or '')
+            yield buffer.drain()
+
+        # Combined notes, written incrementally into a single entry
+        with archive.open(notes_name, 'w', force_zip64=True) as notes:
+            for row in iter_results():
+                if not row['success']:
+                    continue
+                notes.write((row['content'] or '').encode('utf-8'))
+                notes.write(b'\n\n')
+                yield buffer.drain()
+
+    yield buffer.drain()
+
+
+def stream_text(rows):
+    """Yield the combined flashcards of a job, one ``# <file>`` section per successful file."""
+    first = True
+    for row in rows:
+        if not row['success']:
+            continue
+        yield ('' if first else '\n') + f"# {row['file_name']}\n{row['content'] or ''}\n"
+        first = False
+
+
+def iter_card_records(rows):
+    """Yield one dict per flashcard found in a job's result rows."""
+    for row in rows:
+        if not row['success']:
+            yield {"file": row['file_name'], "error": row['error'] or 'processing failed'}
+            continue
+
+        index = 0
+        for line in (row['content'] or '').splitlines():
+            match = CARD_PATTERN.match(line.strip())
+            if match:
+                index += 1
+                yield {
+                    "file": row['file_name'],
+                    "index": index,
+                    "question": match.group('question'),
+                    "answer": match.group('answer')
+                }
+
+
+def stream_ndjson(rows):
+    """Yield NDJSON lines of card records."""
+    for record in iter_card_records(rows):
+        yield json.dumps(record, ensure_ascii=False) + '\n'
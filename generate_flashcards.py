@@ -13,10 +13,28 @@ import argparse
 from pathlib import Path
 import mimetypes
 import time
-import re
+import signal
+import threading
 import concurrent.futures
-from tqdm import tqdm
-import google.generativeai as genai
+from lazy_import import lazy_module
+from startup_profile import ProfileStartupAction
+from profiling import Profiler, span
+from prompt_registry import PromptRegistry, prompt_hash
+from single_flight import SingleFlight, work_key
+from retry_policy import RetryPolicy, classify_error
+from cancellation import CancelToken, Cancelled
+from shared_state import file_hash
+from pdf_text import TextCache, TEXT_CACHE_DIRNAME, load_pages, write_page_subset, format_text_pages
+from page_cache import PageCardCache, PAGE_CACHE_DIRNAME
+from work_queue import WorkQueue, LeaseHeartbeat, worker_id, PENDING, LEASED, DONE, FAILED, DEFAULT_VISIBILITY_TIMEOUT
+from validation import CARD_PATTERN, NO_CARDS_ERROR, validate_and_repair, merge_stats, summarize_stats
+from scheduling import (estimate_file, order_largest_first, apply_budget, project_batch,
+                        format_projection, DEFAULT_REQUESTS_PER_MINUTE)
+
+# Heavy dependencies are imported on first use, so --help, argument errors
+# and importing this module for the prompt stay fast
+genai = lazy_module('google.generativeai')
+tqdm = lazy_module('tqdm')
 
 # RemNote prompt template 
 REMNOTE_PROMPT_TEMPLATE = """
@@ -51,9 +69,201 @@ Example format:
 
 """
 
-def process_file(file_path, api_key, output_dir, pbar=None):
+# Name under which REMNOTE_PROMPT_TEMPLATE is tracked in the prompt registry
+DEFAULT_PROMPT_NAME = 'default'
+
+def delete_uploaded_file(uploaded_file):
+    """Delete an uploaded file from Gemini; failures only leave it to expire."""
+    try:
+        genai.delete_file(uploaded_file.name)
+    except Exception:
+        pass
+
+def call_directly(fn, *args, operation=None, weight=None, discard=None):
+    """Default ``call`` of the generation helpers: run one request, without retries.
+
+    ``call(fn, *args, operation=..., weight=..., discard=...)`` runs a single
+    API request; callers pass e.g. RetryPolicy.call so each request is
+    retried on its own. ``weight`` is the number of pages sent and
+    ``discard`` cleans up the result of an attempt that was abandoned.
+    """
+    return fn(*args)
+
+def upload_file(path, display_name, cancel=None):
+    """Upload a file to Gemini, unless ``cancel`` was cancelled before it started."""
+    if cancel is not None:
+        cancel.raise_if_cancelled()
+    return genai.upload_file(path=path, display_name=display_name)
+
+def prepare_input_parts(file_path, text_cache=None, call=call_directly, cancel=None):
+    """Build the content parts that present a file to the model.
+
+    PDF pages with a usable text layer are sent as plain text; only scanned
+    and image pages are uploaded, as a PDF holding just those pages. Other
+    files are uploaded as they are. Nothing is uploaded once ``cancel`` is
+    cancelled. Returns ``(parts, uploaded_files, page_counts)``.
+    """
+    file_name = os.path.basename(file_path)
+    pages = None
+    if file_path.lower().endswith('.pdf'):
+        with span('extract text', file=file_name):
+            pages = load_pages(file_path, text_cache, file_hash(file_path) if text_cache else None)
+    
+    if not pages or all(text is None for text in pages):
+        # Images, scans and unreadable PDFs: upload the whole file
+        with span('upload', file=file_name):
+            uploaded = call(upload_file, file_path, file_name, cancel, operation='upload',
+                            weight=len(pages) if pages else 1, discard=delete_uploaded_file)
+        return [uploaded], [uploaded], {"text_pages": 0, "uploaded_pages": len(pages) if pages else 1}
+    
+    parts = [format_text_pages(pages)]
+    uploaded_files = []
+    upload_pages = [number for number, text in enumerate(pages) if text is None]
+    if upload_pages:
+        uploaded = upload_pdf_pages(file_path, upload_pages, call, cancel)
+        parts.append(uploaded)
+        uploaded_files.append(uploaded)
+    return parts, uploaded_files, {"text_pages": len(pages) - len(upload_pages), "uploaded_pages": len(upload_pages)}
+
+def upload_pdf_pages(file_path, page_numbers, call=call_directly, cancel=None):
+    """Upload a PDF holding only the given (0-based) pages of a document."""
+    if cancel is not None:
+        cancel.raise_if_cancelled()
+    subset_path = write_page_subset(file_path, page_numbers)
+    try:
+        with span('upload', file=os.path.basename(file_path), pages=len(page_numbers)):
+            return call(upload_file, subset_path, os.path.basename(file_path), cancel, operation='upload',
+                        weight=len(page_numbers), discard=delete_uploaded_file)
+    finally:
+        os.remove(subset_path)
+
+def generate_from_parts(model, parts, uploaded_files, page_counts, prompt_text, allow_headers=False, cancel=None,
+                        call=call_directly):
+    """Generate flashcards from prepared content parts and validate them.
+
+    The generation and each follow-up request are separate ``call``s, so a
+    failed follow-up is retried on its own rather than regenerating the
+    document. The uploaded files among the parts are deleted once
+    generation is done (or abandoned).
+    """
+    try:
+        # Don't spend a generation on a batch that was cancelled meanwhile
+        if cancel is not None:
+            cancel.raise_if_cancelled()
+        
+        # Generate flashcards from the document
+        pages = page_counts["text_pages"] + page_counts["uploaded_pages"]
+        with span('generate'):
+            response = call(model.generate_content, parts + [prompt_text], operation='generate', weight=pages)
+        
+        def follow_up(contents):
+            # Continuations resend the document; repairs are short text-only requests
+            return call(model.generate_content, contents, operation='followup',
+                        weight=pages if isinstance(contents, list) else None)
+        
+        # Check the format and re-request only missing/malformed cards
+        with span('validate'):
+            content, stats = validate_and_repair(model, parts, prompt_text, response, allow_headers=allow_headers,
+                                                 generate=follow_up, cancel=cancel)
+        stats.update(page_counts)
+        return content, stats
+    finally:
+        for uploaded in uploaded_files:
+            with span('delete upload'):
+                delete_uploaded_file(uploaded)
+
+def generate_validated_flashcards(file_path, model, prompt_text, allow_headers=False, cancel=None, text_cache=None,
+                                  call=call_directly):
+    """Present a file to the model, generate flashcards and validate them.
+
+    Text PDFs are sent as extracted text (cached in ``text_cache``, a
+    TextCache); everything else is uploaded, and uploads are deleted again
+    once generation is done (or abandoned). Each API request runs through
+    ``call`` (see call_directly). Returns ``(content, validation_stats)``.
+    """
+    parts, uploaded_files, page_counts = prepare_input_parts(file_path, text_cache, call, cancel)
+    return generate_from_parts(model, parts, uploaded_files, page_counts, prompt_text, allow_headers, cancel, call)
 
-    """Process a single file and generate flashcards."""
+def generate_page_flashcards(file_path, model, prompt_text, number, text, cancel=None, call=call_directly):
+    """Generate and validate the flashcards of one PDF page (0-based ``number``).
+
+    A page with a text layer is sent as text, any other page is uploaded on
+    its own. Returns ``(content, validation_stats)``.
+    """
+    if text is not None:
+        parts = [f"Text of page {number + 1} of the document:\n\n{text}"]
+        return generate_from_parts(model, parts, [], {"text_pages": 1, "uploaded_pages": 0}, prompt_text,
+                                   cancel=cancel, call=call)
+    
+    uploaded = upload_pdf_pages(file_path, [number], call, cancel)
+    return generate_from_parts(model, [uploaded], [uploaded], {"text_pages": 0, "uploaded_pages": 1}, prompt_text,
+                               cancel=cancel, call=call)
+
+def generate_changed_pages(file_path, model, prompt_text, page_hashes, page_cache, call=call_directly, cancel=None,
+                           text_cache=None):
+    """Assemble a PDF's flashcards page by page, generating only uncached pages.
+
+    Each page's flashcards are cached under its content hash and the prompt
+    hash as soon as they are generated, so an interrupted run keeps its
+    progress. Pages that came back without cards are left out and, until
+    PageCardCache.record_empty accepts that as their result, counted in the
+    ``retry_pages`` stat. Each API request runs through ``call`` (see
+    call_directly). Returns ``(content, validation_stats)``.
+    """
+    digest = prompt_hash(prompt_text)
+    with span('extract text', file=os.path.basename(file_path)):
+        pages = load_pages(file_path, text_cache, file_hash(file_path) if text_cache else None)
+    
+    sections = []
+    stats = None
+    reused = 0
+    retry = 0
+    for number, page_digest in enumerate(page_hashes):
+        content = page_cache.get(page_digest, digest)
+        if content is None:
+            text = pages[number] if pages else None
+            with span('page', page=number + 1):
+                content, page_stats = generate_page_flashcards(file_path, model, prompt_text, number, text,
+                                                               cancel, call)
+            if not page_stats["valid"]:
+                # Title pages, blank pages and the like have no cards; keep
+                # the model's remarks about them out of the assembled file
+                content = ''
+                if not page_cache.record_empty(page_digest, digest):
+                    retry += 1
+            else:
+                page_cache.set(page_digest, digest, content)
+            stats = merge_stats(stats, page_stats)
+        else:
+            reused += 1
+        sections.append(content.rstrip('\n') + '\n' if content.strip() else '')
+    
+    # Every page was cached: the document only needs re-assembling
+    stats = stats or {"cards": 0, "discarded_lines": 0, "malformed_lines": 0, "repaired_lines": 0,
+                      "truncated": False, "continuations": 0, "followup_requests": 0, "valid": True,
+                      "text_pages": 0, "uploaded_pages": 0}
+    stats["cards"] = sum(1 for section in sections for line in section.splitlines() if CARD_PATTERN.match(line.strip()))
+    stats["reused_pages"] = reused
+    stats["retry_pages"] = retry
+    return ''.join(sections), stats
+
+def process_file(file_path, api_key, output_dir, pbar=None, registry=None, inflight=None, policy=None,
+                 cancel=None, force=False, text_cache=None, page_cache=None):
+
+    """Process a single file and generate flashcards.
+
+    Outputs are only reused when they were generated from the current text
+    of REMNOTE_PROMPT_TEMPLATE, as recorded in the output directory's
+    prompt registry. With ``inflight`` (a SingleFlight), files with identical
+    content share one upload and generation. API calls are retried under
+    ``policy`` (a RetryPolicy). Once ``cancel`` (a CancelToken) is cancelled,
+    files that have not started are reported as skipped and in-flight calls
+    are abandoned. ``force`` regenerates the file even if its output looks
+    up to date (distributed workers are only handed files that need it).
+    Text extracted from PDFs is cached in ``text_cache`` (a TextCache).
+    With ``page_cache`` (a PageCardCache), PDFs are generated page by page
+    and only pages whose content changed are sent again.
+    """
     # Configure the Gemini API
     genai.configure(api_key=api_key)
     
@@ -64,8 +274,23 @@ def process_file(file_path, api_key, output_dir, pbar=None):
     file_stem = os.path.splitext(file_name)[0]
     output_file = os.path.join(output_dir, f"{file_stem}_flashcards.txt")
     
-    # Check if the output file already exists - skip if it does
-    if os.path.exists(output_file):
+    if registry is None:
+        registry = PromptRegistry.for_directory(output_dir)
+    prompt_entry = registry.register(DEFAULT_PROMPT_NAME, REMNOTE_PROMPT_TEMPLATE)
+    
+    # Page-level regeneration needs the page hashes of this version of the PDF
+    file_digest = page_hashes = None
+    if page_cache is not None and file_path.lower().endswith('.pdf'):
+        file_digest = file_hash(file_path)
+        with span('page hashes', file=file_name):
+            page_hashes = page_cache.page_hashes(file_path, file_digest)
+    
+    # Skip if the output file exists and was made with the current prompt text
+    # (and, page by page, from this version of the document)
+    current = registry.output_is_current(output_file, prompt_entry["hash"])
+    if page_hashes:
+        current = current and page_cache.is_assembled(output_file, file_digest, prompt_entry["hash"])
+    if not force and current:
         if pbar:
             pbar.update(1)
             pbar.set_description(f"Skipped (exists): {file_name}")
@@ -73,91 +298,287 @@ def process_file(file_path, api_key, output_dir, pbar=None):
             "file_path": file_path,
             "output_file": output_file,
             "success": True,
-            "skipped": True
+            "skipped": True,
+            "prompt_hash": prompt_entry["hash"]
         }
     
     result = {
         "file_path": file_path,
         "output_file": output_file,
-        "success": False
+        "success": False,
+        "prompt_hash": prompt_entry["hash"]
     }
     
-    max_retries = 3
-    retry_count = 0
+    # Don't start work for a cancelled batch or one past its deadline
+    if cancel is not None and cancel.cancelled:
+        result["cancelled"] = True
+        result["error"] = f"Skipped {file_name}: {cancel.reason}"
+        if pbar:
+            pbar.update(1)
+            pbar.set_description(f"Skipped ({cancel.reason}): {file_name}")
+        return result
+    
+    if inflight is None:
+        inflight = SingleFlight()
+    key = work_key(file_path, prompt_entry["hash"])
     
-    while retry_count < max_retries:
+    if policy is None:
+        policy = RetryPolicy()
+    
+    def report_retry(attempt, max_attempts, delay, error, kind):
+        message = f"{kind.replace('_', ' ').capitalize()} error. Waiting {delay:.1f}s before retry {attempt}/{max_attempts - 1}"
+        if pbar:
+            pbar.set_description(message)
+        else:
+            print(f"{message}: {error}")
+    
+    # Every API request (upload, generation, follow-up) is retried on its own
+    def call(fn, *args, **options):
+        return policy.call(fn, *args, on_retry=report_retry, cancel=cancel, **options)
+    
+    with span('process_file', file=file_name):
         try:
             if pbar:
                 pbar.set_description(f"Processing: {file_name}")
-            
-            # Upload the file to Gemini
-            sample_file = genai.upload_file(path=file_path, display_name=file_name)
-            
-            # Generate flashcards using the uploaded document
-            response = model.generate_content([sample_file, REMNOTE_PROMPT_TEMPLATE])
-            
+        
+            # Identical files in flight share one upload and generation
+            if page_hashes:
+                # Only changed pages are sent
+                (content, validation), shared = inflight.do(
+                    key, lambda: generate_changed_pages(file_path, model, REMNOTE_PROMPT_TEMPLATE, page_hashes,
+                                                        page_cache, call=call, cancel=cancel, text_cache=text_cache),
+                    cancel=cancel
+                )
+            else:
+                (content, validation), shared = inflight.do(
+                    key, lambda: generate_validated_flashcards(file_path, model, REMNOTE_PROMPT_TEMPLATE, cancel=cancel,
+                                                               text_cache=text_cache, call=call),
+                    cancel=cancel
+                )
+            result["coalesced"] = shared
+            result["validation"] = validation
+        
+            # A response without cards (a refusal, an error message) is not
+            # saved or recorded, so the next run tries the file again; pages
+            # without cards were already left out of a page-by-page result
+            if not page_hashes and not validation["valid"]:
+                result["error"] = f"Error processing {file_name}: {NO_CARDS_ERROR}"
+                if pbar:
+                    pbar.update(1)
+                    pbar.set_description(f"Failed: {file_name}")
+                else:
+                    print(f"❌ {result['error']}")
+                return result
+        
             # Save the generated flashcards to a text file
-            with open(output_file, 'w', encoding='utf-8') as f:
-                f.write(response.text)
-            
+            with span('write output', file=file_name):
+                with open(output_file, 'w', encoding='utf-8') as f:
+                    f.write(content)
+                registry.record_output(output_file, prompt_entry["hash"])
+                # Pages left to retry keep the output stale for the next run
+                if page_hashes and not validation.get("retry_pages"):
+                    page_cache.record_assembled(output_file, file_digest, prompt_entry["hash"])
+        
             result["success"] = True
-            result["content"] = response.text
-            
+            result["content"] = content
+        
             if pbar:
                 pbar.update(1)
                 pbar.set_description(f"Completed: {file_name}")
             else:
                 print(f"✅ Flashcards saved to: {output_file}")
-            
+        
             # Add a small delay to avoid rate limiting
             time.sleep(0.5)
             return result
-            
+        
+        except Cancelled as e:
+            result["cancelled"] = True
+            result["error"] = f"Abandoned {file_name}: {e}"
+        
+            if pbar:
+                pbar.update(1)
+                pbar.set_description(f"Abandoned ({e}): {file_name}")
+        
+            return result
+        
         except Exception as e:
-            error_msg = str(e)
-            retry_count += 1
-            
-            # Check if it's a rate limit error
-            if "429" in error_msg and retry_count < max_retries:
-                # Extract retry delay if available
-                retry_delay = 10  # Default delay
-                if "retry_delay" in error_msg:
-                    try:
-                        # Try to extract the retry delay from the error message
-                        delay_str = re.search(r'retry_delay\s*{\s*seconds:\s*(\d+)', error_msg)
-                        if delay_str:
-                            retry_delay = int(delay_str.group(1))
-                    except:
-                        pass
-                
-                if pbar:
-                    pbar.set_description(f"Rate limited. Waiting {retry_delay}s before retry {retry_count}/{max_retries}")
-                else:
-                    print(f"Rate limited. Waiting {retry_delay}s before retry {retry_count}/{max_retries}")
-                
-                # Wait before retrying
-                time.sleep(retry_delay)
+            # Fatal error, or retries exhausted
+            result["error"] = f"Error processing {file_name} ({classify_error(e)}): {e}"
+        
+            if pbar:
+                pbar.update(1)
+                pbar.set_description(f"Failed: {file_name}")
             else:
-                # Not a rate limit error or max retries reached
-                result["error"] = f"Error processing {file_name}: {error_msg}"
-                
-                if pbar:
-                    pbar.update(1)
-                    pbar.set_description(f"Failed: {file_name}")
-                else:
-                    print(f"❌ {result['error']}")
-                
-                return result
+                print(f"❌ {result['error']}")
+        
+            return result
+
+def write_combined_notes(files, output_dir, notes_filepath):
+    """Combine the flashcard files of ``files`` (in order) into one notes file."""
+    # Write to a temporary file first so readers never see a partial file
+    tmp_path = notes_filepath + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as notes_file:
+        for file in files:
+            flashcard_file = os.path.join(output_dir, f"{Path(file).stem}_flashcards.txt")
+            if os.path.exists(flashcard_file):
+                with open(flashcard_file, 'r', encoding='utf-8') as f:
+                    notes_file.write(f.read())
+                    notes_file.write('\n\n')
+    os.replace(tmp_path, notes_filepath)
+
+def adopt_queue_results(queue, queue_name, registry, digest):
+    """Record outputs that workers finished with the current prompt in the registry.
+
+    Workers never write the shared registry themselves, so concurrent hosts
+    can't overwrite each other's records.
+    """
+    record = queue.get_queue(queue_name)
+    if record is None or record["prompt_hash"] != digest:
+        return 0
+    adopted = 0
+    for item in queue.iter_items(queue_name, DONE):
+        if os.path.exists(item["output_file"]):
+            registry.record_output(item["output_file"], digest)
+            adopted += 1
+    return adopted
+
+def run_coordinator(args, queue, queue_name, estimates, files_to_process, registry, prompt_entry, output_dir):
+    """Enqueue a folder's files for distributed workers, wait for them and assemble the notes."""
+    queue.create_queue(queue_name, os.path.abspath(args.source_dir), output_dir, prompt_entry["hash"])
+    queued = queue.enqueue(queue_name, [
+        (os.path.abspath(estimate["file_path"]),
+         os.path.join(output_dir, f"{Path(estimate['file_path']).stem}_flashcards.txt"),
+         estimate["seconds"])
+        for estimate in estimates
+    ])
+    print(f"Queued {queued} files in {args.queue} (queue '{queue_name}')")
+    print(f"Start workers with: python generate_flashcards.py {args.source_dir} --worker --queue {args.queue}"
+          + (" --per-page" if args.per_page else ""))
     
-    # If we get here, we've exhausted all retries
-    result["error"] = f"Max retries reached for {file_name}"
+    # Ctrl-C stops waiting; queued files stay queued for the workers
+    interrupted = False
+    counts = queue.counts(queue_name)
+    total = sum(counts.values())
+    try:
+        with tqdm.tqdm(total=total, desc="Waiting for workers", unit="file") as pbar:
+            while counts[PENDING] or counts[LEASED]:
+                pbar.update(counts[DONE] + counts[FAILED] - pbar.n)
+                pbar.set_description(f"Waiting for workers ({counts[LEASED]} in progress)")
+                time.sleep(2)
+                counts = queue.counts(queue_name)
+            pbar.update(counts[DONE] + counts[FAILED] - pbar.n)
+    except KeyboardInterrupt:
+        interrupted = True
     
-    if pbar:
-        pbar.update(1)
-    else:
-        print(f"❌ {result['error']}")
+    if interrupted:
+        print("\nStopped waiting; workers keep processing the queue. Run the coordinator again to assemble the notes.")
+        return 130
+    
+    adopt_queue_results(queue, queue_name, registry, prompt_entry["hash"])
+    up_to_date = sum(
+        1 for file in files_to_process
+        if registry.output_is_current(os.path.join(output_dir, f"{file.stem}_flashcards.txt"), prompt_entry["hash"])
+    )
+    print(f"\nProcessing complete: {up_to_date}/{len(files_to_process)} files successfully processed")
+    for item in queue.iter_items(queue_name, FAILED):
+        print(f"  ❌ {os.path.basename(item['file_path'])}: {item['error']}")
     
-    return result
+    notes_filepath = os.path.join(output_dir, queue_name + '_notes.txt')
+    write_combined_notes(files_to_process, output_dir, notes_filepath)
+    print(f"Combined notes saved to: {notes_filepath}")
+    return 0
+
+def run_worker(args, api_key):
+    """Lease files from a distributed queue and process them until it is drained."""
+    queue = WorkQueue(args.queue)
+    queue_name = os.path.basename(os.path.normpath(args.source_dir))
+    record = queue.get_queue(queue_name)
+    if record is None:
+        print(f"Error: no queue '{queue_name}' in {args.queue}; run the coordinator first.")
+        return 1
+    
+    # Every host must generate with the same prompt text as the coordinator
+    digest = prompt_hash(REMNOTE_PROMPT_TEMPLATE)
+    if record["prompt_hash"] != digest:
+        print(f"Error: this copy's prompt ({digest}) differs from the coordinator's ({record['prompt_hash']}).")
+        return 1
+    
+    output_dir = record["output_dir"]
+    os.makedirs(output_dir, exist_ok=True)
+    owner = worker_id()
+    print(f"Worker {owner}: queue '{queue_name}', output directory: {output_dir}")
+    
+    # The coordinator decides what is stale and records outputs in the shared
+    # registry; workers use a private in-memory one
+    registry = PromptRegistry()
+    inflight = SingleFlight()
+    max_workers = 1 if args.no_parallel else max(1, args.max_workers)
+    policy = RetryPolicy(max_attempts=args.max_attempts, attempt_timeout=args.attempt_timeout, hedge=args.hedge,
+                         max_in_flight=max_workers)
+    heartbeat = LeaseHeartbeat(queue, owner, args.lease_timeout)
+    text_cache = TextCache(os.path.join(output_dir, TEXT_CACHE_DIRNAME))
+    page_cache = PageCardCache(os.path.join(output_dir, PAGE_CACHE_DIRNAME)) if args.per_page else None
+    cancel = CancelToken(deadline=args.deadline)
+    
+    def handle_signal(signum, frame):
+        if cancel.cancelled:
+            raise KeyboardInterrupt
+        print("\nInterrupted: returning leased files to the queue (press Ctrl-C again to exit immediately)")
+        cancel.cancel('interrupted')
+    
+    previous_handlers = {signum: signal.signal(signum, handle_signal) for signum in (signal.SIGINT, signal.SIGTERM)}
+    totals = {"done": 0, "failed": 0}
+    totals_lock = threading.Lock()
+    
+    def work():
+        while not cancel.cancelled:
+            with span('lease'):
+                item = queue.lease(queue_name, owner, args.lease_timeout)
+            if item is None:
+                # Wait while other workers hold leases: their files come back
+                # to the queue if those workers die
+                counts = queue.counts(queue_name)
+                if not counts[PENDING] and not counts[LEASED]:
+                    return
+                try:
+                    cancel.sleep(5)
+                except Cancelled:
+                    return
+                continue
+            
+            heartbeat.add(item["id"])
+            try:
+                result = process_file(item["file_path"], api_key, output_dir, registry=registry, inflight=inflight,
+                                      policy=policy, cancel=cancel, force=True, text_cache=text_cache,
+                                      page_cache=page_cache)
+            except Exception as exc:
+                result = {"success": False, "error": f"Error processing {os.path.basename(item['file_path'])}: {exc}"}
+            finally:
+                heartbeat.discard(item["id"])
+            
+            if result.get("cancelled"):
+                queue.release(item["id"], owner)
+                continue
+            if not queue.complete(item["id"], owner, None if result["success"] else result["error"]):
+                print(f"⚠️ Lease on {os.path.basename(item['file_path'])} expired; another worker took it over")
+                continue
+            with totals_lock:
+                totals["done" if result["success"] else "failed"] += 1
+    
+    try:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for future in [executor.submit(work) for _ in range(max_workers)]:
+                future.result()
+    finally:
+        heartbeat.stop()
+        for signum, handler in previous_handlers.items():
+            signal.signal(signum, handler)
+    
+    print(f"\nWorker finished: {totals['done']} files processed, {totals['failed']} failed")
+    if cancel.cancelled:
+        print(f"Stopped early ({cancel.reason}); unfinished files were returned to the queue")
+    return 130 if cancel.reason == 'interrupted' else 0
 
 def main():
     """Main function to process files and generate flashcards."""
@@ -167,22 +588,83 @@ def main():
     parser.add_argument('--api-key', help='Google Gemini API key')
     parser.add_argument('--max-workers', type=int, default=5, help='Maximum number of parallel workers (default: 5)')
     parser.add_argument('--no-parallel', action='store_true', help='Disable parallel processing')
+    parser.add_argument('--max-attempts', type=int, default=4, help='Attempts per file before giving up (default: 4)')
+    parser.add_argument('--attempt-timeout', type=float, default=300,
+                        help='Seconds before a single API attempt is abandoned and retried (default: 300)')
+    parser.add_argument('--hedge', action='store_true',
+                        help='Send a duplicate request when a call runs past the p95 latency of earlier calls')
+    parser.add_argument('--deadline', type=float,
+                        help='Seconds the batch may run; files not finished by then are reported as skipped')
+    parser.add_argument('--budget', type=int, help='Maximum total estimated tokens to spend on this batch')
+    parser.add_argument('--requests-per-minute', type=int, default=DEFAULT_REQUESTS_PER_MINUTE,
+                        help=f'API request quota used for projections (default: {DEFAULT_REQUESTS_PER_MINUTE})')
+    parser.add_argument('--dry-run', action='store_true',
+                        help='Print the projected duration and cost without calling the API')
+    parser.add_argument('--queue', help='SQLite work queue on a shared volume, for distributed processing')
+    role = parser.add_mutually_exclusive_group()
+    role.add_argument('--coordinator', action='store_true',
+                      help='Enqueue the files in --queue, wait for the workers and assemble the combined notes')
+    role.add_argument('--worker', action='store_true', help='Process files leased from --queue')
+    parser.add_argument('--lease-timeout', type=float, default=DEFAULT_VISIBILITY_TIMEOUT,
+                        help=f'Seconds before a silent worker\'s file is handed to another worker '
+                             f'(default: {DEFAULT_VISIBILITY_TIMEOUT})')
+    parser.add_argument('--profile-startup', action=ProfileStartupAction, module='generate_flashcards',
+                        help='Report the import time of this script and its heavy dependencies, then exit')
+    parser.add_argument('--per-page', action='store_true',
+                        help='Generate PDFs page by page and only re-send pages that changed since the last run')
+    parser.add_argument('--profile', metavar='DIR',
+                        help='Record a span trace and sampled stacks of the run and write them to DIR')
     
     args = parser.parse_args()
+    if (args.coordinator or args.worker) and not args.queue:
+        parser.error('--coordinator and --worker require --queue')
     
-    # Check if API key is provided
+    if not args.profile:
+        return run(args)
+    
+    profiler = Profiler().start()
+    try:
+        return run(args)
+    finally:
+        profiler.stop()
+        trace_path, stacks_path = profiler.write(args.profile)
+        print(f"Profile trace saved to: {trace_path} (open in chrome://tracing or ui.perfetto.dev)")
+        print(f"Sampled stacks saved to: {stacks_path} (open in speedscope.app or flamegraph.pl)")
+
+def run(args):
+    """Generate the flashcards for parsed command-line arguments."""
+    # Check if API key is provided (a dry run never calls the API)
     api_key = args.api_key or os.environ.get('GOOGLE_API_KEY')
-    if not api_key:
+    if not api_key and not args.dry_run:
         print("Error: Google Gemini API key is required.")
         print("Either provide it with --api-key or set the GOOGLE_API_KEY environment variable.")
         return 1
 
+    # Distributed workers take their files and output directory from the queue
+    if args.worker:
+        return run_worker(args, api_key)
+
     # Always use 'remnote_cards/[source_folder_name]' directory for output
     source_folder_name = os.path.basename(os.path.normpath(args.source_dir))
     output_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'remnote_cards', source_folder_name)
-    os.makedirs(output_dir, exist_ok=True)
+    # A dry run leaves the disk untouched: no output directory, and the
+    # registry and page cache are only read
+    if not args.dry_run:
+        os.makedirs(output_dir, exist_ok=True)
     print(f"Output directory: {output_dir}")
 
+    # Track which prompt text produced each output so edited prompts re-run
+    registry = PromptRegistry.for_directory(output_dir, read_only=args.dry_run)
+    prompt_entry = registry.register(DEFAULT_PROMPT_NAME, REMNOTE_PROMPT_TEMPLATE)
+    print(f"Prompt: {DEFAULT_PROMPT_NAME} v{prompt_entry['version']} ({prompt_entry['hash']})")
+
+    # Files finished by distributed workers since the last run are up to date
+    queue = WorkQueue(args.queue) if args.coordinator and not args.dry_run else None
+    if queue is not None:
+        adopted = adopt_queue_results(queue, source_folder_name, registry, prompt_entry["hash"])
+        if adopted:
+            print(f"Adopted {adopted} files finished by workers")
+
     # Get all PDF and image files from the source directory and its subfolders
     source_path = Path(args.source_dir)
     supported_extensions = ['.pdf', '.jpg', '.jpeg', '.png']
@@ -203,7 +685,8 @@ def main():
         return files_found
 
     # Find all files recursively
-    files_to_process = find_files_recursive(source_path)
+    with span('scan', file=source_folder_name):
+        files_to_process = find_files_recursive(source_path)
 
     if not files_to_process:
         print(f"No PDF or image files found in {args.source_dir}")
@@ -211,29 +694,93 @@ def main():
     
     print(f"Found {len(files_to_process)} files to process")
     
-    # Process files in parallel
-    success_count = 0
-    all_results = []
+    # Estimate the files that still need generating and submit them
+    # longest-first so a huge file never becomes the tail of the batch
+    page_cache = (PageCardCache(os.path.join(output_dir, PAGE_CACHE_DIRNAME), read_only=args.dry_run)
+                  if args.per_page else None)
+    
+    def estimate_pending(file):
+        """Estimate the work left for a file, or None if its output is up to date."""
+        output_file = os.path.join(output_dir, f"{file.stem}_flashcards.txt")
+        current = registry.output_is_current(output_file, prompt_entry["hash"])
+        if page_cache is not None and file.suffix.lower() == '.pdf':
+            file_digest = file_hash(file)
+            page_hashes = page_cache.page_hashes(file, file_digest)
+            if page_hashes is not None:
+                if current and page_cache.is_assembled(output_file, file_digest, prompt_entry["hash"]):
+                    return None
+                # Only pages without cached flashcards cost a request
+                stale = page_cache.stale_pages(page_hashes, prompt_entry["hash"])
+                return estimate_file(file, REMNOTE_PROMPT_TEMPLATE, pages_sent=len(stale))
+        return None if current else estimate_file(file, REMNOTE_PROMPT_TEMPLATE)
+    
+    with span('estimate'):
+        pending = [estimate for estimate in map(estimate_pending, files_to_process) if estimate is not None]
+    estimates = order_largest_first(pending)
+    estimates, deferred = apply_budget(estimates, args.budget)
+    files_to_submit = [Path(estimate["file_path"]) for estimate in estimates]
     
     # Set the maximum number of parallel workers
     # Use the user-specified value or default to 5 (for free tier limits)
     if args.no_parallel:
         max_workers = 1
     else:
-        max_workers = min(args.max_workers, len(files_to_process))  # Respect user-specified limit
+        max_workers = max(1, min(args.max_workers, len(files_to_submit)))  # Respect user-specified limit
     
-    print(f"Processing {len(files_to_process)} files with {max_workers} parallel workers...")
+    print(f"Up to date: {len(files_to_process) - len(pending)}, to generate: {len(files_to_submit)}")
+    if deferred:
+        print(f"Deferred by --budget {args.budget:,} tokens: {len(deferred)} files "
+              f"(~{sum(e['total_tokens'] for e in deferred):,} tokens)")
+    print(f"Projected: {format_projection(project_batch(estimates, max_workers, args.requests_per_minute))}")
+    
+    if args.dry_run:
+        for estimate in estimates:
+            print(f"  {os.path.basename(estimate['file_path'])}: {estimate['pages']} pages, "
+                  f"~{estimate['total_tokens']:,} tokens, ~{estimate['seconds']:.0f}s")
+        for estimate in deferred:
+            print(f"  {os.path.basename(estimate['file_path'])}: deferred "
+                  f"(~{estimate['total_tokens']:,} tokens)")
+        return 0
+    
+    if queue is not None:
+        return run_coordinator(args, queue, source_folder_name, estimates, files_to_process, registry, prompt_entry,
+                               output_dir)
+    
+    # Process files in parallel
+    success_count = len(files_to_process) - len(pending)
+    all_results = []
+    
+    print(f"Processing {len(files_to_submit)} files with {max_workers} parallel workers...")
+    
+    # Duplicate files in the folder share one API call
+    inflight = SingleFlight()
+    policy = RetryPolicy(max_attempts=args.max_attempts, attempt_timeout=args.attempt_timeout, hedge=args.hedge,
+                         max_in_flight=max_workers)
+    text_cache = TextCache(os.path.join(output_dir, TEXT_CACHE_DIRNAME))
+    
+    # Ctrl-C / SIGTERM cancel the batch: queued files are skipped and
+    # in-flight retries are abandoned. A second Ctrl-C exits immediately.
+    cancel = CancelToken(deadline=args.deadline)
+    
+    def handle_signal(signum, frame):
+        if cancel.cancelled:
+            raise KeyboardInterrupt
+        print("\nInterrupted: cancelling remaining files (press Ctrl-C again to exit immediately)")
+        cancel.cancel('interrupted')
+    
+    previous_handlers = {signum: signal.signal(signum, handle_signal) for signum in (signal.SIGINT, signal.SIGTERM)}
     
     # Use tqdm for progress tracking
-    with tqdm(total=len(files_to_process), desc="Processing files", unit="file") as pbar:
+    with tqdm.tqdm(total=len(files_to_submit), desc="Processing files", unit="file") as pbar:
         # Use ThreadPoolExecutor for parallel processing
         with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
             # Create a dictionary to track which future maps to which file
             future_to_file = {}
             
-            # Submit all files for processing
-            for file_path in files_to_process:
-                future = executor.submit(process_file, str(file_path), api_key, output_dir, pbar)
+            # Submit files largest-first
+            for file_path in files_to_submit:
+                future = executor.submit(process_file, str(file_path), api_key, output_dir, pbar, registry, inflight,
+                                         policy, cancel, text_cache=text_cache, page_cache=page_cache)
                 future_to_file[future] = os.path.basename(file_path)
             
             # Process results as they complete
@@ -252,20 +799,40 @@ def main():
                 except Exception as exc:
                     print(f"\n❌ {file_name} generated an exception: {exc}")
     
+    for signum, handler in previous_handlers.items():
+        signal.signal(signum, handler)
+    
     print(f"\nProcessing complete: {success_count}/{len(files_to_process)} files successfully processed")
+    skipped = [result for result in all_results if result.get("cancelled")]
+    if skipped:
+        print(f"Skipped ({cancel.reason}): {len(skipped)} files")
+        for result in skipped:
+            print(f"  {os.path.basename(result['file_path'])}")
+    if inflight.coalesced:
+        print(f"Duplicate files sharing an API call: {inflight.coalesced}")
+
+    # Report how much cleanup and follow-up the responses needed
+    validation_totals = summarize_stats(result.get("validation") for result in all_results)
+    if validation_totals["files"]:
+        print(f"Validation: {validation_totals['cards']} cards, "
+              f"{validation_totals['discarded_lines']} discarded lines, "
+              f"{validation_totals['repaired_lines']}/{validation_totals['malformed_lines']} malformed lines repaired, "
+              f"{validation_totals['truncated_files']} truncated files, "
+              f"{validation_totals['followup_requests']} follow-up requests"
+              + (f" ({validation_totals['failed_followups']} failed)" if validation_totals['failed_followups'] else ""))
+        print(f"Input: {validation_totals['text_pages']} pages sent as text, "
+              f"{validation_totals['uploaded_pages']} pages uploaded"
+              + (f", {validation_totals['reused_pages']} unchanged pages reused" if args.per_page else "")
+              + (f", {validation_totals['retry_pages']} pages without cards to retry"
+                 if validation_totals['retry_pages'] else ""))
 
     # Combine all generated flashcards into a single notes file
     notes_filename = source_folder_name + '_notes.txt'
     notes_filepath = os.path.join(output_dir, notes_filename)
-    with open(notes_filepath, 'w', encoding='utf-8') as notes_file:
-        for file in files_to_process:
-            flashcard_file = os.path.join(output_dir, f"{file.stem}_flashcards.txt")
-            if os.path.exists(flashcard_file):
-                with open(flashcard_file, 'r', encoding='utf-8') as f:
-                    notes_file.write(f.read())
-                    notes_file.write('\n\n')
+    with span('notes', file=notes_filename):
+        write_combined_notes(files_to_process, output_dir, notes_filepath)
     print(f"Combined notes saved to: {notes_filepath}")
-    return 0
+    return 130 if cancel.reason == 'interrupted' else 0
 
 if __name__ == "__main__":
     sys.exit(main())
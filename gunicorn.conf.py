@@ -0,0 +1,30 @@
+"""
+Gunicorn configuration for the RemNote Flashcard Generator web application.
+
+Every worker process has its own worker pool; the result cache, rate
+limiter and job store are shared through the SQLite database configured
+with FLASHCARD_STATE_DB.
+"""
+
+import os
+import multiprocessing
+
+bind = os.getenv('BIND', f"0.0.0.0:{os.getenv('PORT', '8080')}")
+
+# Processes x request threads; API concurrency per process is FLASHCARD_MAX_WORKERS
+workers = int(os.getenv('WEB_CONCURRENCY', str(min(4, multiprocessing.cpu_count()))))
+worker_class = 'gthread'
+threads = int(os.getenv('WEB_THREADS', '8'))
+
+# Batches are long-running requests; give in-flight jobs time to drain
+timeout = int(os.getenv('WEB_TIMEOUT', '900'))
+graceful_timeout = int(os.getenv('WEB_GRACEFUL_TIMEOUT', '600'))
+
+
+def worker_exit(server, worker):
+    """Drain the worker's in-flight jobs before the process exits."""
+    from app import drain
+
+    app = getattr(worker, 'wsgi', None)
+    if app is not None and 'flashcards' in getattr(app, 'extensions', {}):
+        drain(app)
@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+"""
+RemNote Lazy Imports
+-------------------
+Heavy dependencies (the Gemini SDK above all) take most of a cold start.
+``lazy_module`` returns a stand-in that imports the real module on first
+attribute access, so ``--help``, argument errors and health checks never
+pay for an SDK they don't use. The time each lazy import took is kept in
+``import_times`` for the startup report.
+"""
+
+import time
+import types
+import threading
+import importlib
+import importlib.util
+
+# Seconds spent importing each lazily loaded module, in load order
+import_times = {}
+
+_lock = threading.Lock()
+
+
+class LazyModule(types.ModuleType):
+    """Module stand-in that imports the real module on first use."""
+
+    def __init__(self, name):
+        super().__init__(name)
+        self.__dict__['_module'] = None
+
+    def _load(self):
+        module = self.__dict__['_module']
+        if module is None:
+            with _lock:
+                module = self.__dict__['_module']
+                if module is None:
+                    started = time.perf_counter()
+                    module = importlib.import_module(self.__name__)
+                    import_times[self.__name__] = time.perf_counter() - started
+                    self.__dict__['_module'] = module
+        return module
+
+    def __getattr__(self, attribute):
+        return getattr(self._load(), attribute)
+
+    def __setattr__(self, attribute, value):
+        # Keep monkeypatching (e.g. in tests) working on the real module
+        setattr(self._load(), attribute, value)
+
+    def __dir__(self):
+        return dir(self._load())
+
+
+def lazy_module(name):
+    """Return a stand-in for ``name`` that is imported on first attribute access."""
+    return LazyModule(name)
+
+
+def module_available(name):
+    """Check whether a module can be imported, without importing it."""
+    try:
+        return importlib.util.find_spec(name) is not None
+    except (ImportError, ValueError):
+        return False
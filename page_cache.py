@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+"""
+RemNote Page-Level Card Cache
+----------------------------
+Stores the flashcards generated for each PDF page under the hash of that
+page's content (and the prompt hash), so an edited document only re-sends
+the pages that changed; its ``_flashcards.txt`` is re-assembled from the
+cached results of the others. A page that appears in several documents
+is generated once.
+
+Page hashing needs the optional ``pypdf`` package; without it documents
+are processed as whole files.
+"""
+
+import os
+import json
+import threading
+import hashlib
+
+from pdf_text import pypdf, PYPDF_AVAILABLE
+
+# Name of the page cache directory kept next to the generated outputs
+PAGE_CACHE_DIRNAME = '.page_cards'
+
+# Times a page may come back without cards before that is cached as its result
+EMPTY_PAGE_ATTEMPTS = 3
+
+
+def _hash_object(obj, digest, seen):
+    """Feed a page resource (streams, dictionaries, arrays) into a digest."""
+    obj = obj.get_object() if hasattr(obj, 'get_object') else obj
+    if id(obj) in seen:
+        return
+    seen.add(id(obj))
+
+    if isinstance(obj, pypdf.generic.StreamObject):
+        digest.update(obj.get_data())
+    if isinstance(obj, dict):
+        for key in sorted(obj):
+            # Parent links lead back to the page tree, not to page content
+            if key in ('/Parent', '/Length'):
+                continue
+            digest.update(str(key).encode('utf-8'))
+            _hash_object(obj[key], digest, seen)
+    elif isinstance(obj, list):
+        for item in obj:
+            _hash_object(item, digest, seen)
+    else:
+        digest.update(repr(obj).encode('utf-8'))
+
+
+def compute_page_hashes(file_path):
+    """Return one content hash per page of a PDF, or None if it can't be read.
+
+    A page's hash covers its content stream, the images and forms it draws
+    and its geometry, so re-exporting a document leaves unchanged pages
+    with unchanged hashes.
+    """
+    if not PYPDF_AVAILABLE:
+        return None
+    try:
+        reader = pypdf.PdfReader(file_path)
+        hashes = []
+        for page in reader.pages:
+            digest = hashlib.sha256()
+            contents = page.get_contents()
+            digest.update(contents.get_data() if contents is not None else b'')
+            resources = page.get('/Resources') or {}
+            _hash_object(resources.get('/XObject') or {}, digest, set())
+            for key in ('/MediaBox', '/CropBox', '/Rotate'):
+                digest.update(repr(page.get(key)).encode('utf-8'))
+            hashes.append(digest.hexdigest())
+        return hashes
+    except Exception:
+        return None
+
+
+class PageCardCache:
+    """Per-page flashcards plus the page hashes of each document version.
+
+    A ``read_only`` cache never writes (dry runs).
+    """
+
+    def __init__(self, directory, read_only=False):
+        self.directory = directory
+        self.read_only = read_only
+
+    def _write(self, path, text):
+        """Write a file atomically; other threads and hosts may read concurrently."""
+        if self.read_only:
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(text)
+        os.replace(tmp_path, path)
+
+    def _read_json(self, path):
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    # Page hashes
+
+    def page_hashes(self, file_path, file_digest):
+        """Return the page hashes of a PDF, computing them once per file content."""
+        path = os.path.join(self.directory, 'documents', f"{file_digest}.json")
+        hashes = self._read_json(path)
+        if hashes is None:
+            hashes = compute_page_hashes(file_path)
+            if hashes is not None:
+                self._write(path, json.dumps(hashes))
+        return hashes
+
+    # Page cards
+
+    def _card_path(self, page_digest, prompt_digest):
+        return os.path.join(self.directory, 'pages', f"{page_digest}_{prompt_digest}.txt")
+
+    def get(self, page_digest, prompt_digest):
+        """Return the cached flashcards of a page, or None."""
+        try:
+            with open(self._card_path(page_digest, prompt_digest), 'r', encoding='utf-8') as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def set(self, page_digest, prompt_digest, content):
+        """Store the flashcards generated for a page."""
+        self._write(self._card_path(page_digest, prompt_digest), content)
+
+    def _empty_path(self, page_digest, prompt_digest):
+        return os.path.join(self.directory, 'empty', f"{page_digest}_{prompt_digest}.json")
+
+    def record_empty(self, page_digest, prompt_digest):
+        """Count a generation of a page that produced no flashcards.
+
+        A page without cards may be a title or blank page, or a response
+        that went wrong, so it stays uncached (and is sent again next run)
+        until it has come back empty EMPTY_PAGE_ATTEMPTS times. Returns True
+        once the empty result is cached as final.
+        """
+        path = self._empty_path(page_digest, prompt_digest)
+        attempts = (self._read_json(path) or 0) + 1
+        if attempts < EMPTY_PAGE_ATTEMPTS:
+            self._write(path, json.dumps(attempts))
+            return False
+
+        self.set(page_digest, prompt_digest, '')
+        if not self.read_only:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        return True
+
+    def stale_pages(self, page_hashes, prompt_digest):
+        """Return the (0-based) numbers of pages without cached flashcards."""
+        return [number for number, page_digest in enumerate(page_hashes)
+                if not os.path.exists(self._card_path(page_digest, prompt_digest))]
+
+    # Assembled outputs
+
+    def _assembled_path(self, output_file):
+        return os.path.join(self.directory, 'assembled', os.path.basename(output_file) + '.json')
+
+    def is_assembled(self, output_file, file_digest, prompt_digest):
+        """Check whether an output file was assembled from this document version and prompt."""
+        if not os.path.exists(output_file):
+            return False
+        record = self._read_json(self._assembled_path(output_file))
+        return record == {"file": file_digest, "prompt": prompt_digest}
+
+    def record_assembled(self, output_file, file_digest, prompt_digest):
+        """Record the document version and prompt an output file was assembled from."""
+        self._write(self._assembled_path(output_file), json.dumps({"file": file_digest, "prompt": prompt_digest}))
@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+"""
+RemNote PDF Text Layer
+---------------------
+Pre-pass that reads the text layer of digitally produced PDFs so their
+pages can be sent to the model as plain text instead of an uploaded file.
+Pages without a usable text layer (scans) or with images, form XObjects
+or vector drawings (diagrams, photos, charts) still go through the file
+upload, as a PDF holding only those pages. Extracted text is cached by the file's content hash.
+
+Text extraction needs the optional ``pypdf`` package; without it every PDF
+is uploaded as before.
+"""
+
+import os
+import json
+import tempfile
+import threading
+
+from lazy_import import lazy_module, module_available
+
+# Optional dependency, imported on first use
+pypdf = lazy_module('pypdf')
+PYPDF_AVAILABLE = module_available('pypdf')
+
+# Pages with less extracted text than this are treated as scanned
+MIN_PAGE_CHARS = 200
+
+# Bump when the extraction rules change so cached results are redone
+EXTRACTION_VERSION = 2
+
+# Name of the text cache directory kept next to the generated outputs
+TEXT_CACHE_DIRNAME = '.text_cache'
+
+
+# Path operators (segments and rectangles) a page may use for rules,
+# underlines and table borders before it is treated as a drawing
+MAX_PATH_OPERATORS = 50
+
+PATH_OPERATORS = {b'm', b'l', b'c', b'v', b'y', b're'}
+
+
+def _has_xobject_graphics(page):
+    """Check whether a page draws image or form XObjects."""
+    resources = page.get('/Resources') or {}
+    xobjects = resources.get('/XObject') or {}
+    # Form XObjects can hold vector diagrams or images of their own
+    return any(xobject.get_object().get('/Subtype') in ('/Image', '/Form') for xobject in xobjects.values())
+
+
+def _has_drawing(page):
+    """Check whether a page's content stream draws inline images, shadings or many paths."""
+    contents = page.get_contents()
+    if contents is None:
+        return False
+    paths = 0
+    for _, operator in contents.operations:
+        if operator in (b'INLINE IMAGE', b'sh'):
+            return True
+        if operator in PATH_OPERATORS:
+            paths += 1
+            if paths > MAX_PATH_OPERATORS:
+                return True
+    return False
+
+
+def _has_graphics(page):
+    """Check whether a page shows images or diagrams the text layer can't carry."""
+    try:
+        return _has_xobject_graphics(page) or _has_drawing(page)
+    except Exception:
+        # Unusual resource dictionaries or content streams: upload the page to be safe
+        return True
+
+
+def extract_pages(file_path):
+    """Return the text of each page of a PDF, with None for pages to upload.
+
+    A page is sent as text only if its text layer has at least
+    MIN_PAGE_CHARS characters and it shows no images, form XObjects or
+    vector drawings. Returns None when
+    pypdf is not installed or the PDF can't be read.
+    """
+    if not PYPDF_AVAILABLE:
+        return None
+    try:
+        reader = pypdf.PdfReader(file_path)
+        pages = []
+        for page in reader.pages:
+            text = (page.extract_text() or '').strip()
+            pages.append(text if len(text) >= MIN_PAGE_CHARS and not _has_graphics(page) else None)
+        return pages
+    except Exception:
+        return None
+
+
+def write_page_subset(file_path, page_numbers):
+    """Write the given (0-based) pages of a PDF to a temporary file and return its path."""
+    reader = pypdf.PdfReader(file_path)
+    writer = pypdf.PdfWriter()
+    for number in page_numbers:
+        writer.add_page(reader.pages[number])
+
+    stem = os.path.splitext(os.path.basename(file_path))[0]
+    fd, subset_path = tempfile.mkstemp(prefix=f"{stem}_pages_", suffix='.pdf')
+    with os.fdopen(fd, 'wb') as f:
+        writer.write(f)
+    return subset_path
+
+
+def format_text_pages(pages):
+    """Join extracted pages into one text document with page markers.
+
+    Pages without text are marked as attached, so the model can keep the
+    document order when it reads the uploaded pages alongside the text.
+    """
+    sections = []
+    for number, text in enumerate(pages, start=1):
+        if text is None:
+            sections.append(f"--- Page {number}: see the attached PDF pages ---")
+        else:
+            sections.append(f"--- Page {number} ---\n{text}")
+    return "Text of the document, page by page:\n\n" + "\n\n".join(sections)
+
+
+class TextCache:
+    """Extracted page text stored as one JSON file per PDF content hash."""
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def _path(self, digest):
+        return os.path.join(self.directory, f"{digest}.json")
+
+    def get(self, digest):
+        """Return the cached pages for a content hash, or None."""
+        try:
+            with open(self._path(digest), 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if data.get('version') != EXTRACTION_VERSION:
+            return None
+        return data.get('pages')
+
+    def set(self, digest, pages):
+        """Store the pages extracted from a PDF."""
+        os.makedirs(self.directory, exist_ok=True)
+        # Write to a temporary file first; other processes may read concurrently
+        path = self._path(digest)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'version': EXTRACTION_VERSION, 'pages': pages}, f)
+        os.replace(tmp_path, path)
+
+
+def load_pages(file_path, cache=None, digest=None):
+    """Return a PDF's extracted pages (see extract_pages), using ``cache`` if given."""
+    if cache is None or digest is None:
+        return extract_pages(file_path)
+
+    pages = cache.get(digest)
+    if pages is None:
+        pages = extract_pages(file_path)
+        # Unreadable PDFs and a missing pypdf are not cached: both may change
+        if pages is not None:
+            cache.set(digest, pages)
+    return pages
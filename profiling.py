@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+"""
+RemNote Profiling
+----------------
+Built-in profiler for finding where a batch spends its time:
+
+- spans (``with span('upload', file=name):``) record a per-file timeline
+  of scanning, uploads, model calls, retry sleeps and file writes, written
+  as Chrome trace-event JSON (open it in chrome://tracing or Perfetto)
+- a sampling thread records the Python stacks of every thread that is
+  inside a span, including the thread-pool workers, prefixed with the
+  spans they are in, so the folded output gives a flame graph per file
+  (open it in speedscope or flamegraph.pl)
+
+Spans cost next to nothing while no profiler is running.
+"""
+
+import os
+import sys
+import json
+import time
+import threading
+import contextlib
+import contextvars
+import collections
+
+# Seconds between stack samples
+SAMPLE_INTERVAL = 0.005
+
+# Trace events kept in memory; the oldest are dropped beyond this
+MAX_EVENTS = 500000
+
+# Distinct sampled stacks kept in memory; samples of new stacks beyond this
+# are counted under OTHER_STACK (span labels carry file names, so a
+# long-running web worker would otherwise keep adding stacks)
+MAX_STACKS = 20000
+OTHER_STACK = '(other stacks)'
+
+# Spans the current context is inside, outermost first
+_spans = contextvars.ContextVar('profiling_spans', default=())
+
+# Spans the current thread itself has open; threads started with a copied
+# context inherit its spans but not this depth
+_local = threading.local()
+
+# The running profiler, if any
+_active = None
+
+
+def _label(name, args):
+    """Label a span in stack samples, e.g. ``process_file notes.pdf``."""
+    subject = args.get('file')
+    return f"{name} {subject}" if subject else name
+
+
+@contextlib.contextmanager
+def span(name, category='flashcards', **args):
+    """Record the enclosed block as a span of the running profiler."""
+    profiler = _active
+    if profiler is None:
+        yield
+        return
+
+    parent = _spans.get()
+    stack = parent + (_label(name, args),)
+    token = _spans.set(stack)
+    ident = threading.get_ident()
+    profiler._thread_spans[ident] = stack
+    depth = getattr(_local, 'depth', 0)
+    _local.depth = depth + 1
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        ended = time.perf_counter()
+        _spans.reset(token)
+        _local.depth = depth
+        # Once the thread's own outermost span exits, drop its entry even if
+        # it inherited spans, so finished threads (retry attempts) don't linger
+        if depth:
+            profiler._thread_spans[ident] = parent
+        else:
+            profiler._thread_spans.pop(ident, None)
+        profiler.record(name, category, started, ended, args)
+
+
+class Profiler:
+    """Collects spans and stack samples from every thread of the process."""
+
+    def __init__(self, sample_interval=SAMPLE_INTERVAL, max_stacks=MAX_STACKS):
+        self.sample_interval = sample_interval
+        self.max_stacks = max_stacks
+        self.pid = os.getpid()
+        self.samples = collections.Counter()
+        self._events = collections.deque(maxlen=MAX_EVENTS)
+        self._thread_names = {}
+        self._thread_spans = {}
+        self._origin = time.perf_counter()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._sampler = None
+
+    def start(self):
+        """Start recording spans and sampling stacks."""
+        global _active
+        _active = self
+        self._sampler = threading.Thread(target=self._sample_loop, name='profiler', daemon=True)
+        self._sampler.start()
+        return self
+
+    def stop(self):
+        """Stop recording; the collected data stays available."""
+        global _active
+        if _active is self:
+            _active = None
+        self._stop.set()
+        if self._sampler is not None:
+            self._sampler.join()
+
+    def record(self, name, category, started, ended, args):
+        """Add a complete span event (times from time.perf_counter)."""
+        thread = threading.current_thread()
+        tid = thread.native_id
+        event = {
+            "name": name,
+            "cat": category,
+            "ph": "X",
+            "ts": round((started - self._origin) * 1e6, 1),
+            "dur": round((ended - started) * 1e6, 1),
+            "pid": self.pid,
+            "tid": tid,
+            "args": {key: str(value) for key, value in args.items()}
+        }
+        with self._lock:
+            self._thread_names.setdefault(tid, thread.name)
+            self._events.append(event)
+
+    def _sample_loop(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.sample_interval):
+            frames = sys._current_frames()
+            for ident, frame in frames.items():
+                spans = self._thread_spans.get(ident)
+                if ident == own or not spans:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                    frame = frame.f_back
+                self.add_sample(';'.join(list(spans) + stack[::-1]))
+
+    def add_sample(self, stack):
+        """Count one sample of a folded stack, within the max_stacks limit."""
+        with self._lock:
+            if stack not in self.samples and len(self.samples) >= self.max_stacks:
+                stack = OTHER_STACK
+            self.samples[stack] += 1
+
+    def trace(self):
+        """Return the spans as a Chrome trace-event JSON object."""
+        with self._lock:
+            events = list(self._events)
+            names = dict(self._thread_names)
+        metadata = [
+            {"name": "process_name", "ph": "M", "pid": self.pid, "tid": 0,
+             "args": {"name": f"flashcards ({self.pid})"}}
+        ] + [
+            {"name": "thread_name", "ph": "M", "pid": self.pid, "tid": tid, "args": {"name": name}}
+            for tid, name in names.items()
+        ]
+        return {"traceEvents": metadata + events, "displayTimeUnit": "ms"}
+
+    def folded_stacks(self):
+        """Return the stack samples in folded format (``frame;frame;... count``)."""
+        with self._lock:
+            samples = sorted(self.samples.items())
+        return ''.join(f"{stack} {count}\n" for stack, count in samples)
+
+    def write(self, directory, suffix=''):
+        """Write ``trace<suffix>.json`` and ``stacks<suffix>.folded``; returns both paths."""
+        os.makedirs(directory, exist_ok=True)
+        trace_path = os.path.join(directory, f"trace{suffix}.json")
+        stacks_path = os.path.join(directory, f"stacks{suffix}.folded")
+        with open(trace_path, 'w', encoding='utf-8') as f:
+            json.dump(self.trace(), f)
+        with open(stacks_path, 'w', encoding='utf-8') as f:
+            f.write(self.folded_stacks())
+        return trace_path, stacks_path
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+RemNote Prompt Registry
+----------------------
+Keeps track of prompt templates by the hash of their text rather than by
+their name. Every output directory holds a small ``prompt_registry.json``
+that records the current hash and version of each named prompt and which
+output files were produced from which prompt hash, so callers can re-run
+only the prompts whose text actually changed.
+"""
+
+import os
+import re
+import json
+import hashlib
+import threading
+
+# Name of the registry file kept next to the generated outputs
+REGISTRY_FILENAME = 'prompt_registry.json'
+
+# Number of hex characters of the SHA-256 digest used in filenames
+HASH_LENGTH = 12
+
+
+def prompt_hash(prompt_text):
+    """Return the content hash of a prompt template."""
+    # Surrounding whitespace is not meaningful to the model, so ignore it
+    normalized = prompt_text.strip().replace('\r\n', '\n')
+    return hashlib.sha256(normalized.encode('utf-8')).hexdigest()[:HASH_LENGTH]
+
+
+def parse_prompts_markdown(prompts_file):
+    """Parse ``## Name`` + fenced code block sections from a markdown file."""
+    with open(prompts_file, 'r', encoding='utf-8') as f:
+        content = f.read()
+
+    pattern = r'## ([^\n]+)\n```\n(.*?)\n```'
+    matches = re.findall(pattern, content, re.DOTALL)
+
+    prompts = {}
+    for title, prompt_text in matches:
+        prompts[title.strip()] = prompt_text.strip()
+    return prompts
+
+
+class PromptRegistry:
+    """Registry of prompt templates and the outputs generated from them.
+
+    A ``read_only`` registry reads its file but never writes it (dry runs).
+    """
+
+    def __init__(self, path=None, read_only=False):
+        self.path = path
+        self.read_only = read_only
+        self.prompts = {}
+        self.outputs = {}
+        self._lock = threading.Lock()
+
+        if path and os.path.exists(path):
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+                self.prompts = data.get('prompts', {})
+                self.outputs = data.get('outputs', {})
+            except (OSError, ValueError):
+                # A corrupt registry only costs us a re-run, never a crash
+                self.prompts = {}
+                self.outputs = {}
+
+    @classmethod
+    def for_directory(cls, output_dir, read_only=False):
+        """Open the registry stored in an output directory."""
+        return cls(os.path.join(output_dir, REGISTRY_FILENAME), read_only)
+
+    def register(self, name, prompt_text):
+        """Register a prompt and return its entry (name, hash, version, text).
+
+        The version is bumped every time the text of a named prompt changes.
+        """
+        digest = prompt_hash(prompt_text)
+        with self._lock:
+            entry = self.prompts.get(name)
+            if entry is None:
+                entry = {"hash": digest, "version": 1, "history": [digest]}
+                self.prompts[name] = entry
+                self._save_locked()
+            elif entry["hash"] != digest:
+                entry["hash"] = digest
+                entry["version"] += 1
+                entry.setdefault("history", []).append(digest)
+                self._save_locked()
+
+        return {
+            "name": name,
+            "hash": digest,
+            "version": entry["version"],
+            "text": prompt_text
+        }
+
+    def register_all(self, prompts):
+        """Register a ``{name: text}`` mapping and return ``{name: entry}``."""
+        return {name: self.register(name, text) for name, text in prompts.items()}
+
+    def output_is_current(self, output_file, digest):
+        """Check whether an output file exists and was made with this prompt hash.
+
+        Outputs that predate the registry have no recorded hash; they are
+        adopted as current instead of forcing a full re-run.
+        """
+        if not os.path.exists(output_file):
+            return False
+
+        key = os.path.basename(output_file)
+        with self._lock:
+            recorded = self.outputs.get(key)
+            if recorded is None:
+                self.outputs[key] = digest
+                self._save_locked()
+                return True
+            return recorded == digest
+
+    def record_output(self, output_file, digest):
+        """Record that an output file was generated from the given prompt hash."""
+        with self._lock:
+            self.outputs[os.path.basename(output_file)] = digest
+            self._save_locked()
+
+    def _save_locked(self):
+        """Write the registry to disk (caller must hold the lock)."""
+        if not self.path or self.read_only:
+            return
+
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({"prompts": self.prompts, "outputs": self.outputs}, f, indent=2, sort_keys=True)
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,350 @@
+#!/usr/bin/env python3
+"""
+RemNote Retry Policy
+-------------------
+A reusable retry policy for Gemini API calls:
+
+- errors are classified by exception type / HTTP status rather than by
+  substring-matching "429"
+- retries use exponential backoff with full jitter, honouring the server's
+  ``retry_delay`` hint on rate limits
+- every attempt has a deadline, so a hung call frees its worker
+- optionally, an attempt that runs past the observed p95 latency of
+  similar-sized requests is hedged with a duplicate request and the first
+  response wins
+- a CancelToken aborts the wait for an attempt and any backoff sleep
+- with ``max_in_flight``, requests still running after being abandoned
+  (timed out, cancelled, out-raced) keep their slot until they return, so
+  the real number of concurrent API calls never exceeds the cap
+"""
+
+import re
+import time
+import random
+import functools
+import threading
+import contextvars
+import collections
+import concurrent.futures
+
+from cancellation import Cancelled
+from profiling import span
+
+# Error kinds
+RATE_LIMIT = 'rate_limit'
+TRANSIENT = 'transient'
+TIMEOUT = 'timeout'
+FATAL = 'fatal'
+CANCELLED = 'cancelled'
+
+# Default delay when a rate-limit error carries no retry hint
+DEFAULT_RATE_LIMIT_DELAY = 10
+
+# How often a waiting attempt checks its cancel token (seconds)
+CANCEL_CHECK_INTERVAL = 0.5
+
+
+class AttemptTimeout(Exception):
+    """Raised when a single attempt exceeds its deadline."""
+
+
+def _exception_types(google_exceptions, *names):
+    """Resolve google.api_core exception classes that exist in this version."""
+    if google_exceptions is None:
+        return ()
+    return tuple(getattr(google_exceptions, name) for name in names if hasattr(google_exceptions, name))
+
+
+@functools.lru_cache(maxsize=None)
+def _error_types():
+    """Return the google.api_core exception classes per error kind.
+
+    Imported on the first error rather than at startup, as google.api_core
+    is a heavy import.
+    """
+    try:
+        from google.api_core import exceptions as google_exceptions
+    except ImportError:  # pragma: no cover - google-api-core ships with google-generativeai
+        google_exceptions = None
+
+    return {
+        RATE_LIMIT: _exception_types(google_exceptions, 'ResourceExhausted', 'TooManyRequests'),
+        TRANSIENT: _exception_types(google_exceptions, 'ServiceUnavailable', 'InternalServerError', 'BadGateway',
+                                    'GatewayTimeout', 'Aborted', 'Unknown'),
+        TIMEOUT: _exception_types(google_exceptions, 'DeadlineExceeded'),
+        FATAL: _exception_types(google_exceptions, 'InvalidArgument', 'BadRequest', 'PermissionDenied',
+                                'Forbidden', 'Unauthenticated', 'Unauthorized', 'NotFound', 'FailedPrecondition')
+    }
+
+
+def _status_code(exc):
+    """Return the HTTP status attached to an exception, if any."""
+    for attribute in ('code', 'status_code'):
+        value = getattr(exc, attribute, None)
+        if isinstance(value, int):
+            return value
+    response = getattr(exc, 'response', None)
+    value = getattr(response, 'status_code', None)
+    return value if isinstance(value, int) else None
+
+
+def classify_error(exc):
+    """Classify an exception as rate_limit, transient, timeout, fatal or cancelled."""
+    if isinstance(exc, Cancelled):
+        return CANCELLED
+    error_types = _error_types()
+    if isinstance(exc, (AttemptTimeout, concurrent.futures.TimeoutError) + error_types[TIMEOUT]):
+        return TIMEOUT
+    for kind in (RATE_LIMIT, TRANSIENT, FATAL):
+        if error_types[kind] and isinstance(exc, error_types[kind]):
+            return kind
+
+    status = _status_code(exc)
+    if status == 429:
+        return RATE_LIMIT
+    if status in (408, 504):
+        return TIMEOUT
+    if status is not None and status >= 500:
+        return TRANSIENT
+    if status is not None and 400 <= status < 500:
+        return FATAL
+
+    if isinstance(exc, (ConnectionError, TimeoutError)):
+        return TRANSIENT
+    if isinstance(exc, (ValueError, TypeError, KeyError, FileNotFoundError, PermissionError)):
+        # Programming and input errors will not fix themselves
+        return FATAL
+
+    # Unknown failures are retried, as the original retry loops did
+    return TRANSIENT
+
+
+def retry_after(exc):
+    """Extract the server's ``retry_delay`` hint (seconds) from an error, if any."""
+    match = re.search(r'retry_delay\s*{\s*seconds:\s*(\d+)', str(exc))
+    return int(match.group(1)) if match else None
+
+
+class LatencyTracker:
+    """Rolling window of successful call latencies per operation."""
+
+    def __init__(self, window=200):
+        self._samples = collections.defaultdict(lambda: collections.deque(maxlen=window))
+        self._lock = threading.Lock()
+
+    def record(self, name, seconds):
+        with self._lock:
+            self._samples[name].append(seconds)
+
+    def quantile(self, name, q, min_samples=1):
+        """Return the q-quantile of recorded latencies, or None without enough samples."""
+        with self._lock:
+            samples = sorted(self._samples[name])
+        if len(samples) < min_samples:
+            return None
+        index = min(len(samples) - 1, int(round(q * (len(samples) - 1))))
+        return samples[index]
+
+
+# Shared by every policy in the process so hedging learns from all calls
+latency_tracker = LatencyTracker()
+
+
+def latency_key(operation, weight=None):
+    """Key latencies by operation and a power-of-two bucket of the request size.
+
+    ``weight`` is any size measure (e.g. pages sent); a 1-page request and a
+    200-page document are never compared with each other.
+    """
+    if not weight:
+        return operation
+    return f"{operation}/{1 << (max(1, int(weight)) - 1).bit_length()}"
+
+
+def _start_attempt(fn, args, kwargs, slots=None):
+    """Run one attempt on a daemon thread and return its Future.
+
+    A daemon thread (rather than a pool) means an attempt that never returns
+    cannot block a worker or interpreter shutdown. The attempt runs in a copy
+    of the caller's context, so profiling spans nest under the caller's. A
+    slot already taken from ``slots`` is released when the attempt returns,
+    even if nobody waits for it any more.
+    """
+    future = concurrent.futures.Future()
+    context = contextvars.copy_context()
+
+    def run():
+        try:
+            if not future.set_running_or_notify_cancel():
+                return
+            try:
+                future.set_result(context.run(fn, *args, **kwargs))
+            except BaseException as exc:
+                future.set_exception(exc)
+        finally:
+            if slots is not None:
+                slots.release()
+
+    threading.Thread(target=run, name='api-attempt', daemon=True).start()
+    return future
+
+
+def _discard_results(futures, discard):
+    """Hand the results of abandoned attempts to ``discard`` once they arrive."""
+    def on_done(future):
+        if not future.cancelled() and future.exception() is None:
+            try:
+                discard(future.result())
+            except Exception:
+                pass
+
+    for future in futures:
+        future.add_done_callback(on_done)
+
+
+class RetryPolicy:
+    """Retry an API call with classified errors, jittered backoff, deadlines and hedging."""
+
+    def __init__(self, max_attempts=4, base_delay=1.0, max_delay=60.0, attempt_timeout=300.0,
+                 hedge=False, hedge_quantile=0.95, hedge_min_samples=20, tracker=None, max_in_flight=None):
+        self.max_attempts = max(1, max_attempts)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.attempt_timeout = attempt_timeout
+        self.hedge = hedge
+        self.hedge_quantile = hedge_quantile
+        self.hedge_min_samples = hedge_min_samples
+        self.tracker = tracker or latency_tracker
+        # Requests running at once across every call, abandoned ones included
+        self.max_in_flight = max_in_flight
+        self._slots = threading.BoundedSemaphore(max_in_flight) if max_in_flight else None
+
+    def backoff(self, attempt, kind, exc=None):
+        """Return the delay before the next attempt (attempt numbers start at 1)."""
+        ceiling = min(self.max_delay, self.base_delay * (2 ** (attempt - 1)))
+        delay = random.uniform(0, ceiling)
+        if kind == RATE_LIMIT:
+            hint = retry_after(exc) if exc is not None else None
+            floor = hint if hint is not None else min(DEFAULT_RATE_LIMIT_DELAY, self.max_delay)
+            delay = floor + random.uniform(0, ceiling)
+        return delay
+
+    def call(self, fn, *args, operation='generate', weight=None, on_retry=None, cancel=None, discard=None,
+             **kwargs):
+        """Call ``fn(*args, **kwargs)`` under this policy and return its result.
+
+        ``on_retry(attempt, max_attempts, delay, error, kind)`` is called before
+        each backoff sleep. The last error is re-raised when attempts run out
+        or the error is fatal. With a ``cancel`` token, Cancelled is raised as
+        soon as the token is cancelled, even mid-attempt or mid-sleep.
+        ``discard(result)`` is called with the result of any attempt that
+        completes after being abandoned (timed out, cancelled or out-raced by
+        a hedge), e.g. to delete an upload nobody will use. ``weight`` (e.g.
+        pages sent) picks the latency bucket used for hedging.
+        """
+        operation = latency_key(operation, weight)
+        sleep = cancel.sleep if cancel is not None else time.sleep
+        attempt = 0
+        while True:
+            attempt += 1
+            if cancel is not None:
+                cancel.raise_if_cancelled()
+            started = time.monotonic()
+            try:
+                with span('attempt', operation=operation, attempt=attempt):
+                    result = self._attempt(fn, args, kwargs, operation, cancel, discard)
+            except Exception as exc:
+                kind = classify_error(exc)
+                if kind in (FATAL, CANCELLED) or attempt >= self.max_attempts:
+                    raise
+                delay = self.backoff(attempt, kind, exc)
+                if on_retry:
+                    on_retry(attempt, self.max_attempts, delay, exc, kind)
+                with span('retry sleep', kind=kind, delay=f"{delay:.1f}"):
+                    sleep(delay)
+                continue
+
+            self.tracker.record(operation, time.monotonic() - started)
+            return result
+
+    def _acquire_slot(self, cancel=None):
+        """Wait for a free request slot (no-op without ``max_in_flight``)."""
+        if self._slots is None or self._slots.acquire(blocking=False):
+            return
+        with span('slot wait'):
+            while not self._slots.acquire(timeout=CANCEL_CHECK_INTERVAL):
+                if cancel is not None:
+                    cancel.raise_if_cancelled()
+
+    def _attempt(self, fn, args, kwargs, operation, cancel=None, discard=None):
+        """Run one attempt, enforcing its deadline and hedging slow calls."""
+        # An earlier attempt abandoned by this or another call may still be
+        # running; wait until it, or some other request, frees a slot
+        self._acquire_slot(cancel)
+
+        if not self.attempt_timeout and not self.hedge and cancel is None:
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                if self._slots is not None:
+                    self._slots.release()
+
+        started = time.monotonic()
+        deadline = started + self.attempt_timeout if self.attempt_timeout else None
+
+        hedge_at = None
+        if self.hedge:
+            p95 = self.tracker.quantile(operation, self.hedge_quantile, self.hedge_min_samples)
+            if p95 is not None:
+                hedge_at = started + p95
+
+        futures = [_start_attempt(fn, args, kwargs, self._slots)]
+        try:
+            return self._wait(futures, fn, args, kwargs, operation, cancel, deadline, hedge_at)
+        finally:
+            # Requests still running are abandoned; clean up what they return
+            if discard is not None:
+                _discard_results(futures, discard)
+
+    def _wait(self, futures, fn, args, kwargs, operation, cancel, deadline, hedge_at):
+        """Wait for the first successful attempt among ``futures``, hedging if due.
+
+        ``futures`` is updated in place: the winner and failed attempts are
+        removed, so what is left when this returns or raises was abandoned.
+        """
+        hedged = False
+        while True:
+            now = time.monotonic()
+            if deadline is not None and now >= deadline:
+                raise AttemptTimeout(f"{operation} did not finish within {self.attempt_timeout:.0f}s")
+
+            wake_times = [t for t in (deadline, None if hedged else hedge_at) if t is not None]
+            if cancel is not None:
+                # Wake regularly to notice cancellation; the abandoned request
+                # finishes on its daemon thread and cleans up after itself
+                cancel.raise_if_cancelled()
+                wake_times.append(now + CANCEL_CHECK_INTERVAL)
+            timeout = max(0.0, min(wake_times) - now) if wake_times else None
+            done, _ = concurrent.futures.wait(futures, timeout=timeout,
+                                              return_when=concurrent.futures.FIRST_COMPLETED)
+
+            errors = []
+            for future in done:
+                if future.exception() is None:
+                    futures.remove(future)
+                    return future.result()
+                errors.append(future.exception())
+
+            # Keep waiting on the other request if only one of them failed
+            for future in done:
+                futures.remove(future)
+            if not futures:
+                raise errors[-1]
+
+            # The call is slower than p95 of recent similar calls: send a
+            # duplicate, but only if a request slot is free right now
+            if not hedged and hedge_at is not None and time.monotonic() >= hedge_at:
+                if self._slots is None or self._slots.acquire(blocking=False):
+                    with span('hedge', operation=operation):
+                        futures.append(_start_attempt(fn, args, kwargs, self._slots))
+                hedged = True
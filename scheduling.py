@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+"""
+RemNote Batch Scheduling
+-----------------------
+Pre-flight estimates of tokens, latency and cost for each input file, used
+to submit work largest-first (so a huge PDF is never the tail of a batch),
+to cap a batch at a token budget and to project the duration of a dry run.
+
+The estimates only read file headers; nothing is sent to the API.
+"""
+
+import os
+import re
+import heapq
+import struct
+
+# Gemini bills each PDF page and each small image as a fixed number of tokens
+TOKENS_PER_PAGE = 258
+
+# Images larger than this (in both dimensions) are split into 768x768 tiles
+SMALL_IMAGE_SIZE = 384
+IMAGE_TILE_SIZE = 768
+
+# Rough number of flashcard tokens the model writes per page
+OUTPUT_TOKENS_PER_PAGE = 400
+
+# Latency model: fixed request overhead + upload time + generation time
+BASE_LATENCY_SECONDS = 3.0
+UPLOAD_BYTES_PER_SECOND = 2 * 1024 * 1024
+OUTPUT_TOKENS_PER_SECOND = 150
+
+# gemini-2.0-flash list prices in USD per million tokens
+INPUT_PRICE_PER_MILLION = 0.10
+OUTPUT_PRICE_PER_MILLION = 0.40
+
+# Free tier request quota for gemini-2.0-flash
+DEFAULT_REQUESTS_PER_MINUTE = 15
+
+
+def pdf_page_count(file_path):
+    """Count the pages of a PDF by scanning its page objects."""
+    with open(file_path, 'rb') as f:
+        data = f.read()
+
+    pages = len(re.findall(rb'/Type\s*/Page(?!s)', data))
+    if pages == 0:
+        # Compressed object streams hide page objects; fall back to /Count
+        counts = [int(count) for count in re.findall(rb'/Count\s+(\d+)', data)]
+        pages = max(counts) if counts else 1
+    return max(pages, 1)
+
+
+def image_dimensions(file_path):
+    """Return ``(width, height)`` of a PNG or JPEG image, or None if unknown."""
+    with open(file_path, 'rb') as f:
+        header = f.read(26)
+
+        # PNG: dimensions live in the IHDR chunk right after the signature
+        if header.startswith(b'\x89PNG\r\n\x1a\n'):
+            width, height = struct.unpack('>II', header[16:24])
+            return width, height
+
+        # JPEG: walk the segments until a start-of-frame marker
+        if header.startswith(b'\xff\xd8'):
+            f.seek(2)
+            while True:
+                marker = f.read(2)
+                if len(marker) < 2 or marker[0] != 0xFF:
+                    return None
+                length_bytes = f.read(2)
+                if len(length_bytes) < 2:
+                    return None
+                length = struct.unpack('>H', length_bytes)[0]
+                if 0xC0 <= marker[1] <= 0xCF and marker[1] not in (0xC4, 0xC8, 0xCC):
+                    frame = f.read(5)
+                    if len(frame) < 5:
+                        return None
+                    height, width = struct.unpack('>HH', frame[1:5])
+                    return width, height
+                f.seek(length - 2, os.SEEK_CUR)
+
+    return None
+
+
+def image_tokens(dimensions):
+    """Estimate the input tokens of an image from its dimensions."""
+    if not dimensions:
+        return TOKENS_PER_PAGE
+
+    width, height = dimensions
+    if width <= SMALL_IMAGE_SIZE and height <= SMALL_IMAGE_SIZE:
+        return TOKENS_PER_PAGE
+
+    tiles_x = -(-width // IMAGE_TILE_SIZE)
+    tiles_y = -(-height // IMAGE_TILE_SIZE)
+    return tiles_x * tiles_y * TOKENS_PER_PAGE
+
+
+def estimate_file(file_path, prompt_text='', pages_sent=None):
+    """Estimate tokens, latency and cost of generating flashcards for one file.
+
+    With ``pages_sent``, only that many pages of a PDF are sent, one request
+    per page (page-level regeneration).
+    """
+    file_path = str(file_path)
+    size = os.path.getsize(file_path)
+    prompt_tokens = len(prompt_text) // 4
+    requests = 1
+
+    if file_path.lower().endswith('.pdf'):
+        pages = pdf_page_count(file_path)
+        if pages_sent is not None:
+            size = size * min(pages_sent, pages) // pages
+            pages = requests = pages_sent
+        content_tokens = pages * TOKENS_PER_PAGE
+    else:
+        pages = 1
+        content_tokens = image_tokens(image_dimensions(file_path))
+
+    input_tokens = content_tokens + prompt_tokens * requests
+    output_tokens = pages * OUTPUT_TOKENS_PER_PAGE
+    seconds = (BASE_LATENCY_SECONDS * requests + size / UPLOAD_BYTES_PER_SECOND
+               + output_tokens / OUTPUT_TOKENS_PER_SECOND)
+    cost = (input_tokens * INPUT_PRICE_PER_MILLION
+            + output_tokens * OUTPUT_PRICE_PER_MILLION) / 1_000_000
+
+    return {
+        "file_path": file_path,
+        "size": size,
+        "pages": pages,
+        "input_tokens": input_tokens,
+        "output_tokens": output_tokens,
+        "total_tokens": input_tokens + output_tokens,
+        "seconds": seconds,
+        "cost": cost
+    }
+
+
+def order_largest_first(estimates):
+    """Sort estimates longest-first to minimise the makespan of the batch."""
+    return sorted(estimates, key=lambda e: (e["seconds"], e["total_tokens"]), reverse=True)
+
+
+def apply_budget(estimates, budget_tokens):
+    """Split estimates into those that fit in a token budget and the rest.
+
+    Files are taken in the given order; a file that does not fit is deferred
+    and smaller files after it may still be selected.
+    """
+    if budget_tokens is None:
+        return list(estimates), []
+
+    selected = []
+    deferred = []
+    used = 0
+    for estimate in estimates:
+        if used + estimate["total_tokens"] <= budget_tokens:
+            selected.append(estimate)
+            used += estimate["total_tokens"]
+        else:
+            deferred.append(estimate)
+    return selected, deferred
+
+
+def project_batch(estimates, max_workers, requests_per_minute=DEFAULT_REQUESTS_PER_MINUTE):
+    """Project duration, tokens and cost of running estimates in the given order."""
+    max_workers = max(1, max_workers)
+
+    # Simulate the thread pool: each file goes to the worker that frees up first
+    workers = [0.0] * min(max_workers, max(1, len(estimates)))
+    heapq.heapify(workers)
+    for estimate in estimates:
+        start = heapq.heappop(workers)
+        heapq.heappush(workers, start + estimate["seconds"])
+    makespan = max(workers) if estimates else 0.0
+
+    # The request quota puts a floor under the duration of large batches
+    quota_seconds = 0.0
+    if requests_per_minute:
+        quota_seconds = len(estimates) / requests_per_minute * 60
+
+    return {
+        "files": len(estimates),
+        "input_tokens": sum(e["input_tokens"] for e in estimates),
+        "output_tokens": sum(e["output_tokens"] for e in estimates),
+        "total_tokens": sum(e["total_tokens"] for e in estimates),
+        "cost": sum(e["cost"] for e in estimates),
+        "seconds": max(makespan, quota_seconds),
+        "quota_limited": quota_seconds > makespan
+    }
+
+
+def format_projection(projection):
+    """Format a batch projection as a one-line summary."""
+    minutes, seconds = divmod(int(round(projection["seconds"])), 60)
+    limit = " (limited by request quota)" if projection["quota_limited"] else ""
+    return (f"{projection['files']} files, ~{projection['total_tokens']:,} tokens "
+            f"({projection['input_tokens']:,} in / {projection['output_tokens']:,} out), "
+            f"~${projection['cost']:.4f}, ~{minutes}m {seconds:02d}s{limit}")
@@ -0,0 +1,351 @@
+#!/usr/bin/env python3
+"""
+RemNote Shared State
+-------------------
+SQLite-backed state shared by every worker process of the web app:
+
+- a result cache keyed by file content hash + prompt hash
+- in-flight markers, so identical work arriving at different processes
+  runs once and the others wait for its cached result
+- a sliding-window rate limiter for API requests
+- a job store recording each batch and its per-file results
+
+SQLite handles the cross-process locking, so any number of WSGI workers
+on one machine can point at the same database file. Cached results and
+finished jobs are deleted once they are older than their retention period.
+"""
+
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import contextlib
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS cache (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL,
+    created REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS rate_events (
+    name TEXT NOT NULL,
+    ts REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS rate_events_name_ts ON rate_events (name, ts);
+CREATE INDEX IF NOT EXISTS cache_created ON cache (created);
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    total_files INTEGER NOT NULL DEFAULT 0,
+    processed_files INTEGER NOT NULL DEFAULT 0,
+    pid INTEGER,
+    created REAL NOT NULL,
+    updated REAL NOT NULL,
+    info TEXT NOT NULL DEFAULT '{}'
+);
+CREATE TABLE IF NOT EXISTS job_results (
+    job_id TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    file_name TEXT NOT NULL,
+    success INTEGER NOT NULL,
+    content TEXT,
+    error TEXT,
+    PRIMARY KEY (job_id, position)
+);
+CREATE INDEX IF NOT EXISTS jobs_updated ON jobs (updated);
+CREATE TABLE IF NOT EXISTS inflight (
+    key TEXT PRIMARY KEY,
+    pid INTEGER NOT NULL,
+    expires REAL NOT NULL
+);
+"""
+
+# Default retention (seconds) of cached results and of jobs with their results
+CACHE_RETENTION = 30 * 24 * 60 * 60
+JOB_RETENTION = 7 * 24 * 60 * 60
+
+# Finishing a job prunes old rows at most this often per process (seconds)
+PRUNE_INTERVAL = 60 * 60
+
+# An in-flight marker is ignored after this long, even if its process is alive
+INFLIGHT_TTL = 30 * 60
+
+# How often a process waiting on another's work checks for its result (seconds)
+INFLIGHT_POLL_INTERVAL = 1.0
+
+
+def file_hash(file_path):
+    """Return the SHA-256 of a file's contents."""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _process_alive(pid):
+    """Check whether a process on this machine is still running."""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def result_cache_key(file_digest, prompt_digest):
+    """Build the cache key for a file processed with a given prompt."""
+    return f"{file_digest}:{prompt_digest}"
+
+
+class SharedState:
+    """Cache, rate limiter and job store in one SQLite database.
+
+    Results cached longer than ``cache_retention`` seconds and jobs last
+    updated more than ``job_retention`` seconds ago are pruned when the
+    state is opened and, periodically, when a job finishes.
+    """
+
+    def __init__(self, path, cache_retention=CACHE_RETENTION, job_retention=JOB_RETENTION):
+        self.path = path
+        self.cache_retention = cache_retention
+        self.job_retention = job_retention
+        self._last_prune = 0.0
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+
+        with self._connect() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.executescript(SCHEMA)
+        self.prune()
+
+    @contextlib.contextmanager
+    def _connect(self):
+        """Open a connection; connections are cheap and never shared between threads."""
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    # Result cache
+
+    def cache_get(self, key):
+        """Return the cached value for a key, or None."""
+        with self._connect() as conn:
+            row = conn.execute('SELECT value FROM cache WHERE key = ?', (key,)).fetchone()
+        return json.loads(row['value']) if row else None
+
+    def cache_set(self, key, value):
+        """Store a JSON-serialisable value under a key."""
+        with self._connect() as conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO cache (key, value, created) VALUES (?, ?, ?)',
+                (key, json.dumps(value), time.time())
+            )
+
+    # In-flight markers
+
+    def claim(self, key):
+        """Mark work as in flight in this process.
+
+        Returns False while another live process holds an unexpired marker.
+        """
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                row = conn.execute('SELECT pid, expires FROM inflight WHERE key = ?', (key,)).fetchone()
+                claimed = (row is None or row['pid'] == os.getpid() or row['expires'] <= now
+                           or not _process_alive(row['pid']))
+                if claimed:
+                    conn.execute('INSERT OR REPLACE INTO inflight (key, pid, expires) VALUES (?, ?, ?)',
+                                 (key, os.getpid(), now + INFLIGHT_TTL))
+                conn.execute('COMMIT')
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+        return claimed
+
+    def release(self, key):
+        """Remove this process's in-flight marker for a key."""
+        with self._connect() as conn:
+            conn.execute('DELETE FROM inflight WHERE key = ? AND pid = ?', (key, os.getpid()))
+
+    def claim_or_wait(self, key, cancel=None):
+        """Claim a piece of work, or wait for the process already doing it.
+
+        Returns None once this process holds the claim (release it when the
+        result is cached), or the cached value the other process produced.
+        If that process fails or dies without a result, the claim passes to
+        one of the waiters. ``cancel`` (a CancelToken) ends the wait.
+        """
+        sleep = cancel.sleep if cancel is not None else time.sleep
+        while True:
+            if self.claim(key):
+                # The previous holder may have cached its result just now
+                cached = self.cache_get(key)
+                if cached is not None:
+                    self.release(key)
+                return cached
+            sleep(INFLIGHT_POLL_INTERVAL)
+            cached = self.cache_get(key)
+            if cached is not None:
+                return cached
+
+    # Rate limiter
+
+    def try_acquire(self, name, per_minute):
+        """Take a request slot if one is free.
+
+        Returns 0 when a slot was taken, otherwise the number of seconds until
+        the oldest request in the window expires.
+        """
+        now = time.time()
+        with self._connect() as conn:
+            # BEGIN IMMEDIATE serialises the check-and-insert across processes
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                conn.execute('DELETE FROM rate_events WHERE name = ? AND ts <= ?', (name, now - 60))
+                rows = conn.execute(
+                    'SELECT ts FROM rate_events WHERE name = ? ORDER BY ts LIMIT ?', (name, per_minute)
+                ).fetchall()
+                if len(rows) < per_minute:
+                    conn.execute('INSERT INTO rate_events (name, ts) VALUES (?, ?)', (name, now))
+                    wait = 0
+                else:
+                    wait = max(rows[0]['ts'] + 60 - now, 0.01)
+                conn.execute('COMMIT')
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+        return wait
+
+    def acquire(self, name, per_minute, cancel=None):
+        """Block until a request slot is free. A limit of 0 disables limiting.
+
+        With a ``cancel`` token (a CancelToken), the wait ends by raising
+        Cancelled once the token is cancelled.
+        """
+        if not per_minute:
+            return 0
+        sleep = cancel.sleep if cancel is not None else time.sleep
+        waited = 0
+        while True:
+            if cancel is not None:
+                cancel.raise_if_cancelled()
+            wait = self.try_acquire(name, per_minute)
+            if not wait:
+                return waited
+            sleep(wait)
+            waited += wait
+
+    # Job store
+
+    def create_job(self, job_id, total_files, info=None):
+        """Record a new job."""
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                'INSERT INTO jobs (id, status, total_files, pid, created, updated, info) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (job_id, 'running', total_files, os.getpid(), now, now, json.dumps(info or {}))
+            )
+
+    def add_job_file(self, job_id):
+        """Count one more file in a job whose files arrive one at a time."""
+        with self._connect() as conn:
+            conn.execute(
+                'UPDATE jobs SET total_files = total_files + 1, updated = ? WHERE id = ?',
+                (time.time(), job_id)
+            )
+
+    def add_job_result(self, job_id, position, result, content=None):
+        """Store one file's result and bump the job's progress."""
+        with self._connect() as conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO job_results (job_id, position, file_name, success, content, error) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                (job_id, position, result.get('file_name', ''), 1 if result.get('success') else 0,
+                 content, result.get('error'))
+            )
+            conn.execute(
+                'UPDATE jobs SET processed_files = processed_files + 1, updated = ? WHERE id = ?',
+                (time.time(), job_id)
+            )
+
+    def finish_job(self, job_id, status='complete', info=None):
+        """Mark a job as finished, merging extra info into the record."""
+        with self._connect() as conn:
+            row = conn.execute('SELECT info FROM jobs WHERE id = ?', (job_id,)).fetchone()
+            merged = json.loads(row['info']) if row else {}
+            merged.update(info or {})
+            conn.execute(
+                'UPDATE jobs SET status = ?, updated = ?, info = ? WHERE id = ?',
+                (status, time.time(), json.dumps(merged), job_id)
+            )
+        if time.monotonic() - self._last_prune >= PRUNE_INTERVAL:
+            self.prune()
+
+    def prune(self):
+        """Delete expired cache entries and old jobs with their results.
+
+        A retention of None (or 0) keeps those rows forever. Returns the
+        number of cache entries and jobs deleted.
+        """
+        self._last_prune = time.monotonic()
+        now = time.time()
+        removed = {"cache": 0, "jobs": 0}
+        with self._connect() as conn:
+            conn.execute('DELETE FROM inflight WHERE expires < ?', (now,))
+            if self.cache_retention:
+                removed["cache"] = conn.execute(
+                    'DELETE FROM cache WHERE created < ?', (now - self.cache_retention,)
+                ).rowcount
+            if self.job_retention:
+                # Jobs idle this long are finished, or died with their process
+                conn.execute('BEGIN IMMEDIATE')
+                try:
+                    conn.execute(
+                        'DELETE FROM job_results WHERE job_id IN (SELECT id FROM jobs WHERE updated < ?)',
+                        (now - self.job_retention,)
+                    )
+                    removed["jobs"] = conn.execute(
+                        'DELETE FROM jobs WHERE updated < ?', (now - self.job_retention,)
+                    ).rowcount
+                    conn.execute('COMMIT')
+                except BaseException:
+                    conn.execute('ROLLBACK')
+                    raise
+        return removed
+
+    def get_job(self, job_id):
+        """Return a job record as a dict, or None."""
+        with self._connect() as conn:
+            row = conn.execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        if not row:
+            return None
+        job = dict(row)
+        job['info'] = json.loads(job['info'])
+        return job
+
+    def iter_job_results(self, job_id):
+        """Yield a job's per-file results in submission order, one row at a time."""
+        with self._connect() as conn:
+            cursor = conn.execute(
+                'SELECT position, file_name, success, content, error FROM job_results '
+                'WHERE job_id = ? ORDER BY position', (job_id,)
+            )
+            for row in cursor:
+                yield dict(row)
+
+    def interrupt_jobs(self, pid):
+        """Mark jobs still running in a process as interrupted (used on shutdown)."""
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = 'interrupted', updated = ? WHERE pid = ? AND status = 'running'",
+                (time.time(), pid)
+            )
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""
+RemNote Single-Flight Coalescing
+-------------------------------
+Deduplicates identical work that is in flight at the same time. The first
+caller for a key runs the work; callers arriving with the same key while it
+runs wait for that result instead of repeating the upload and generation.
+"""
+
+import threading
+
+from shared_state import file_hash, result_cache_key
+
+# How often a waiting caller checks its cancel token (seconds)
+CANCEL_CHECK_INTERVAL = 0.5
+
+
+def work_key(file_path, prompt_digest):
+    """Key identical work by file content hash + prompt hash."""
+    return result_cache_key(file_hash(file_path), prompt_digest)
+
+
+class _Call:
+    """A piece of work in flight and the callers waiting for it."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """Run at most one call per key at a time and share its outcome."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.coalesced = 0
+
+    def do(self, key, fn, *args, cancel=None, **kwargs):
+        """Run ``fn`` for ``key`` or wait for the identical call already running.
+
+        Returns ``(result, shared)`` where ``shared`` is True when the result
+        came from another caller's call. Exceptions are re-raised to every
+        caller. A waiting caller stops waiting (raising Cancelled) once its
+        own ``cancel`` token is cancelled; the token is not passed to ``fn``.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                call.waiters += 1
+                self.coalesced += 1
+                leader = False
+            else:
+                call = _Call()
+                self._calls[key] = call
+                leader = True
+
+        if not leader:
+            while not call.done.wait(CANCEL_CHECK_INTERVAL if cancel is not None else None):
+                cancel.raise_if_cancelled()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = fn(*args, **kwargs)
+        except BaseException as exc:
+            call.error = exc
+            raise
+        finally:
+            # Later callers start a fresh call; waiters read the stored outcome
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+        return call.result, False
+
+    def in_flight(self):
+        """Return the number of distinct calls currently running."""
+        with self._lock:
+            return len(self._calls)
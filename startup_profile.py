@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+"""
+RemNote Startup Profile
+----------------------
+Reports where a cold start spends its time: interpreter startup, the
+imports a module runs at load time, and each heavy dependency that is
+only imported on first use. Every measurement runs in a fresh interpreter
+with ``-X importtime``, so already-imported modules never hide a cost.
+
+Usage: ``python generate_flashcards.py --profile-startup`` or
+``python startup_profile.py app``.
+"""
+
+import os
+import sys
+import time
+import argparse
+import subprocess
+
+from lazy_import import module_available
+
+# Dependencies the entry points import lazily
+LAZY_MODULES = ('google.generativeai', 'google.api_core.exceptions', 'pypdf', 'tqdm', 'dotenv')
+
+# Number of a module's own imports listed in the report
+TOP_IMPORTS = 8
+
+
+def _run_importtime(code):
+    """Run code in a fresh interpreter and return its ``-X importtime`` entries.
+
+    Each entry is ``(depth, name, self_us, cumulative_us)`` in import order.
+    """
+    completed = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', code],
+        cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, text=True
+    )
+    if completed.returncode != 0:
+        raise RuntimeError(completed.stderr.strip().splitlines()[-1] if completed.stderr.strip() else code)
+
+    entries = []
+    for line in completed.stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        fields = line[len('import time:'):].split('|')
+        if len(fields) != 3 or not fields[0].strip().isdigit():
+            continue
+        name = fields[2].rstrip()
+        depth = (len(name) - len(name.lstrip())) // 2
+        entries.append((depth, name.strip(), int(fields[0]), int(fields[1])))
+    return entries
+
+
+def profile_startup(module_name, lazy_modules=LAZY_MODULES):
+    """Measure the cold-start cost of importing a module and its lazy dependencies."""
+    started = time.perf_counter()
+    subprocess.run([sys.executable, '-c', 'pass'], check=True)
+    interpreter_ms = (time.perf_counter() - started) * 1000
+
+    entries = _run_importtime(f"import {module_name}")
+
+    # Entries are listed children first: the module's subtree is the run of
+    # nested entries just before its own top-level line
+    total_us = 0
+    direct = []
+    for index in range(len(entries) - 1, -1, -1):
+        depth, name, _, cumulative = entries[index]
+        if depth == 0 and name == module_name:
+            total_us = cumulative
+            for child_depth, child, _, child_cumulative in reversed(entries[:index]):
+                if child_depth == 0:
+                    break
+                if child_depth == 1:
+                    direct.append((child, child_cumulative))
+            break
+    direct.sort(key=lambda item: item[1], reverse=True)
+
+    # Each lazy dependency on its own, on top of the module's eager imports
+    lazy = []
+    for name in lazy_modules:
+        if not module_available(name.split('.')[0]):
+            continue
+        extra = _run_importtime(f"import {module_name}\nimport {name}")
+        cost = next((cumulative for depth, entry, _, cumulative in reversed(extra)
+                     if depth == 0 and entry == name), 0)
+        lazy.append((name, cost))
+
+    return {
+        "module": module_name,
+        "interpreter_ms": interpreter_ms,
+        "module_ms": total_us / 1000,
+        "imports": [(name, cumulative / 1000) for name, cumulative in direct[:TOP_IMPORTS]],
+        "lazy": [(name, cost / 1000) for name, cost in lazy]
+    }
+
+
+def format_report(report):
+    """Format a startup profile as text."""
+    lines = [
+        f"Startup profile for {report['module']} (fresh interpreter, -X importtime):",
+        f"  Interpreter startup:         {report['interpreter_ms']:8.1f} ms (wall clock)",
+        f"  import {report['module']}:{' ' * max(1, 21 - len(report['module']))}{report['module_ms']:8.1f} ms",
+    ]
+    for name, ms in report["imports"]:
+        lines.append(f"    {name:<26} {ms:8.1f} ms")
+    if report["lazy"]:
+        lines.append("  Imported on first use (not paid at startup):")
+        for name, ms in report["lazy"]:
+            lines.append(f"    {name:<26} {ms:8.1f} ms")
+    return '\n'.join(lines)
+
+
+class ProfileStartupAction(argparse.Action):
+    """``--profile-startup``: print the startup profile of a module and exit, like ``--version``."""
+
+    def __init__(self, option_strings, dest, module=None, **kwargs):
+        self.module = module
+        super().__init__(option_strings, dest, nargs=0, default=argparse.SUPPRESS, **kwargs)
+
+    def __call__(self, parser, namespace, values, option_string=None):
+        print(format_report(profile_startup(self.module)))
+        parser.exit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Report the cold-start import cost of a module.')
+    parser.add_argument('module', nargs='?', default='generate_flashcards',
+                        help='Module to profile (default: generate_flashcards)')
+    args = parser.parse_args()
+    print(format_report(profile_startup(args.module)))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
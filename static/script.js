@@ -2,6 +2,12 @@
 let selectedFiles = [];
 let isProcessing = false;
 let defaultPrompt = '';
+let currentJobId = null;
+let generatedFlashcards = '';
+let activeBatchId = null;
+
+// Number of files uploaded to a batch session at the same time
+const UPLOAD_CONCURRENCY = 3;
 
 // DOM elements
 const uploadArea = document.getElementById('uploadArea');
@@ -237,34 +243,58 @@ async function processFiles() {
     isProcessing = true;
     showProgress();
     
-    const formData = new FormData();
-    selectedFiles.forEach((file, index) => {
-        formData.append('files', file);
-        console.log(`📄 Added file ${index + 1}: ${file.name} (${formatFileSize(file.size)})`);
-    });
-    
-    // Add the custom prompt to the form data
+    // Add the custom prompt to the batch session
+    const batchForm = new FormData();
     const currentPrompt = promptEditor.value.trim();
     if (currentPrompt && currentPrompt !== defaultPrompt) {
-        formData.append('prompt', currentPrompt);
+        batchForm.append('prompt', currentPrompt);
         console.log('📝 Custom prompt included in request');
     } else {
         console.log('📝 Using default prompt');
     }
     
+    let progressTimer = null;
+    
     try {
-        updateProgress(10, 'Uploading files...');
-        console.log('📤 Uploading files to server...');
-        
-        const response = await fetch('/process_files', {
+        updateProgress(5, 'Starting batch...');
+        const batchResponse = await fetch('/batches', {
             method: 'POST',
-            body: formData
+            body: batchForm
         });
+        const batch = await batchResponse.json();
+        if (!batchResponse.ok) {
+            throw new Error(batch.error || 'Could not start batch');
+        }
+        console.log(`📦 Batch session opened: ${batch.batch_id}`);
+        activeBatchId = batch.batch_id;
         
-        console.log(`📡 Server response status: ${response.status}`);
+        // Upload files one at a time (a few in parallel); the server starts
+        // generating each file as soon as it arrives
+        progressTimer = setInterval(() => pollBatchProgress(batch.batch_id), 2000);
+        let uploadedCount = 0;
+        await runWithConcurrency(selectedFiles, UPLOAD_CONCURRENCY, async (file, index) => {
+            const formData = new FormData();
+            formData.append('file', file);
+            formData.append('position', index);
+            console.log(`📤 Uploading file ${index + 1}: ${file.name} (${formatFileSize(file.size)})`);
+            
+            const response = await fetch(`/batches/${batch.batch_id}/files`, {
+                method: 'POST',
+                body: formData
+            });
+            if (!response.ok) {
+                const error = await response.json().catch(() => ({}));
+                throw new Error(error.error || `Upload failed for ${file.name}`);
+            }
+            
+            uploadedCount++;
+            updateProgress(5 + Math.round(45 * uploadedCount / selectedFiles.length),
+                `Uploaded ${uploadedCount}/${selectedFiles.length} files...`);
+        });
         
-        updateProgress(50, 'Processing with AI...');
-        console.log('🤖 Server processing files with AI...');
+        console.log('🤖 All files uploaded, waiting for AI processing...');
+        const response = await fetch(`/batches/${batch.batch_id}/close`, { method: 'POST' });
+        console.log(`📡 Server response status: ${response.status}`);
         
         const result = await response.json();
         console.log('📥 Received response from server:', {
@@ -289,15 +319,58 @@ async function processFiles() {
             message: error.message,
             stack: error.stack
         });
+        cancelActiveBatch();
         hideProgress();
         showToast('Processing failed', error.message, 'error');
     } finally {
+        activeBatchId = null;
+        clearInterval(progressTimer);
         isProcessing = false;
         updateUI();
         console.log('🏁 File processing session ended');
     }
 }
 
+// Tell the server to stop working on the batch in progress, if any
+function cancelActiveBatch() {
+    if (!activeBatchId) return;
+    console.log(`🛑 Cancelling batch ${activeBatchId}`);
+    navigator.sendBeacon(`/batches/${activeBatchId}/cancel`);
+    activeBatchId = null;
+}
+
+// Closing or leaving the page abandons the batch, so free the server's workers
+window.addEventListener('pagehide', cancelActiveBatch);
+
+// Run an async task for every item with at most `limit` running at once
+async function runWithConcurrency(items, limit, task) {
+    let next = 0;
+    const runners = Array.from({ length: Math.min(limit, items.length) }, async () => {
+        while (next < items.length) {
+            const index = next++;
+            await task(items[index], index);
+        }
+    });
+    await Promise.all(runners);
+}
+
+async function pollBatchProgress(batchId) {
+    try {
+        const response = await fetch(`/jobs/${batchId}`);
+        if (!response.ok) return;
+        const job = await response.json();
+        if (job.processed_files > 0) {
+            const done = Math.min(job.processed_files, selectedFiles.length);
+            const percentage = 50 + Math.round(45 * done / selectedFiles.length);
+            if (percentage > parseInt(progressFill.style.width || '0', 10)) {
+                updateProgress(percentage, `Generated flashcards for ${done}/${selectedFiles.length} files...`);
+            }
+        }
+    } catch (error) {
+        console.warn('⚠️ Could not fetch batch progress:', error);
+    }
+}
+
 function showProgress() {
     console.log('⏳ Showing progress section');
     progressSection.style.display = 'block';
@@ -318,20 +391,48 @@ function hideProgress() {
     uploadArea.style.display = selectedFiles.length === 0 ? 'block' : 'none';
 }
 
-function showResults(result) {
+async function showResults(result) {
     console.log('📋 Displaying results to user');
     console.log(`📊 Results summary: ${result.processed_files}/${result.total_files} files processed`);
     
     progressSection.style.display = 'none';
     resultsSection.style.display = 'block';
     
-    flashcardsEditor.value = result.flashcards;
+    currentJobId = result.job_id || null;
     fileCount.textContent = `${result.processed_files} of ${result.total_files} files processed`;
     
-    console.log(`📝 Flashcards length: ${result.flashcards.length} characters`);
+    // The flashcards are streamed into the editor rather than sent in the
+    // summary, so the whole batch is never held as one JSON response
+    flashcardsEditor.value = '';
+    try {
+        await streamFlashcards(currentJobId);
+    } catch (error) {
+        console.error('❌ Could not load flashcards:', error);
+        showToast('Loading failed', error.message, 'error');
+        return;
+    }
+    generatedFlashcards = flashcardsEditor.value;
+    
+    console.log(`📝 Flashcards length: ${flashcardsEditor.value.length} characters`);
     showToast('Success!', result.message, 'success');
 }
 
+// Append a job's combined flashcards to the editor as they arrive
+async function streamFlashcards(jobId) {
+    const response = await fetch(`/jobs/${encodeURIComponent(jobId)}/flashcards.txt`);
+    if (!response.ok) {
+        throw new Error(`Server responded with ${response.status}`);
+    }
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    while (true) {
+        const { done, value } = await reader.read();
+        if (done) break;
+        flashcardsEditor.value += decoder.decode(value, { stream: true });
+    }
+    flashcardsEditor.value += decoder.decode();
+}
+
 // Results functions
 function copyToClipboard() {
     flashcardsEditor.select();
@@ -341,6 +442,20 @@ function copyToClipboard() {
 }
 
 function downloadFlashcards() {
+    // Unedited results are streamed from the server as a ZIP of per-file
+    // flashcards plus combined notes, so the browser never builds the archive
+    if (currentJobId && flashcardsEditor.value === generatedFlashcards) {
+        const a = document.createElement('a');
+        a.href = `/jobs/${encodeURIComponent(currentJobId)}/export.zip`;
+        document.body.appendChild(a);
+        a.click();
+        document.body.removeChild(a);
+        console.log(`💾 Streaming ZIP export for job ${currentJobId}`);
+        showToast('Downloading...', 'Your flashcards ZIP is being prepared.', 'success');
+        return;
+    }
+    
+    // Edited flashcards only exist in the browser, so save them directly
     const blob = new Blob([flashcardsEditor.value], { type: 'text/plain' });
     const url = URL.createObjectURL(blob);
     const a = document.createElement('a');
@@ -367,6 +482,8 @@ function startNewBatch() {
     progressSection.style.display = 'none';
     flashcardsEditor.value = '';
     fileCount.textContent = '';
+    currentJobId = null;
+    generatedFlashcards = '';
     updateUI();
     console.log('✨ New batch started - UI reset');
 }
@@ -11,30 +11,29 @@ Features:
 - Parallel processing of multiple prompts simultaneously
 - Evaluation of prompt effectiveness for test preparation
 - HTML comparison of results
+- Outputs keyed by prompt content hash, so only edited prompts are re-run
 """
 
 import os
 import sys
 import argparse
-import re
 from pathlib import Path
-import google.generativeai as genai
 import concurrent.futures
 import time
-from tqdm import tqdm
+from lazy_import import lazy_module
+from startup_profile import ProfileStartupAction
+from prompt_registry import PromptRegistry, parse_prompts_markdown, prompt_hash
+from retry_policy import RetryPolicy, classify_error
+from generate_flashcards import upload_file, delete_uploaded_file
+from scheduling import pdf_page_count
+
+# Heavy dependencies are imported on first use
+genai = lazy_module('google.generativeai')
+tqdm = lazy_module('tqdm')
 
 def extract_prompts_from_file(prompts_file):
     """Extract prompts from the prompts.md file."""
-    with open(prompts_file, 'r', encoding='utf-8') as f:
-        content = f.read()
-    
-    # Extract sections using regex - more robust pattern to handle all prompts
-    pattern = r'## ([^\n]+)\n```\n(.*?)\n```'
-    matches = re.findall(pattern, content, re.DOTALL)
-    
-    prompts = {}
-    for title, prompt_text in matches:
-        prompts[title] = prompt_text.strip()
+    prompts = parse_prompts_markdown(prompts_file)
     
     print(f"Found {len(prompts)} prompts in {prompts_file}")
     # Print the first few prompt names to verify
@@ -46,7 +45,11 @@ def extract_prompts_from_file(prompts_file):
     
     return prompts
 
-def process_file_with_prompt(file_path, api_key, output_dir, prompt_name, prompt_text, pbar=None):
+def prompt_output_file(output_dir, file_stem, prompt_text):
+    """Return the output path for a file processed with a given prompt text."""
+    return os.path.join(output_dir, f"{file_stem}_{prompt_hash(prompt_text)}_flashcards.txt")
+
+def process_file_with_prompt(file_path, api_key, output_dir, prompt_name, prompt_text, pbar=None, policy=None):
     """Process a single file with a specific prompt."""
     # Configure the Gemini API
     genai.configure(api_key=api_key)
@@ -57,9 +60,9 @@ def process_file_with_prompt(file_path, api_key, output_dir, prompt_name, prompt
     file_name = os.path.basename(file_path)
     file_stem = os.path.splitext(file_name)[0]
     
-    # Create a sanitized prompt name for the filename
-    sanitized_prompt_name = prompt_name.replace('/', '_').replace(' ', '_')
-    output_file = os.path.join(output_dir, f"{file_stem}_{sanitized_prompt_name}_flashcards.txt")
+    # Key the output by the prompt's content hash, not its name, so renaming
+    # a prompt reuses its results and editing one forces a re-run
+    output_file = prompt_output_file(output_dir, file_stem, prompt_text)
     
     # Check if the output file already exists - skip if it does
     if os.path.exists(output_file):
@@ -88,78 +91,59 @@ def process_file_with_prompt(file_path, api_key, output_dir, prompt_name, prompt
         "content": ""
     }
     
-    max_retries = 3
-    retry_count = 0
+    if policy is None:
+        policy = RetryPolicy()
+    
+    def report_retry(attempt, max_attempts, delay, error, kind):
+        if pbar:
+            pbar.set_description(f"{kind.replace('_', ' ').capitalize()} error. Waiting {delay:.1f}s "
+                                 f"before retry {attempt}/{max_attempts - 1}")
     
-    while retry_count < max_retries:
+    try:
+        # The upload and the generation are retried on their own, so a failed
+        # generation doesn't upload the file again; uploads of abandoned
+        # attempts are deleted
+        pages = pdf_page_count(file_path) if file_path.lower().endswith('.pdf') else 1
+        sample_file = policy.call(upload_file, file_path, file_name, operation='upload', weight=pages,
+                                  on_retry=report_retry, discard=delete_uploaded_file)
         try:
-            # Upload the file to Gemini
-            sample_file = genai.upload_file(path=file_path, display_name=file_name)
-            
             # Generate flashcards using the uploaded document and the specific prompt
-            response = model.generate_content([sample_file, prompt_text])
-            
-            # Save the generated flashcards to a text file
-            with open(output_file, 'w', encoding='utf-8') as f:
-                f.write(f"# Flashcards generated with: {prompt_name}\n\n")
-                f.write(response.text)
-            
-            result["success"] = True
-            result["content"] = response.text
-            
-            if pbar:
-                pbar.update(1)
-                pbar.set_description(f"Processed: {prompt_name}")
-            
-            # Add a small delay to avoid rate limiting
-            time.sleep(0.5)
-            return result
-            
-        except Exception as e:
-            error_msg = str(e)
-            retry_count += 1
-            
-            # Check if it's a rate limit error
-            if "429" in error_msg and retry_count < max_retries:
-                # Extract retry delay if available
-                retry_delay = 10  # Default delay
-                if "retry_delay" in error_msg:
-                    try:
-                        # Try to extract the retry delay from the error message
-                        delay_str = re.search(r'retry_delay\s*{\s*seconds:\s*(\d+)', error_msg)
-                        if delay_str:
-                            retry_delay = int(delay_str.group(1))
-                    except:
-                        pass
-                
-                if pbar:
-                    pbar.set_description(f"Rate limited. Waiting {retry_delay}s before retry {retry_count}/{max_retries}")
-                
-                # Wait before retrying
-                time.sleep(retry_delay)
-            else:
-                # Not a rate limit error or max retries reached
-                result["error"] = f"❌ Error processing {prompt_name}: {error_msg}"
-                
-                if pbar:
-                    pbar.update(1)
-                    pbar.set_description(f"Failed: {prompt_name}")
-                
-                return result
-    
-    # If we get here, we've exhausted all retries
-    result["error"] = f"❌ Max retries reached for {prompt_name}"
-    
-    if pbar:
-        pbar.update(1)
-    
-    return result
+            response = policy.call(model.generate_content, [sample_file, prompt_text], operation='generate',
+                                   weight=pages, on_retry=report_retry)
+        finally:
+            delete_uploaded_file(sample_file)
+        
+        # Save the generated flashcards to a text file
+        with open(output_file, 'w', encoding='utf-8') as f:
+            f.write(f"# Flashcards generated with: {prompt_name}\n\n")
+            f.write(response.text)
+        
+        result["success"] = True
+        result["content"] = response.text
+        
+        if pbar:
+            pbar.update(1)
+            pbar.set_description(f"Processed: {prompt_name}")
+        
+        # Add a small delay to avoid rate limiting
+        time.sleep(0.5)
+        return result
+        
+    except Exception as e:
+        # Fatal error, or retries exhausted
+        result["error"] = f"❌ Error processing {prompt_name} ({classify_error(e)}): {e}"
+        
+        if pbar:
+            pbar.update(1)
+            pbar.set_description(f"Failed: {prompt_name}")
+        
+        return result
 
-def evaluate_flashcards(api_key, output_dir, file_stem, prompt_results):
+def evaluate_flashcards(api_key, output_dir, file_stem, prompt_results, reuse_existing=True):
     """Evaluate the flashcard results and identify the top 3 for test preparation."""
     # Check if evaluation file already exists
     eval_file = os.path.join(output_dir, f"{file_stem}_evaluation.txt")
-    if os.path.exists(eval_file):
+    if reuse_existing and os.path.exists(eval_file):
         print(f"\nEvaluation file already exists: {eval_file}")
         # Read existing evaluation
         with open(eval_file, 'r', encoding='utf-8') as f:
@@ -258,6 +242,8 @@ def main():
     parser.add_argument('--api-key', help='Google Gemini API key')
     parser.add_argument('--prompts-file', default='prompts.md', help='File containing prompt templates')
     parser.add_argument('--output-dir', default='prompt_test_results', help='Directory for output files')
+    parser.add_argument('--profile-startup', action=ProfileStartupAction, module='test_prompts',
+                        help='Report the import time of this script and its heavy dependencies, then exit')
     
     args = parser.parse_args()
     
@@ -293,11 +279,23 @@ def main():
     
     print(f"Found {len(prompts)} prompts to test")
     
+    # Register prompts so their versions are tracked across runs
+    registry = PromptRegistry.for_directory(output_dir)
+    prompt_entries = registry.register_all(prompts)
+    
     # Process each input file
     for input_file in args.input_file:
         file_stem = os.path.splitext(os.path.basename(input_file))[0]
         print(f"\n=== Processing file: {input_file} ===")
         
+        # Only prompts without an output for their current text need a call
+        changed = [name for name, text in prompts.items()
+                   if not os.path.exists(prompt_output_file(output_dir, file_stem, text))]
+        print(f"{len(changed)} new or edited prompts, {len(prompts) - len(changed)} unchanged")
+        for name in changed:
+            entry = prompt_entries[name]
+            print(f"  • {name} v{entry['version']} ({entry['hash']})")
+        
         # Process input file with each prompt in parallel
         success_count = 0
         prompt_results = ""
@@ -309,8 +307,11 @@ def main():
         
         print(f"\nProcessing {len(prompts)} prompts with {max_workers} parallel workers...")
         
+        # One policy for all prompts, so abandoned attempts count against the worker limit
+        policy = RetryPolicy(max_in_flight=max_workers)
+        
         # Create a progress bar
-        with tqdm(total=len(prompts), desc="Processing prompts") as pbar:
+        with tqdm.tqdm(total=len(prompts), desc="Processing prompts") as pbar:
             # Use ThreadPoolExecutor for parallel processing
             with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
                 # Submit all tasks
@@ -323,7 +324,8 @@ def main():
                         output_dir, 
                         prompt_name, 
                         prompt_text,
-                        pbar
+                        pbar,
+                        policy
                     )
                     future_to_prompt[future] = prompt_name
                 
@@ -353,7 +355,9 @@ def main():
         print(f"\nTesting complete for {input_file}: {success_count}/{len(prompts)} prompts successfully tested")
         
         # Evaluate the results to find the top 3 templates
-        top_templates = evaluate_flashcards(api_key, output_dir, file_stem, prompt_results)
+        # Re-evaluate whenever any prompt's results changed
+        top_templates = evaluate_flashcards(api_key, output_dir, file_stem, prompt_results,
+                                            reuse_existing=not changed)
     
         # Create a comparison HTML file
         html_output = os.path.join(output_dir, f"{file_stem}_comparison.html")
@@ -419,10 +423,8 @@ def main():
             f.write("</div>\n<div class=\"container\">\n")
         
         
-            for prompt_name in prompts:
-                sanitized_prompt_name = prompt_name.replace('/', '_').replace(' ', '_')
-                result_file = f"{file_stem}_{sanitized_prompt_name}_flashcards.txt"
-                result_path = os.path.join(output_dir, result_file)
+            for prompt_name, prompt_text in prompts.items():
+                result_path = prompt_output_file(output_dir, file_stem, prompt_text)
                 
                 # Check if this is a top template
                 is_top = prompt_name in top_templates
@@ -0,0 +1,49 @@
+import contextvars
+import threading
+
+import pytest
+
+import profiling
+
+
+@pytest.fixture
+def profiler():
+    profiler = profiling.Profiler().start()
+    yield profiler
+    profiler.stop()
+
+
+def test_nested_spans_restore_the_thread_entry(profiler):
+    ident = threading.get_ident()
+    with profiling.span('process_file', file='notes.pdf'):
+        with profiling.span('upload'):
+            assert profiler._thread_spans[ident] == ('process_file notes.pdf', 'upload')
+        assert profiler._thread_spans[ident] == ('process_file notes.pdf',)
+    assert ident not in profiler._thread_spans
+
+
+def test_thread_with_copied_context_drops_its_entry(profiler):
+    seen = {}
+
+    def attempt():
+        with profiling.span('generate'):
+            seen['ident'] = threading.get_ident()
+            seen['spans'] = profiler._thread_spans[seen['ident']]
+
+    with profiling.span('process_file', file='notes.pdf'):
+        thread = threading.Thread(target=contextvars.copy_context().run, args=(attempt,))
+        thread.start()
+        thread.join()
+        # The attempt thread saw the inherited span but left no entry behind
+        assert seen['spans'] == ('process_file notes.pdf', 'generate')
+        assert seen['ident'] not in profiler._thread_spans
+        assert threading.get_ident() in profiler._thread_spans
+    assert profiler._thread_spans == {}
+
+
+def test_new_stacks_beyond_the_limit_are_folded_together():
+    profiler = profiling.Profiler(max_stacks=3)
+    for stack in ['a;x', 'b;x', 'a;x', 'c;x', 'd;x', 'e;x', 'b;x']:
+        profiler.add_sample(stack)
+
+    assert profiler.samples == {'a;x': 2, 'b;x': 2, 'c;x': 1, profiling.OTHER_STACK: 2}
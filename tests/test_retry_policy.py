@@ -0,0 +1,219 @@
+import threading
+import time
+
+import pytest
+from google.api_core import exceptions as google_exceptions
+
+import retry_policy
+from cancellation import CancelToken, Cancelled
+from retry_policy import (
+    CANCELLED, FATAL, RATE_LIMIT, TIMEOUT, TRANSIENT,
+    AttemptTimeout, LatencyTracker, RetryPolicy, classify_error, latency_key, retry_after
+)
+
+
+class StatusError(Exception):
+    def __init__(self, status_code):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+
+
+@pytest.mark.parametrize("exc, kind", [
+    (google_exceptions.ResourceExhausted("quota"), RATE_LIMIT),
+    (google_exceptions.TooManyRequests("slow down"), RATE_LIMIT),
+    (google_exceptions.ServiceUnavailable("down"), TRANSIENT),
+    (google_exceptions.InternalServerError("oops"), TRANSIENT),
+    (google_exceptions.DeadlineExceeded("slow"), TIMEOUT),
+    (google_exceptions.InvalidArgument("bad"), FATAL),
+    (google_exceptions.PermissionDenied("no"), FATAL),
+    (AttemptTimeout("slow"), TIMEOUT),
+    (Cancelled("cancelled"), CANCELLED),
+    (StatusError(429), RATE_LIMIT),
+    (StatusError(504), TIMEOUT),
+    (StatusError(503), TRANSIENT),
+    (StatusError(404), FATAL),
+    (ConnectionError("reset"), TRANSIENT),
+    (ValueError("bad input"), FATAL),
+    (RuntimeError("unknown"), TRANSIENT),
+])
+def test_classify_error(exc, kind):
+    assert classify_error(exc) == kind
+
+
+def test_classify_error_does_not_match_substrings():
+    assert classify_error(RuntimeError("processed 429 cards")) == TRANSIENT
+
+
+def test_retry_after_reads_server_hint():
+    assert retry_after(Exception("429 quota retry_delay { seconds: 17 }")) == 17
+    assert retry_after(Exception("429 quota")) is None
+
+
+def test_backoff_is_full_jitter_capped_by_max_delay(monkeypatch):
+    policy = RetryPolicy(base_delay=1.0, max_delay=5.0)
+    monkeypatch.setattr(retry_policy.random, 'uniform', lambda low, high: high)
+    assert [policy.backoff(attempt, TRANSIENT) for attempt in (1, 2, 3, 4, 5)] == [1.0, 2.0, 4.0, 5.0, 5.0]
+    monkeypatch.setattr(retry_policy.random, 'uniform', lambda low, high: low)
+    assert policy.backoff(4, TRANSIENT) == 0
+
+
+def test_backoff_waits_at_least_the_rate_limit_hint(monkeypatch):
+    policy = RetryPolicy(base_delay=1.0, max_delay=60.0)
+    monkeypatch.setattr(retry_policy.random, 'uniform', lambda low, high: low)
+    assert policy.backoff(1, RATE_LIMIT, Exception("retry_delay { seconds: 7 }")) == 7
+    assert policy.backoff(1, RATE_LIMIT, Exception("quota")) == retry_policy.DEFAULT_RATE_LIMIT_DELAY
+
+
+def test_call_retries_transient_errors_and_raises_fatal_ones():
+    calls = []
+
+    def flaky():
+        calls.append(1)
+        if len(calls) < 3:
+            raise google_exceptions.ServiceUnavailable("down")
+        return "ok"
+
+    policy = RetryPolicy(max_attempts=3, base_delay=0.001, tracker=LatencyTracker())
+    assert policy.call(flaky) == "ok"
+    assert len(calls) == 3
+
+    def fatal():
+        calls.append(1)
+        raise google_exceptions.InvalidArgument("bad")
+
+    calls.clear()
+    with pytest.raises(google_exceptions.InvalidArgument):
+        policy.call(fatal)
+    assert len(calls) == 1
+
+
+def test_attempt_timeout_abandons_the_call_and_discards_its_result():
+    release = threading.Event()
+    discarded = []
+
+    def hung():
+        release.wait(5)
+        return "late"
+
+    policy = RetryPolicy(max_attempts=1, attempt_timeout=0.05, tracker=LatencyTracker())
+    started = time.monotonic()
+    with pytest.raises(AttemptTimeout):
+        policy.call(hung, discard=discarded.append)
+    assert time.monotonic() - started < 1
+
+    release.set()
+    deadline = time.monotonic() + 2
+    while not discarded and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert discarded == ["late"]
+
+
+def test_slow_attempt_is_hedged_and_first_response_wins():
+    tracker = LatencyTracker()
+    for _ in range(20):
+        tracker.record('generate', 0.01)
+    release = threading.Event()
+    calls = []
+    discarded = []
+
+    def first_hangs():
+        calls.append(1)
+        if len(calls) == 1:
+            release.wait(5)
+            return "slow"
+        return "hedged"
+
+    policy = RetryPolicy(max_attempts=1, attempt_timeout=5, hedge=True, tracker=tracker)
+    assert policy.call(first_hangs, discard=discarded.append) == "hedged"
+    assert len(calls) == 2
+
+    # The out-raced request is cleaned up once it returns
+    release.set()
+    deadline = time.monotonic() + 2
+    while not discarded and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert discarded == ["slow"]
+
+
+def test_hedging_uses_latencies_of_similar_sized_requests():
+    tracker = LatencyTracker()
+    for _ in range(20):
+        tracker.record(latency_key('generate', 1), 0.01)
+    calls = []
+
+    def slowish():
+        calls.append(1)
+        time.sleep(0.2)
+        return "done"
+
+    # A 200-page request is not compared with the 1-page latencies
+    policy = RetryPolicy(max_attempts=1, attempt_timeout=5, hedge=True, tracker=tracker)
+    assert policy.call(slowish, weight=200) == "done"
+    assert len(calls) == 1
+
+    assert policy.call(slowish, weight=1) == "done"
+    assert len(calls) == 3
+
+
+def test_latency_key_buckets():
+    assert latency_key('generate') == 'generate'
+    assert [latency_key('generate', pages) for pages in (1, 2, 3, 4, 5, 200)] == [
+        'generate/1', 'generate/2', 'generate/4', 'generate/4', 'generate/8', 'generate/256'
+    ]
+
+
+def test_abandoned_attempts_keep_their_slot():
+    active = []
+    peak = []
+    lock = threading.Lock()
+    release = threading.Event()
+
+    def tracked():
+        with lock:
+            active.append(1)
+            peak.append(len(active))
+        try:
+            if len(peak) == 1:
+                release.wait(5)
+            return "ok"
+        finally:
+            with lock:
+                active.pop()
+
+    policy = RetryPolicy(max_attempts=2, base_delay=0.001, attempt_timeout=0.05, tracker=LatencyTracker(),
+                         max_in_flight=1)
+    threading.Timer(0.3, release.set).start()
+    started = time.monotonic()
+    assert policy.call(tracked) == "ok"
+    # The retry waited for the abandoned first attempt to return
+    assert time.monotonic() - started >= 0.25
+    assert max(peak) == 1
+
+
+def test_hedge_is_skipped_without_a_free_slot():
+    tracker = LatencyTracker()
+    for _ in range(20):
+        tracker.record('generate', 0.01)
+    calls = []
+
+    def slowish():
+        calls.append(1)
+        time.sleep(0.2)
+        return "done"
+
+    policy = RetryPolicy(max_attempts=1, attempt_timeout=5, hedge=True, tracker=tracker, max_in_flight=1)
+    assert policy.call(slowish) == "done"
+    assert len(calls) == 1
+
+
+def test_cancel_ends_the_wait_for_a_slot():
+    release = threading.Event()
+    policy = RetryPolicy(max_attempts=1, attempt_timeout=0.05, tracker=LatencyTracker(), max_in_flight=1)
+    with pytest.raises(AttemptTimeout):
+        policy.call(release.wait, 5)
+
+    cancel = CancelToken()
+    threading.Timer(0.1, cancel.cancel).start()
+    with pytest.raises(Cancelled):
+        policy.call(lambda: "never", cancel=cancel)
+    release.set()
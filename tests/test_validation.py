@@ -0,0 +1,108 @@
+import pytest
+
+from validation import summarize_stats, validate_and_repair, validate_flashcards
+
+
+class Response:
+    def __init__(self, text):
+        self.text = text
+        self.candidates = []
+
+
+class Model:
+    """Answers follow-up requests from a list, recording what was sent."""
+
+    def __init__(self, *answers):
+        self.answers = list(answers)
+        self.requests = []
+
+    def generate_content(self, contents):
+        self.requests.append(contents)
+        answer = self.answers.pop(0)
+        if isinstance(answer, Exception):
+            raise answer
+        return Response(answer)
+
+
+def test_cards_keep_indentation_and_preamble_is_discarded():
+    check = validate_flashcards("Here are your flashcards:\n* Cell == unit of life\n    * Nucleus == holds DNA\n")
+    assert check["cards"] == ["* Cell == unit of life", "    * Nucleus == holds DNA"]
+    assert check["discarded"] == ["Here are your flashcards:"]
+    assert not check["malformed"] and not check["truncated"]
+
+
+def test_wrapped_answer_is_joined_until_a_blank_line():
+    check = validate_flashcards("* Q1 == first half\nsecond half\n\n* Q2 == A2\n")
+    assert check["cards"] == ["* Q1 == first half second half", "* Q2 == A2"]
+
+
+def test_trailing_chatter_is_not_glued_onto_the_last_card():
+    text = "```\n* Q1 == A1\n* Q2 == A2\n```\n\nLet me know if you need more flashcards!"
+    check = validate_flashcards(text)
+    assert check["cards"] == ["* Q1 == A1", "* Q2 == A2"]
+    assert check["discarded"] == ["```", "```", "Let me know if you need more flashcards!"]
+    assert not check["malformed"] and not check["truncated"]
+
+
+def test_stray_text_between_cards_goes_to_repair():
+    check = validate_flashcards("* Q1 == A1\n\nPhotosynthesis makes sugar\n* Q2 == A2\n")
+    assert check["malformed"] == ["Photosynthesis makes sugar"]
+
+
+def test_bold_note_is_not_a_card_or_a_truncation():
+    check = validate_flashcards("* Q1 == A1\n**Note:** some questions were illegible.")
+    assert check["cards"] == ["* Q1 == A1"]
+    assert check["discarded"] == ["**Note:** some questions were illegible."]
+    assert not check["malformed"] and not check["truncated"]
+
+
+@pytest.mark.parametrize("line", ["1. Q == A", "- Q == A", "*Q == A", "Q == A", "* Q ==", "* Q without answer"])
+def test_card_like_lines_are_malformed(line):
+    check = validate_flashcards(f"* Q0 == A0\n{line}\n* Q9 == A9")
+    assert check["malformed"] == [line]
+
+
+def test_headers_are_kept_only_when_allowed():
+    text = "# Biology\n* Q == A\n"
+    assert validate_flashcards(text)["lines"] == ["* Q == A"]
+    assert validate_flashcards(text, allow_headers=True)["lines"] == ["# Biology", "* Q == A"]
+
+
+def test_partial_last_card_is_truncated_not_malformed():
+    check = validate_flashcards("* Q1 == A1\n* Q2 ==")
+    assert check["truncated"]
+    assert check["malformed"] == []
+
+
+def test_response_without_cards_is_invalid_and_sends_nothing():
+    model = Model()
+    content, stats = validate_and_repair(model, 'file', 'prompt', Response("I'm sorry, I can't read this document."))
+    assert stats["valid"] is False
+    assert content == "I'm sorry, I can't read this document."
+    assert model.requests == []
+
+
+def test_truncated_response_is_continued_without_duplicates():
+    model = Model("* Q2 == A2\n* Q3 == A3\n")
+    content, stats = validate_and_repair(model, 'file', 'prompt', Response("* Q1 == A1\n* Q2 == A2\n* Q3 =="))
+    assert content == "* Q1 == A1\n* Q2 == A2\n* Q3 == A3\n"
+    assert stats["continuations"] == 1 and not stats["truncated"]
+    # The continuation resends the document with the prompt
+    assert model.requests[0][:2] == ['file', 'prompt']
+
+
+def test_repair_keeps_one_copy_of_echoed_cards():
+    model = Model("* Q1 == A1\n* Q2 == A2\n")
+    content, stats = validate_and_repair(model, 'file', 'prompt', Response("* Q1 == A1\n- Q2 == A2\n"))
+    assert content == "* Q1 == A1\n* Q2 == A2\n"
+    assert stats["repaired_lines"] == 1
+    # The repair request is text only
+    assert isinstance(model.requests[0], str)
+
+
+def test_failed_followup_keeps_the_cards_received():
+    model = Model(RuntimeError("unavailable"))
+    content, stats = validate_and_repair(model, 'file', 'prompt', Response("* Q1 == A1\n- broken == card\n"))
+    assert content == "* Q1 == A1\n"
+    assert stats["failed_followups"] == 1
+    assert summarize_stats([stats])["failed_followups"] == 1
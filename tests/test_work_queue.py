@@ -0,0 +1,166 @@
+import threading
+import time
+
+import pytest
+
+from work_queue import DONE, FAILED, LEASED, PENDING, LeaseHeartbeat, WorkQueue
+
+QUEUE = 'notes'
+
+
+@pytest.fixture
+def queue(tmp_path):
+    queue = WorkQueue(str(tmp_path / 'queue.sqlite3'))
+    queue.create_queue(QUEUE, '/src', '/out', 'abc123')
+    return queue
+
+
+def enqueue(queue, *names, priority=0):
+    return queue.enqueue(QUEUE, [(f'/src/{name}', f'/out/{name}.txt', priority) for name in names])
+
+
+def test_lease_hands_out_highest_priority_first(queue):
+    queue.enqueue(QUEUE, [('/src/small', '/out/small.txt', 1), ('/src/big', '/out/big.txt', 50),
+                          ('/src/medium', '/out/medium.txt', 10)])
+    leased = [queue.lease(QUEUE, 'w1')['file_path'] for _ in range(3)]
+    assert leased == ['/src/big', '/src/medium', '/src/small']
+    assert queue.lease(QUEUE, 'w1') is None
+    assert queue.counts(QUEUE) == {PENDING: 0, LEASED: 3, DONE: 0, FAILED: 0}
+
+
+def test_leased_item_is_invisible_until_its_lease_expires(queue):
+    enqueue(queue, 'a')
+    first = queue.lease(QUEUE, 'w1', visibility_timeout=0.1)
+    assert first['owner'] == 'w1' and first['leases'] == 1
+    assert queue.lease(QUEUE, 'w2', visibility_timeout=0.1) is None
+
+    time.sleep(0.15)
+    second = queue.lease(QUEUE, 'w2', visibility_timeout=10)
+    assert second['id'] == first['id']
+    assert second['owner'] == 'w2' and second['leases'] == 2
+
+
+def test_item_fails_after_max_leases_expire(queue):
+    enqueue(queue, 'a')
+    for _ in range(2):
+        assert queue.lease(QUEUE, 'w1', visibility_timeout=0.05, max_leases=2) is not None
+        time.sleep(0.08)
+
+    assert queue.lease(QUEUE, 'w1', visibility_timeout=0.05, max_leases=2) is None
+    item, = queue.iter_items(QUEUE)
+    assert item['status'] == FAILED
+    assert item['error'] == 'lease expired 2 times'
+
+
+def test_complete_is_rejected_after_the_lease_was_lost(queue):
+    enqueue(queue, 'a')
+    stale = queue.lease(QUEUE, 'w1', visibility_timeout=0.05)
+    time.sleep(0.08)
+    current = queue.lease(QUEUE, 'w2', visibility_timeout=10)
+
+    assert queue.complete(stale['id'], 'w1') is False
+    assert queue.complete(current['id'], 'w2') is True
+    assert queue.counts(QUEUE)[DONE] == 1
+    # Completing twice is a no-op
+    assert queue.complete(current['id'], 'w2') is False
+
+
+def test_complete_with_error_marks_the_item_failed(queue):
+    enqueue(queue, 'a')
+    item = queue.lease(QUEUE, 'w1')
+    assert queue.complete(item['id'], 'w1', error='model refused') is True
+    stored, = queue.iter_items(QUEUE, FAILED)
+    assert stored['error'] == 'model refused'
+    assert stored['owner'] is None
+
+
+def test_release_returns_the_item_without_counting_the_lease(queue):
+    enqueue(queue, 'a')
+    item = queue.lease(QUEUE, 'w1')
+    queue.release(item['id'], 'w2')  # not the owner: ignored
+    assert queue.counts(QUEUE)[LEASED] == 1
+
+    queue.release(item['id'], 'w1')
+    stored, = queue.iter_items(QUEUE)
+    assert stored['status'] == PENDING and stored['leases'] == 0
+    assert queue.lease(QUEUE, 'w2')['leases'] == 1
+
+
+def test_extend_only_renews_the_owners_leases(queue):
+    enqueue(queue, 'a', 'b')
+    mine = queue.lease(QUEUE, 'w1', visibility_timeout=0.1)
+    theirs = queue.lease(QUEUE, 'w2', visibility_timeout=0.1)
+    assert queue.extend([mine['id'], theirs['id']], 'w1', visibility_timeout=10) == [mine['id']]
+
+    time.sleep(0.15)
+    # Only the item whose lease was not renewed is handed out again
+    assert queue.lease(QUEUE, 'w3')['id'] == theirs['id']
+    assert queue.lease(QUEUE, 'w3') is None
+
+
+def test_enqueue_keeps_live_leases_and_requeues_the_rest(queue):
+    enqueue(queue, 'running', 'finished')
+    running = queue.lease(QUEUE, 'w1', visibility_timeout=10)
+    finished = queue.lease(QUEUE, 'w1', visibility_timeout=10)
+    queue.complete(finished['id'], 'w1')
+
+    assert enqueue(queue, 'running', 'finished', 'new') == 2
+    states = {item['file_path']: item['status'] for item in queue.iter_items(QUEUE)}
+    assert states == {'/src/running': LEASED, '/src/finished': PENDING, '/src/new': PENDING}
+    assert queue.complete(running['id'], 'w1') is True
+
+
+def test_heartbeat_keeps_leases_alive_until_stopped(queue):
+    enqueue(queue, 'a')
+    item = queue.lease(QUEUE, 'w1', visibility_timeout=0.3)
+    heartbeat = LeaseHeartbeat(queue, 'w1', visibility_timeout=0.3)
+    heartbeat.add(item['id'])
+    try:
+        time.sleep(0.6)
+        assert queue.lease(QUEUE, 'w2') is None
+    finally:
+        heartbeat.stop()
+
+    time.sleep(0.35)
+    assert queue.lease(QUEUE, 'w2')['id'] == item['id']
+
+
+def test_heartbeat_stops_renewing_discarded_items(queue):
+    enqueue(queue, 'a')
+    item = queue.lease(QUEUE, 'w1', visibility_timeout=0.3)
+    heartbeat = LeaseHeartbeat(queue, 'w1', visibility_timeout=0.3)
+    heartbeat.add(item['id'])
+    heartbeat.discard(item['id'])
+    try:
+        time.sleep(0.45)
+        assert queue.lease(QUEUE, 'w2')['id'] == item['id']
+    finally:
+        heartbeat.stop()
+
+
+def test_concurrent_workers_never_lease_the_same_item(tmp_path):
+    path = str(tmp_path / 'queue.sqlite3')
+    WorkQueue(path).create_queue(QUEUE, '/src', '/out', 'abc123')
+    enqueue(WorkQueue(path), *[f'file{n}' for n in range(40)])
+    leased = []
+    lock = threading.Lock()
+
+    def worker(owner):
+        # Each worker opens its own handle, as separate processes would
+        queue = WorkQueue(path)
+        while True:
+            item = queue.lease(QUEUE, owner)
+            if item is None:
+                return
+            with lock:
+                leased.append(item['id'])
+            assert queue.complete(item['id'], owner)
+
+    threads = [threading.Thread(target=worker, args=(f'w{n}',)) for n in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(leased) == 40 == len(set(leased))
+    assert WorkQueue(path).counts(QUEUE)[DONE] == 40
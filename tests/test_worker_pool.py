@@ -0,0 +1,136 @@
+import threading
+import time
+
+import pytest
+
+from worker_pool import FairWorkerPool
+
+
+def test_results_and_exceptions_reach_the_futures():
+    pool = FairWorkerPool(max_workers=2)
+    try:
+        assert pool.submit('a', lambda x, y=1: x + y, 1, y=2).result(timeout=5) == 3
+
+        def boom():
+            raise ValueError("bad file")
+
+        with pytest.raises(ValueError):
+            pool.submit('a', boom).result(timeout=5)
+    finally:
+        pool.shutdown()
+
+
+def test_concurrency_never_exceeds_max_workers():
+    pool = FairWorkerPool(max_workers=3)
+    lock = threading.Lock()
+    running = []
+    peak = []
+
+    def task():
+        with lock:
+            running.append(1)
+            peak.append(len(running))
+        time.sleep(0.02)
+        with lock:
+            running.pop()
+
+    futures = [pool.submit(f'key{n % 4}', task) for n in range(30)]
+    for future in futures:
+        future.result(timeout=10)
+    pool.shutdown()
+    assert max(peak) == 3
+    assert pool.stats()["threads"] <= 3
+
+
+def test_small_request_is_not_starved_by_a_large_one():
+    pool = FairWorkerPool(max_workers=2)
+    order = []
+    gate = threading.Event()
+
+    def task(name):
+        gate.wait(5)
+        order.append(name)
+
+    big = [pool.submit('big', task, f'big{n}') for n in range(10)]
+    small = pool.submit('small', task, 'small')
+    gate.set()
+    small.result(timeout=5)
+    for future in big:
+        future.result(timeout=5)
+    pool.shutdown()
+
+    # The two workers started big0 and big1; the next free worker takes the
+    # small request before the rest of the big queue
+    assert order.index('small') <= 3
+
+
+def test_cancel_only_drops_queued_items_of_one_key():
+    pool = FairWorkerPool(max_workers=1)
+    gate = threading.Event()
+    running = pool.submit('a', gate.wait, 5)
+    queued = [pool.submit('a', lambda: 'a') for _ in range(3)]
+    other = pool.submit('b', lambda: 'b')
+
+    # The worker is busy with the first item, so the rest are still queued
+    deadline = time.monotonic() + 5
+    while not running.running() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert pool.cancel('a') == 3
+    gate.set()
+
+    assert running.result(timeout=5) is True
+    assert all(future.cancelled() for future in queued)
+    assert other.result(timeout=5) == 'b'
+    pool.shutdown()
+
+
+def test_stats_report_running_and_queued_work():
+    pool = FairWorkerPool(max_workers=1)
+    gate = threading.Event()
+    first = pool.submit('a', gate.wait, 5)
+    pool.submit('b', lambda: None)
+    deadline = time.monotonic() + 5
+    while not first.running() and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+    stats = pool.stats()
+    assert stats["running"] == 1 and stats["queued"] == 1
+    assert stats["queues"] == {'a': {"queued": 0, "running": 1}, 'b': {"queued": 1, "running": 0}}
+    gate.set()
+    pool.shutdown()
+
+
+def test_shutdown_waits_for_running_work_and_rejects_new_work():
+    pool = FairWorkerPool(max_workers=2)
+    finished = []
+
+    def slow():
+        time.sleep(0.1)
+        finished.append(1)
+
+    pool.submit('a', slow)
+    pool.submit('a', slow)
+    pool.shutdown(wait=True)
+    assert len(finished) == 2
+    with pytest.raises(RuntimeError):
+        pool.submit('a', slow)
+
+
+def test_shutdown_can_cancel_queued_work():
+    pool = FairWorkerPool(max_workers=1)
+    gate = threading.Event()
+    running = pool.submit('a', gate.wait, 5)
+    deadline = time.monotonic() + 5
+    while not running.running() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    queued = pool.submit('a', lambda: None)
+
+    threading.Timer(0.1, gate.set).start()
+    pool.shutdown(wait=True, cancel_futures=True)
+    assert queued.cancelled()
+    assert running.result(timeout=5) is True
+
+
+def test_max_workers_must_be_positive():
+    with pytest.raises(ValueError):
+        FairWorkerPool(max_workers=0)
@@ -0,0 +1,300 @@
+#!/usr/bin/env python3
+"""
+RemNote Flashcard Output Validation
+----------------------------------
+Checks model responses against the ``* question == answer`` format,
+drops preamble and stray formatting, detects truncated responses and
+re-requests only the missing or malformed portion instead of the whole
+document.
+"""
+
+import re
+
+from cancellation import Cancelled
+
+# A well-formed RemNote card line (indented cards are children of the one above)
+CARD_PATTERN = re.compile(r'^\s*\*\s+(?P<question>.*?\S)\s*==\s*(?P<answer>\S.*)$')
+
+# Numbered list items, e.g. ``1. question == answer``
+NUMBERED_PATTERN = re.compile(r'^\d+[.)]\s')
+
+# Markdown section heading (kept only when the prompt asks for headings)
+HEADER_PATTERN = re.compile(r'^#{1,6}\s+\S')
+
+# Maximum number of follow-up requests per document
+MAX_FOLLOWUPS = 2
+
+# Error reported for a response without a single card; it is not saved
+NO_CARDS_ERROR = "The response contained no flashcards"
+
+CONTINUATION_PROMPT = """
+Your previous answer was cut off after question {count}. The last complete flashcard was:
+
+{last_card}
+
+Continue from question {next_count}. Do not repeat any earlier flashcards.
+Output ONLY the remaining flashcards in this exact format:
+
+* question == answer
+"""
+
+REPAIR_PROMPT = """
+The following lines were supposed to be RemNote flashcards but are not in the required format.
+Rewrite each one as a single line in this exact format, keeping the content unchanged:
+
+* question == answer
+
+Output ONLY the rewritten flashcards, one per line. Drop lines that are not flashcards.
+
+{lines}
+"""
+
+
+def finish_reason(response):
+    """Return the finish reason name of the first candidate, if available."""
+    try:
+        reason = response.candidates[0].finish_reason
+    except (AttributeError, IndexError, TypeError):
+        return None
+    return getattr(reason, 'name', str(reason))
+
+
+def validate_flashcards(text, allow_headers=False, truncated_hint=False):
+    """Split a response into cards, malformed lines and discarded lines.
+
+    Returns a dict with the kept ``lines`` (cards and, if allowed, headers),
+    the ``malformed`` card-like lines, the ``discarded`` preamble/formatting
+    lines and whether the response looks ``truncated``. Indentation is kept
+    so child cards stay nested, and free text following a card (up to the
+    next blank line) is joined onto it as a wrapped answer. Code fences and
+    bold notes are discarded wherever they appear.
+    """
+    lines = []
+    cards = []
+    malformed = []
+    discarded = []
+    # The list holding the previous line ('lines' or 'malformed'), if it can
+    # take a wrapped continuation
+    previous = None
+    # Free text after a card, kept for repair only if another card follows
+    stray = []
+
+    for raw_line in text.splitlines():
+        line = raw_line.rstrip()
+        stripped = line.strip()
+        if not stripped:
+            # A blank line ends a wrapped answer
+            previous = None
+            continue
+
+        if CARD_PATTERN.match(line):
+            malformed.extend(stray)
+            stray = []
+            lines.append(line)
+            cards.append(line)
+            previous = cards
+        elif stripped.startswith('```') or (stripped.startswith('**') and '==' not in stripped):
+            # Code fences and bold notes (``**Note:** ...``) are formatting
+            discarded.append(line)
+            previous = None
+        elif HEADER_PATTERN.match(stripped):
+            if allow_headers:
+                lines.append(line)
+            else:
+                discarded.append(line)
+            previous = None
+        elif stripped.startswith(('*', '-')) or NUMBERED_PATTERN.match(stripped) or '==' in stripped:
+            # Looks like a card but the marker or question/answer split is broken
+            malformed.extend(stray)
+            stray = []
+            malformed.append(line)
+            previous = malformed
+        elif previous is cards:
+            # Free text right after a card is a wrapped answer
+            cards[-1] = f"{cards[-1]} {stripped}"
+            lines[-1] = cards[-1]
+        elif previous is malformed:
+            # ... and after a broken card it belongs to that card's repair
+            malformed[-1] = f"{malformed[-1]} {stripped}"
+        elif cards:
+            # Stray text between cards goes to the repair request; after the
+            # last card it is closing chatter
+            stray.append(line)
+        else:
+            # Preamble and other chatter before the first card
+            discarded.append(line)
+    discarded.extend(stray)
+
+    # A response that stops mid-card or hits the token limit was cut off
+    last_line = text.strip().splitlines()[-1].strip() if text.strip() else ''
+    truncated = truncated_hint or (
+        bool(cards) and bool(last_line) and not CARD_PATTERN.match(last_line)
+        and not HEADER_PATTERN.match(last_line) and last_line.startswith('*')
+        and not last_line.startswith('**')
+    )
+    if truncated and malformed and malformed[-1].strip() == last_line:
+        # The partial last card is re-requested rather than repaired
+        malformed.pop()
+
+    return {
+        "lines": lines,
+        "cards": cards,
+        "malformed": malformed,
+        "discarded": discarded,
+        "truncated": truncated
+    }
+
+
+def _card_key(card):
+    """Compare cards regardless of indentation and spacing."""
+    return ' '.join(card.split())
+
+
+def _follow_up(generate, contents, stats, cancel=None):
+    """Send a follow-up request; returns None if it failed.
+
+    Follow-ups only improve a response that is already usable, so a failure
+    (after the caller's own retries) keeps what was received so far.
+    Cancellation is not a failure: Cancelled propagates.
+    """
+    if cancel is not None:
+        cancel.raise_if_cancelled()
+    stats["followup_requests"] += 1
+    try:
+        return generate(contents)
+    except Cancelled:
+        raise
+    except Exception:
+        stats["failed_followups"] += 1
+        return None
+
+
+def validate_and_repair(model, file_part, prompt_text, response, allow_headers=False,
+                        max_followups=MAX_FOLLOWUPS, generate=None, cancel=None):
+    """Validate a response and re-request only what is missing or malformed.
+
+    ``file_part`` is the uploaded file, or a list of the parts presenting the
+    document. ``generate`` is the callable used for follow-up requests and
+    defaults to ``model.generate_content``. A follow-up that fails keeps the
+    cards already received. No follow-up is sent once ``cancel`` (a
+    CancelToken) is cancelled. Returns ``(content, stats)`` where ``content``
+    is the cleaned flashcard text.
+    """
+    if generate is None:
+        generate = model.generate_content
+    file_parts = list(file_part) if isinstance(file_part, (list, tuple)) else [file_part]
+
+    text = response.text
+    check = validate_flashcards(text, allow_headers,
+                                truncated_hint=finish_reason(response) == 'MAX_TOKENS')
+
+    stats = {
+        "cards": len(check["cards"]),
+        "discarded_lines": len(check["discarded"]),
+        "malformed_lines": len(check["malformed"]),
+        "repaired_lines": 0,
+        "truncated": check["truncated"],
+        "continuations": 0,
+        "followup_requests": 0,
+        "failed_followups": 0,
+        "valid": True
+    }
+
+    # Nothing recognisable as a card: keep the raw text rather than guess
+    if not check["cards"]:
+        stats["valid"] = False
+        return text, stats
+
+    lines = list(check["lines"])
+    cards = list(check["cards"])
+    truncated = check["truncated"]
+
+    # Ask the model to continue from where a truncated response stopped
+    while truncated and stats["followup_requests"] < max_followups:
+        prompt = CONTINUATION_PROMPT.format(
+            count=len(cards), next_count=len(cards) + 1, last_card=cards[-1]
+        )
+        follow_up = _follow_up(generate, file_parts + [prompt_text, prompt], stats, cancel)
+        if follow_up is None:
+            break
+        stats["continuations"] += 1
+
+        more = validate_flashcards(follow_up.text, allow_headers,
+                                   truncated_hint=finish_reason(follow_up) == 'MAX_TOKENS')
+        seen = {_card_key(card) for card in cards}
+        new_cards = [card for card in more["cards"] if _card_key(card) not in seen]
+        lines.extend(line for line in more["lines"] if _card_key(line) not in seen)
+        cards.extend(new_cards)
+        check["malformed"].extend(more["malformed"])
+        truncated = more["truncated"] and bool(new_cards)
+
+    # Repair malformed lines with a small text-only request
+    if check["malformed"] and stats["followup_requests"] < max_followups:
+        follow_up = _follow_up(generate, REPAIR_PROMPT.format(lines='\n'.join(check["malformed"])), stats,
+                               cancel)
+        if follow_up is not None:
+            # The model may echo cards that were already fine; keep one copy
+            seen = {_card_key(card) for card in cards}
+            repaired = []
+            for card in validate_flashcards(follow_up.text)["cards"]:
+                if _card_key(card) not in seen:
+                    seen.add(_card_key(card))
+                    repaired.append(card)
+            stats["repaired_lines"] = len(repaired)
+            lines.extend(repaired)
+            cards.extend(repaired)
+
+    stats["cards"] = len(cards)
+    stats["truncated"] = truncated
+    return '\n'.join(lines) + '\n', stats
+
+
+def merge_stats(stats, more):
+    """Combine the validation stats of two requests for the same file."""
+    if stats is None:
+        return dict(more)
+    merged = dict(stats)
+    for key, value in more.items():
+        if key == "valid":
+            merged[key] = merged.get(key, True) and value
+        elif key == "truncated":
+            merged[key] = merged.get(key, False) or value
+        else:
+            merged[key] = merged.get(key, 0) + value
+    return merged
+
+
+def summarize_stats(all_stats):
+    """Aggregate per-file validation stats into batch totals."""
+    totals = {
+        "files": 0,
+        "cards": 0,
+        "discarded_lines": 0,
+        "malformed_lines": 0,
+        "repaired_lines": 0,
+        "truncated_files": 0,
+        "followup_requests": 0,
+        "failed_followups": 0,
+        "invalid_files": 0,
+        "text_pages": 0,
+        "uploaded_pages": 0,
+        "reused_pages": 0,
+        "retry_pages": 0
+    }
+    for stats in all_stats:
+        if not stats:
+            continue
+        totals["files"] += 1
+        totals["cards"] += stats["cards"]
+        totals["discarded_lines"] += stats["discarded_lines"]
+        totals["malformed_lines"] += stats["malformed_lines"]
+        totals["repaired_lines"] += stats["repaired_lines"]
+        totals["truncated_files"] += 1 if stats["continuations"] or stats["truncated"] else 0
+        totals["followup_requests"] += stats["followup_requests"]
+        totals["failed_followups"] += stats.get("failed_followups", 0)
+        totals["invalid_files"] += 0 if stats["valid"] else 1
+        totals["text_pages"] += stats.get("text_pages", 0)
+        totals["uploaded_pages"] += stats.get("uploaded_pages", 0)
+        totals["reused_pages"] += stats.get("reused_pages", 0)
+        totals["retry_pages"] += stats.get("retry_pages", 0)
+    return totals
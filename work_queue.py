@@ -0,0 +1,273 @@
+#!/usr/bin/env python3
+"""
+RemNote Distributed Work Queue
+-----------------------------
+A SQLite work queue shared by a coordinator and any number of worker
+processes, possibly on different hosts with their own API keys:
+
+- the coordinator enqueues a folder's files (largest first) and waits
+- workers lease one file at a time; a lease is invisible to other workers
+  until its visibility timeout expires, and is kept alive by a heartbeat
+  while the file is being processed
+- a worker that dies simply stops renewing its leases, so its files are
+  handed to another worker; files whose lease keeps expiring are failed
+
+The database must live on a volume every host can reach with working file
+locks. WAL mode needs shared memory between processes, so the queue uses a
+rollback journal, which also works on network filesystems that lock.
+"""
+
+import os
+import time
+import socket
+import sqlite3
+import threading
+import contextlib
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS queues (
+    name TEXT PRIMARY KEY,
+    source_dir TEXT NOT NULL,
+    output_dir TEXT NOT NULL,
+    prompt_hash TEXT NOT NULL,
+    created REAL NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS items (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    queue TEXT NOT NULL,
+    file_path TEXT NOT NULL,
+    output_file TEXT NOT NULL,
+    priority REAL NOT NULL DEFAULT 0,
+    status TEXT NOT NULL,
+    owner TEXT,
+    lease_expires REAL,
+    leases INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    updated REAL NOT NULL,
+    UNIQUE (queue, file_path)
+);
+CREATE INDEX IF NOT EXISTS items_queue_status ON items (queue, status, priority);
+"""
+
+# Item states
+PENDING = 'pending'
+LEASED = 'leased'
+DONE = 'done'
+FAILED = 'failed'
+
+# Seconds a leased item stays invisible to other workers without a heartbeat
+DEFAULT_VISIBILITY_TIMEOUT = 120
+
+# Leases an item may take before it is failed instead of handed out again
+DEFAULT_MAX_LEASES = 3
+
+
+def worker_id():
+    """Identify this worker process across hosts."""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+class WorkQueue:
+    """Lease-based work queue stored in a SQLite database."""
+
+    def __init__(self, path):
+        self.path = path
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+
+        with self._connect() as conn:
+            conn.execute('PRAGMA journal_mode=DELETE')
+            conn.executescript(SCHEMA)
+
+    @contextlib.contextmanager
+    def _connect(self):
+        """Open a connection; connections are cheap and never shared between threads."""
+        conn = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        """Run statements in a write transaction (BEGIN IMMEDIATE serialises writers)."""
+        with self._connect() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                yield conn
+                conn.execute('COMMIT')
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+
+    # Queues
+
+    def create_queue(self, name, source_dir, output_dir, prompt_hash):
+        """Create or update a named queue (one per source folder)."""
+        now = time.time()
+        with self._transaction() as conn:
+            conn.execute(
+                'INSERT INTO queues (name, source_dir, output_dir, prompt_hash, created, updated) '
+                'VALUES (?, ?, ?, ?, ?, ?) '
+                'ON CONFLICT (name) DO UPDATE SET source_dir = excluded.source_dir, '
+                'output_dir = excluded.output_dir, prompt_hash = excluded.prompt_hash, updated = excluded.updated',
+                (name, source_dir, output_dir, prompt_hash, now, now)
+            )
+
+    def get_queue(self, name):
+        """Return a queue record as a dict, or None."""
+        with self._connect() as conn:
+            row = conn.execute('SELECT * FROM queues WHERE name = ?', (name,)).fetchone()
+        return dict(row) if row else None
+
+    def enqueue(self, name, items):
+        """Queue ``(file_path, output_file, priority)`` items; higher priority is leased first.
+
+        Items already queued are reset to pending unless a worker currently
+        holds a live lease on them. Returns the number of items queued.
+        """
+        now = time.time()
+        queued = 0
+        with self._transaction() as conn:
+            for file_path, output_file, priority in items:
+                cursor = conn.execute(
+                    'INSERT INTO items (queue, file_path, output_file, priority, status, updated) '
+                    'VALUES (?, ?, ?, ?, ?, ?) '
+                    'ON CONFLICT (queue, file_path) DO UPDATE SET output_file = excluded.output_file, '
+                    'priority = excluded.priority, status = excluded.status, owner = NULL, '
+                    'lease_expires = NULL, leases = 0, error = NULL, updated = excluded.updated '
+                    'WHERE items.status != ? OR items.lease_expires <= ?',
+                    (name, file_path, output_file, priority, PENDING, now, LEASED, now)
+                )
+                queued += cursor.rowcount
+        return queued
+
+    # Leases
+
+    def lease(self, name, owner, visibility_timeout=DEFAULT_VISIBILITY_TIMEOUT, max_leases=DEFAULT_MAX_LEASES):
+        """Lease the highest-priority available item, or return None.
+
+        Items whose lease expired are available again; once an item has been
+        leased ``max_leases`` times without finishing it is marked failed.
+        """
+        now = time.time()
+        with self._transaction() as conn:
+            conn.execute(
+                'UPDATE items SET status = ?, owner = NULL, error = ?, updated = ? '
+                'WHERE queue = ? AND status = ? AND lease_expires <= ? AND leases >= ?',
+                (FAILED, f'lease expired {max_leases} times', now, name, LEASED, now, max_leases)
+            )
+            row = conn.execute(
+                'SELECT * FROM items WHERE queue = ? AND (status = ? OR (status = ? AND lease_expires <= ?)) '
+                'ORDER BY priority DESC, id LIMIT 1',
+                (name, PENDING, LEASED, now)
+            ).fetchone()
+            if row is None:
+                return None
+            conn.execute(
+                'UPDATE items SET status = ?, owner = ?, lease_expires = ?, leases = leases + 1, updated = ? '
+                'WHERE id = ?',
+                (LEASED, owner, now + visibility_timeout, now, row['id'])
+            )
+        item = dict(row)
+        item.update(status=LEASED, owner=owner, leases=row['leases'] + 1)
+        return item
+
+    def extend(self, item_ids, owner, visibility_timeout=DEFAULT_VISIBILITY_TIMEOUT):
+        """Renew leases still held by ``owner``; returns the ids that were renewed."""
+        now = time.time()
+        renewed = []
+        with self._transaction() as conn:
+            for item_id in item_ids:
+                cursor = conn.execute(
+                    'UPDATE items SET lease_expires = ?, updated = ? WHERE id = ? AND owner = ? AND status = ?',
+                    (now + visibility_timeout, now, item_id, owner, LEASED)
+                )
+                if cursor.rowcount:
+                    renewed.append(item_id)
+        return renewed
+
+    def complete(self, item_id, owner, error=None):
+        """Mark a leased item done (or failed with ``error``).
+
+        Returns False when the lease was lost to another worker meanwhile.
+        """
+        with self._transaction() as conn:
+            cursor = conn.execute(
+                'UPDATE items SET status = ?, owner = NULL, lease_expires = NULL, error = ?, updated = ? '
+                'WHERE id = ? AND owner = ? AND status = ?',
+                (FAILED if error else DONE, error, time.time(), item_id, owner, LEASED)
+            )
+        return cursor.rowcount > 0
+
+    def release(self, item_id, owner):
+        """Hand a leased item back without counting the lease against it."""
+        with self._transaction() as conn:
+            conn.execute(
+                'UPDATE items SET status = ?, owner = NULL, lease_expires = NULL, leases = MAX(leases - 1, 0), '
+                'updated = ? WHERE id = ? AND owner = ? AND status = ?',
+                (PENDING, time.time(), item_id, owner, LEASED)
+            )
+
+    # Progress
+
+    def counts(self, name):
+        """Return the number of items per state."""
+        counts = {PENDING: 0, LEASED: 0, DONE: 0, FAILED: 0}
+        with self._connect() as conn:
+            for row in conn.execute('SELECT status, COUNT(*) AS n FROM items WHERE queue = ? GROUP BY status',
+                                    (name,)):
+                counts[row['status']] = row['n']
+        return counts
+
+    def iter_items(self, name, status=None):
+        """Yield a queue's items, optionally only those in one state."""
+        query = 'SELECT * FROM items WHERE queue = ?'
+        params = [name]
+        if status:
+            query += ' AND status = ?'
+            params.append(status)
+        with self._connect() as conn:
+            for row in conn.execute(query + ' ORDER BY id', params):
+                yield dict(row)
+
+
+class LeaseHeartbeat:
+    """Background thread renewing the leases a worker process holds."""
+
+    def __init__(self, queue, owner, visibility_timeout=DEFAULT_VISIBILITY_TIMEOUT):
+        self.queue = queue
+        self.owner = owner
+        self.visibility_timeout = visibility_timeout
+        self._held = set()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='lease-heartbeat', daemon=True)
+        self._thread.start()
+
+    def add(self, item_id):
+        with self._lock:
+            self._held.add(item_id)
+
+    def discard(self, item_id):
+        with self._lock:
+            self._held.discard(item_id)
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        # Renew well before expiry so one slow database write can't lose a lease
+        while not self._stop.wait(self.visibility_timeout / 3):
+            with self._lock:
+                held = list(self._held)
+            if not held:
+                continue
+            try:
+                self.queue.extend(held, self.owner, self.visibility_timeout)
+            except sqlite3.Error:
+                # Try again on the next beat; the lease only lapses after several misses
+                pass
@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+"""
+RemNote Shared Worker Pool
+-------------------------
+An application-wide thread pool with a global concurrency cap and
+fair-share scheduling between queues. Each web request (or any other
+caller) submits work under its own key; whenever a worker frees up it
+takes the next item from the queue with the fewest tasks already
+running, so one 200-file upload cannot starve a 1-file request.
+"""
+
+import threading
+import collections
+import concurrent.futures
+
+
+class FairWorkerPool:
+    """Fixed-size thread pool that shares workers fairly between keys."""
+
+    def __init__(self, max_workers=5, thread_name_prefix='flashcard-worker'):
+        if max_workers < 1:
+            raise ValueError("max_workers must be at least 1")
+
+        self.max_workers = max_workers
+        self._thread_name_prefix = thread_name_prefix
+        self._queues = collections.OrderedDict()
+        self._running = collections.Counter()
+        self._condition = threading.Condition()
+        self._threads = []
+        self._shutdown = False
+
+    def submit(self, key, fn, *args, **kwargs):
+        """Queue ``fn(*args, **kwargs)`` under ``key`` and return a Future."""
+        future = concurrent.futures.Future()
+        with self._condition:
+            if self._shutdown:
+                raise RuntimeError("cannot submit to a pool that has been shut down")
+
+            self._queues.setdefault(key, collections.deque()).append((future, fn, args, kwargs))
+            self._start_worker_locked()
+            self._condition.notify()
+        return future
+
+    def cancel(self, key):
+        """Cancel every queued (not yet running) item for a key."""
+        with self._condition:
+            items = self._queues.pop(key, ())
+        cancelled = 0
+        for future, _, _, _ in items:
+            if future.cancel():
+                cancelled += 1
+        return cancelled
+
+    def stats(self):
+        """Return queue depth and running counts for monitoring."""
+        with self._condition:
+            queues = {
+                str(key): {"queued": len(items), "running": self._running[key]}
+                for key, items in self._queues.items()
+            }
+            for key, running in self._running.items():
+                if running and str(key) not in queues:
+                    queues[str(key)] = {"queued": 0, "running": running}
+
+            return {
+                "max_workers": self.max_workers,
+                "threads": len(self._threads),
+                "running": sum(self._running.values()),
+                "queued": sum(len(items) for items in self._queues.values()),
+                "queues": queues
+            }
+
+    def shutdown(self, wait=True, cancel_futures=False):
+        """Stop accepting work; optionally cancel queued items and wait for workers."""
+        with self._condition:
+            self._shutdown = True
+            if cancel_futures:
+                pending = [item for items in self._queues.values() for item in items]
+                self._queues.clear()
+            else:
+                pending = []
+            self._condition.notify_all()
+            threads = list(self._threads)
+
+        for future, _, _, _ in pending:
+            future.cancel()
+
+        if wait:
+            for thread in threads:
+                thread.join()
+
+    def _start_worker_locked(self):
+        """Start another worker thread if the cap allows and work is waiting."""
+        idle = len(self._threads) - sum(self._running.values())
+        queued = sum(len(items) for items in self._queues.values())
+        if queued > idle and len(self._threads) < self.max_workers:
+            thread = threading.Thread(
+                target=self._worker,
+                name=f"{self._thread_name_prefix}-{len(self._threads)}",
+                daemon=True
+            )
+            self._threads.append(thread)
+            thread.start()
+
+    def _next_item_locked(self):
+        """Pop the next item from the queue with the fewest running tasks."""
+        best_key = None
+        for key, items in self._queues.items():
+            if items and (best_key is None or self._running[key] < self._running[best_key]):
+                best_key = key
+
+        if best_key is None:
+            return None, None
+
+        items = self._queues[best_key]
+        item = items.popleft()
+        if items:
+            # Rotate so keys with equal shares take turns
+            self._queues.move_to_end(best_key)
+        else:
+            del self._queues[best_key]
+        return best_key, item
+
+    def _worker(self):
+        """Worker loop: take the fairest next item and run it."""
+        while True:
+            with self._condition:
+                key, item = self._next_item_locked()
+                while item is None:
+                    if self._shutdown:
+                        return
+                    self._condition.wait()
+                    key, item = self._next_item_locked()
+                self._running[key] += 1
+
+            future, fn, args, kwargs = item
+            try:
+                if future.set_running_or_notify_cancel():
+                    try:
+                        future.set_result(fn(*args, **kwargs))
+                    except BaseException as exc:
+                        future.set_exception(exc)
+            finally:
+                with self._condition:
+                    self._running[key] -= 1
+                    if not self._running[key]:
+                        del self._running[key]
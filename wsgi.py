@@ -0,0 +1,12 @@
+#!/usr/bin/env python3
+"""
+WSGI entry point for the RemNote Flashcard Generator web application.
+
+Run with a multi-worker server, for example:
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+"""
+
+from app import create_app
+
+app = create_app()